@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18 October, 2026
+
+Compare the CPU engine (engine.py) with myokit.SimulationOpenCL on a small
+branch geometry. Reports activation times at x1 and x2, and the largest
+differences in activation time (over all cells) and voltage with the CPU
+engine. The CPU engine is also compared with itself at a smaller time step,
+which does not require OpenCL.
+
+@author: tbury
+"""
+
+import numpy as np
+import pandas as pd
+import time
+
+import myokit as myokit
+
+import tyro
+from dataclasses import dataclass
+
+from engine import SimulationCPU
+from funs import get_geometry, edges_to_connections, cells_in
+
+
+@dataclass
+class Args:
+    model: str = "../mmt_files/br-1977-opencl.mmt"
+    """mmt file of the cell model"""
+    variable: str = "membrane.V"
+    """membrane potential variable to compare"""
+    active_thresh: float = 0.5
+    """threshold in membrane potential to register as active"""
+    conductance: float = 1
+    """Cell-to-cell conductance"""
+    dt: float = 2e-3
+    """integration time step"""
+    stim_duration: float = 2
+    """duration of stimulus applied to the paced cells"""
+    double_precision: bool = False
+    """whether to run the OpenCL simulation in double precision"""
+    refine: int = 4
+    """factor by which dt is reduced for the CPU reference run"""
+    tmax: float = 150
+    """time to run simulation up to"""
+    log_interval: float = 0.5
+    """how often to log system (number of time units)"""
+    l1: int = 40
+    """length of horizontal channel before and after junction"""
+    w1: int = 10
+    """width of horizontal channel"""
+    h: int = 20
+    """height of the diagonal channel"""
+    w2: int = 10
+    """width of diagonal channel"""
+    theta: int = 150
+    """angle of diagonal channel"""
+    stim_width: int = 5
+    """width of area in which to stimulate"""
+    x1: int = 10
+    """left location of where to record activation time"""
+    x2: int = 70
+    """right location of where to record activation time"""
+
+
+args = tyro.cli(Args)
+print(args)
+
+# Geometry
+rows = np.s_[args.h : args.h + args.w1]
+geometry = get_geometry(
+    "mesh_single_branch_2",
+    l1=args.l1,
+    w1=args.w1,
+    h=args.h,
+    w2=args.w2,
+    theta=args.theta,
+    prune_from=[args.h, args.h + args.w1, 0, args.stim_width],
+)
+labels = geometry["labels"]
+ncells = len(geometry["coords"])
+connections = edges_to_connections(
+    geometry["src"], geometry["dst"], conductance=args.conductance
+)
+list_cells_pace = cells_in(labels, (rows, np.s_[: args.stim_width])).tolist()
+cells_x1 = cells_in(labels, (rows, args.x1))
+cells_x2 = cells_in(labels, (rows, args.x2))
+print(f"Geometry has {ncells} cells")
+
+# Model and protocol (starting from the initial state of the model file)
+m = myokit.load_model(args.model)
+p = myokit.Protocol()
+p.schedule(1, 15, args.stim_duration)
+
+
+def run(s, dt):
+    """Run simulation s and return voltage array (n_times, ncells) and timing"""
+
+    s.set_connections(connections)
+    s.set_step_size(step_size=dt)
+    s.set_paced_cell_list(list_cells_pace)
+    tic = time.perf_counter()
+    log = s.run(
+        args.tmax,
+        log_interval=args.log_interval,
+        log=["engine.time", args.variable],
+    )
+    toc = time.perf_counter()
+    v = np.array([log[f"{i}.{args.variable}"] for i in range(ncells)]).T
+    return np.array(log["engine.time"]), v, toc - tic
+
+
+def get_active_time(t, v, list_idx):
+    """First time the mean voltage over cells list_idx exceeds threshold"""
+
+    v_mean = v[:, list_idx].mean(axis=1)
+    active = np.nonzero(v_mean > args.active_thresh)[0]
+    return t[active[0]] if len(active) else np.nan
+
+
+def get_cell_active_times(t, v):
+    """First upward threshold crossing of each cell, interpolated between logs"""
+
+    above = v > args.active_thresh
+    first = np.argmax(above, axis=0)
+    t_active = np.full(v.shape[1], np.nan)
+    for i in np.nonzero(above.any(axis=0) & (first > 0))[0]:
+        k = first[i]
+        frac = (args.active_thresh - v[k - 1, i]) / (v[k, i] - v[k - 1, i])
+        t_active[i] = t[k - 1] + frac * (t[k] - t[k - 1])
+    return t_active
+
+
+runs = {}
+runs["cpu"] = run(SimulationCPU(m, p, ncells=ncells), args.dt)
+runs["cpu_fine"] = run(SimulationCPU(m, p, ncells=ncells), args.dt / args.refine)
+try:
+    s_opencl = myokit.SimulationOpenCL(
+        m,
+        p,
+        ncells=ncells,
+        diffusion=True,
+        precision=64 if args.double_precision else 32,
+    )
+    runs["opencl"] = run(s_opencl, args.dt)
+except Exception as e:
+    print(f"OpenCL simulation not available ({e})")
+
+t_ref, v_ref, _ = runs["cpu"]
+t_active_ref = get_cell_active_times(t_ref, v_ref)
+list_dict = []
+for name, (t, v, runtime) in runs.items():
+    n = min(len(t), len(t_ref))
+    t_active = get_cell_active_times(t, v)
+    list_dict.append(
+        dict(
+            engine=name,
+            runtime=runtime,
+            active_x1=get_active_time(t, v, cells_x1),
+            active_x2=get_active_time(t, v, cells_x2),
+            max_abs_diff_active=np.nanmax(np.abs(t_active - t_active_ref)),
+            mismatch_active=int((np.isnan(t_active) != np.isnan(t_active_ref)).sum()),
+            max_abs_diff_cpu=np.abs(v[:n] - v_ref[:n]).max(),
+        )
+    )
+
+df = pd.DataFrame(list_dict)
+print(df.to_string(index=False))
@@ -0,0 +1,818 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18 October, 2026
+
+CPU reaction-diffusion engine for simulations on branch geometry.
+Mirrors the parts of myokit.SimulationOpenCL used by the sim_branch scripts.
+
+@author: tbury
+"""
+
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from scipy import sparse
+from scipy.sparse import linalg
+
+import myokit
+
+from funs import get_laplacian
+from codegen import get_rhs, get_gates
+
+# Time stepping of the diffusion current: explicit (part of the reaction step),
+# or a separate implicit step after the reaction step (operator splitting)
+DIFFUSION = ["explicit", "backward_euler", "crank_nicolson"]
+
+# Solvers of the implicit diffusion step: sparse LU factorization or conjugate
+# gradients (for meshes too large to factorize)
+DIFFUSION_SOLVERS = ["splu", "cg"]
+
+# Floating point precision of the state: all float64, all float32, or float32
+# gates and diffusion with float64 for the other states
+PRECISIONS = ["double", "single", "mixed"]
+
+# The range of active cells starts and ends at multiples of this many cells,
+# so that it changes only every few updates of the active set
+ACTIVE_BLOCK = 256
+
+
+class SimulationCPU:
+    """Simulate a model on a network of connected cells on the CPU
+
+    All cells are integrated at once as an (n_states, n_cells) array with
+    forward Euler, or with the Rush-Larsen method, which uses the exact
+    exponential update for gating variables (see codegen.py). The diffusion
+    current of each cell is sum_j g_ij (V_i - V_j), computed as a sparse
+    Laplacian product, as in myokit.SimulationOpenCL.
+
+    With an implicit diffusion scheme, each step is split into a reaction step
+    without diffusion current and a diffusion step of the membrane potential,
+    solved with backward Euler or Crank-Nicolson. The stable step size then no
+    longer depends on the conductance. The matrix of the diffusion step is
+    factorized once per step size (splu), or solved iteratively with a Jacobi
+    preconditioned conjugate gradient method (cg).
+
+    With adaptive steps (see set_adaptive), each step is compared with two
+    half steps, and the step size is halved or doubled to keep the error in
+    the membrane potential below a tolerance. Steps then grow at rest and
+    shrink during upstrokes. Activation times can be recorded in all modes
+    (see set_activation_threshold).
+
+    In single precision, states, constants and the Laplacian are float32. In
+    mixed precision, only the gating variables and the diffusion current are
+    float32: gates are bounded in [0, 1] and relax to their steady state, so
+    rounding errors do not accumulate, whereas the membrane potential and the
+    concentrations drift slowly and keep float64 so that small increments are
+    not lost. The states are then stored as a float64 and a float32 array.
+    With the numpy backend, the gate updates are also evaluated in float32
+    (see codegen.generate_rhs_source), from a float32 copy of the membrane
+    potential; with numba, they are promoted to float64 and mixed precision
+    only saves memory.
+
+    With several threads, the cells are split into contiguous blocks (e.g.
+    bands of mesh rows, see funs.row_partition), and each thread computes the
+    reaction step of one block. The diffusion current of a block uses the
+    rows of the Laplacian of its cells, applied to the membrane potential of
+    its cells and its halo (the cells of other blocks they are connected
+    to), gathered from a copy of the membrane potential taken before any
+    block is updated. NumPy and SciPy release the GIL in whole-array
+    operations, so blocks of more than a few thousand cells can run in
+    parallel, but the speedup over cores has not been measured (see
+    bench_threads.py in simulate_ord).
+
+    With an active set (see set_active_set), only the cells that are
+    depolarized, recovering, paced, or driven by a diffusion current, and
+    their neighbours, are stepped with the step size. The other cells are at
+    rest, and take one coarse step every few steps, at which the active set
+    is updated. In a planar wave on a long mesh, most cells are at rest ahead
+    of or behind the wave, and are only evaluated at the coarse steps.
+
+    Args:
+        model: myokit.Model with variables bound to pace and diffusion_current
+        protocol: myokit.Protocol applied to the paced cells
+        ncells: number of cells
+        backend: right-hand side kernel, "numpy" or "numba" (see codegen.py)
+        integrator: "euler" or "rush_larsen"
+        diffusion: "explicit", "backward_euler" or "crank_nicolson"
+        diffusion_solver: "splu" or "cg", for implicit diffusion
+        precision: "double", "single" or "mixed"
+        nthreads: number of threads of the reaction step
+    """
+
+    def __init__(
+        self,
+        model,
+        protocol=None,
+        ncells=1,
+        backend="numpy",
+        integrator="euler",
+        diffusion="explicit",
+        diffusion_solver="splu",
+        precision="double",
+        nthreads=1,
+    ):
+        if diffusion not in DIFFUSION:
+            raise ValueError(f"Unknown diffusion {diffusion}, choose from {DIFFUSION}")
+        if diffusion_solver not in DIFFUSION_SOLVERS:
+            raise ValueError(
+                f"Unknown diffusion solver {diffusion_solver}, "
+                f"choose from {DIFFUSION_SOLVERS}"
+            )
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision {precision}, choose from {PRECISIONS}")
+        self._backend = backend
+        self._integrator = integrator
+        self._diffusion = diffusion
+        self._diffusion_solver = diffusion_solver
+        self._precision = precision
+        self._nthreads = nthreads
+        self._model = model.clone()
+        self._model.validate()
+        self._protocol = protocol
+        self._ncells = ncells
+        self._nstates = self._model.count_states()
+
+        # Index of membrane potential in state
+        vm = self._model.label("membrane_potential")
+        if vm is None:
+            raise ValueError("model has no variable labelled membrane_potential")
+        self._iv = vm.index()
+
+        # Rate of change of the membrane potential per unit diffusion current
+        y0 = self._model.initial_values(as_floats=True)
+        inputs = {"pace": 0.0, "diffusion_current": 0.0}
+        dv0 = self._model.evaluate_derivatives(y0, inputs)[self._iv]
+        inputs["diffusion_current"] = 1.0
+        dv1 = self._model.evaluate_derivatives(y0, inputs)[self._iv]
+        self._diffusion_rate = dv0 - dv1
+
+        # Solvers of the implicit diffusion step, for each step size
+        self._diffusion_solvers = {}
+        self.cg_tol = 1e-8
+
+        # Arrays in which the states are stored, as (dtype, state indices), and
+        # the (array, row) of each state
+        states = list(self._model.states())
+        if precision == "mixed":
+            gates = {var for var, _, _ in get_gates(self._model)}
+            self._blocks = [
+                (np.float64, [i for i, var in enumerate(states) if var not in gates]),
+                (np.float32, [i for i, var in enumerate(states) if var in gates]),
+            ]
+            self._blocks = [block for block in self._blocks if block[1]]
+        else:
+            dtype = np.float32 if precision == "single" else np.float64
+            self._blocks = [(dtype, list(range(self._nstates)))]
+        self._layout = [None] * self._nstates
+        for b, (_, rows) in enumerate(self._blocks):
+            for r, i in enumerate(rows):
+                self._layout[i] = (b, r)
+        # Float type of the constants and the diffusion current
+        self._dtype = np.float64 if precision == "double" else np.float32
+
+        self._rhs, constants = get_rhs(
+            self._model,
+            backend,
+            integrator=integrator,
+            layout=self._layout if len(self._blocks) > 1 else None,
+            float32_gates=precision == "mixed" and backend == "numpy",
+        )
+        self._constant_index = {qname: i for i, qname in enumerate(constants)}
+        self._constants = np.array(
+            [self._model.get(qname).eval() for qname in constants],
+            dtype=self._dtype if precision == "single" else float,
+        )
+
+        # Values of constants that differ between cells
+        self._fields = {}
+
+        self._laplacian = sparse.csr_matrix((ncells, ncells), dtype=self._dtype)
+        self._paced = np.zeros(ncells, dtype=bool)
+        self._paced[:5] = True
+        self._step_size = 0.005
+        self._time = 0.0
+
+        # Adaptive step size control (off by default)
+        self._abs_tol = None
+        self._max_step_size = None
+
+        # Recording of activation times (off by default)
+        self._activation_thresh = None
+        self._activation_times = np.full(ncells, np.nan)
+
+        # Active set integration (off by default)
+        self._v_rest = None
+        self._v_tol = None
+        self._rate_tol = None
+        self._coarse_steps = 1
+
+        self._counts = dict(steps=0, rejected=0, rhs_evaluations=0, cell_evaluations=0)
+
+        # Boundaries of the blocks of cells of each thread (equal blocks by
+        # default), and the blocks with their local Laplacian and halo
+        self._bounds = None
+        self._parts = None
+
+        self._default_state = np.tile(
+            np.array(self._model.initial_values(as_floats=True))[:, None],
+            (1, ncells),
+        )
+        self._state = self._to_blocks(self._default_state)
+
+    def set_connections(self, connections):
+        """Set connections from a list of (cell1, cell2, conductance) tuples"""
+
+        connections = np.asarray(connections, dtype=float).reshape(-1, 3)
+        src = connections[:, 0].astype(np.int64)
+        dst = connections[:, 1].astype(np.int64)
+        self.set_laplacian(
+            get_laplacian(src, dst, self._ncells, conductance=connections[:, 2])
+        )
+
+    def set_laplacian(self, laplacian):
+        """Set the (ncells, ncells) weighted Laplacian of the connections"""
+        self._laplacian = sparse.csr_matrix(laplacian, dtype=self._dtype)
+        self._diffusion_solvers = {}
+        self._parts = None
+
+    def _diffusion_step(self, v, h):
+        """Membrane potential v after an implicit diffusion step of size h
+
+        Solves (I + theta A) v_new = (I - (1 - theta) A) v, with A the Laplacian
+        scaled by h and the diffusion rate, and theta 1 (backward Euler) or 1/2
+        (Crank-Nicolson).
+        """
+
+        theta = 1.0 if self._diffusion == "backward_euler" else 0.5
+        a = (h * self._diffusion_rate) * self._laplacian
+        b = v if theta == 1 else v - (1 - theta) * (a @ v)
+
+        key = round(h, 12)
+        solve = self._diffusion_solvers.get(key)
+        if solve is None:
+            if len(self._diffusion_solvers) > 8:
+                # Only keep solvers of recent step sizes (steps shortened at
+                # protocol events each have their own size)
+                self._diffusion_solvers = {}
+            matrix = (sparse.identity(self._ncells) + theta * a).tocsc()
+            if self._diffusion_solver == "splu":
+                solve = linalg.splu(matrix).solve
+            else:
+                solve = self._cg_solver(matrix)
+            self._diffusion_solvers[key] = solve
+
+        return solve(b)
+
+    def _cg_solver(self, matrix):
+        """Function solving matrix @ x = b by Jacobi preconditioned CG"""
+
+        inv_diag = 1 / matrix.diagonal()
+        precond = linalg.LinearOperator(matrix.shape, matvec=lambda x: inv_diag * x)
+        matrix = matrix.tocsr()
+
+        def solve(b):
+            # Start from b, which is close to the solution for small steps
+            x, info = linalg.cg(matrix, b, x0=b, rtol=self.cg_tol, atol=0, M=precond)
+            if info != 0:
+                raise myokit.SimulationError("CG diffusion solver did not converge")
+            return x
+
+        return solve
+
+    def set_constant(self, var, value):
+        """Change the value of a literal constant"""
+        if isinstance(var, myokit.Variable):
+            var = var.qname()
+        self._constants[self._constant_index[var]] = value
+
+    def set_field(self, var, values):
+        """Replace a literal constant by an array of values for each cell"""
+        if isinstance(var, myokit.Variable):
+            var = var.qname()
+        values = np.asarray(values, dtype=float).ravel()
+        if values.size != self._ncells:
+            raise ValueError("field must have one value for each cell")
+        self._fields[self._constant_index[var]] = values
+
+    def set_partition(self, bounds):
+        """Set the blocks of cells of the threads, as boundaries of contiguous
+        index ranges (see funs.row_partition)"""
+        bounds = np.asarray(bounds, dtype=np.int64)
+        if bounds[0] != 0 or bounds[-1] != self._ncells or np.any(np.diff(bounds) < 0):
+            raise ValueError("bounds must increase from 0 to ncells")
+        self._bounds = bounds
+        self._parts = None
+
+    def _partition(self):
+        """Blocks of cells as (cells, local Laplacian, halo), with the local
+        Laplacian acting on the membrane potential of the cells in halo"""
+        if self._parts is None:
+            bounds = self._bounds
+            if bounds is None:
+                bounds = np.linspace(0, self._ncells, self._nthreads + 1)
+                bounds = bounds.round().astype(np.int64)
+            self._parts = []
+            for start, stop in zip(bounds[:-1], bounds[1:]):
+                if stop == start:
+                    continue
+                laplacian = self._laplacian[start:stop]
+                halo = np.unique(laplacian.indices)
+                self._parts.append(
+                    (slice(start, stop), laplacian[:, halo].tocsr(), halo)
+                )
+        return self._parts
+
+    def set_paced_cell_list(self, cells):
+        """Set the indices of the cells that receive the pacing stimulus"""
+        self._paced[:] = False
+        self._paced[np.asarray(cells, dtype=np.int64)] = True
+
+    def set_protocol(self, protocol=None):
+        self._protocol = protocol
+
+    def set_step_size(self, step_size=0.005):
+        self._step_size = float(step_size)
+
+    def step_size(self):
+        return self._step_size
+
+    def set_adaptive(self, abs_tol=None, max_step_size=None):
+        """Use adaptive step sizes, or fixed steps if abs_tol is None
+
+        Step sizes are the step size (set_step_size) times a power of 2, so
+        the step size is the smallest step. The largest step defaults to 64
+        times the step size, and is limited by the stability of explicit
+        diffusion.
+
+        Args:
+            abs_tol: tolerance on the error in membrane potential per step,
+                estimated from the difference between a full step and two
+                half steps
+            max_step_size: largest step size
+        """
+        self._abs_tol = abs_tol
+        self._max_step_size = max_step_size
+
+    def set_active_set(self, v_rest=None, v_tol=1.0, rate_tol=None, coarse_steps=8):
+        """Only step the cells near a wavefront with the step size
+
+        Cells are active if their membrane potential is more than v_tol from
+        the resting potential (depolarized or recovering), if their diffusion
+        current changes it by more than rate_tol per unit time, or if they are
+        paced during a stimulus, and so are the cells connected to them. The
+        other cells take one step of coarse_steps times the step size (capped
+        by the stability of explicit diffusion), after which the active set
+        is updated. Requires fixed steps, explicit diffusion and one thread.
+
+        This only pays off on large meshes that are mostly at rest, where the
+        wavefront covers a small fraction of the cells. On the default branch
+        geometries of the sim scripts (a few thousand cells, most of them
+        excited during a run) it runs at 0.6x to 1.1x the speed of stepping
+        all cells. In bench_active_set.py (FHN, planar wave) it breaks even
+        at about 4600 cells (a channel about 400 cells long), and the speedup
+        grows with mesh length: 1.7x at 1e4 cells and 2.2x at 2e4 cells.
+
+        Args:
+            v_rest: resting potential (scalar or one value per cell), or None
+                to step all cells with the step size
+            v_tol: largest distance from v_rest of cells at rest
+            rate_tol: largest rate of change of the membrane potential from
+                the diffusion current of cells at rest (defaults to v_tol)
+            coarse_steps: number of steps per step of the cells at rest
+        """
+        self._v_rest = None if v_rest is None else np.asarray(v_rest, dtype=float)
+        self._v_tol = v_tol
+        self._rate_tol = v_tol if rate_tol is None else rate_tol
+        self._coarse_steps = max(1, int(coarse_steps))
+
+    def set_activation_threshold(self, thresh=None):
+        """Record the first time the membrane potential of each cell crosses
+        thresh upwards (None to stop recording)"""
+        self._activation_thresh = thresh
+        self._activation_times = np.full(self._ncells, np.nan)
+
+    def activation_times(self):
+        """First time the membrane potential of each cell crossed the threshold
+        (NaN if it did not), linearly interpolated within steps"""
+        return self._activation_times.copy()
+
+    def statistics(self):
+        """Number of steps, rejected steps, right-hand side evaluations, and
+        right-hand side evaluations of single cells"""
+        return dict(self._counts)
+
+    def _state_array(self, state):
+        state = np.asarray(state, dtype=float)
+        if state.size == self._nstates:
+            return np.tile(state.reshape(-1, 1), (1, self._ncells))
+        if state.size == self._nstates * self._ncells:
+            # Cell-major ordering, as used by myokit.SimulationOpenCL
+            return state.reshape(self._ncells, self._nstates).T.copy()
+        raise ValueError("state must have n_states or n_states * ncells entries")
+
+    def _to_blocks(self, state):
+        """Split an (n_states, n_cells) array into the arrays of each precision"""
+        return [state[rows].astype(dtype) for dtype, rows in self._blocks]
+
+    def _from_blocks(self, blocks):
+        """Join the arrays of each precision into an (n_states, n_cells) array"""
+        state = np.empty((self._nstates, self._ncells))
+        for (_, rows), block in zip(self._blocks, blocks):
+            state[rows] = block
+        return state
+
+    def set_state(self, state):
+        """Set state of one cell (applied to all) or of all cells (cell-major)"""
+        self._state = self._to_blocks(self._state_array(state))
+
+    def set_default_state(self, state):
+        self._default_state = self._state_array(state)
+
+    def state(self):
+        """Current state of all cells as a flat cell-major list"""
+        return list(self._from_blocks(self._state).T.ravel())
+
+    def default_state(self):
+        return list(self._default_state.T.ravel())
+
+    def time(self):
+        return self._time
+
+    def set_time(self, time=0):
+        self._time = float(time)
+
+    def reset(self):
+        """Reset time and state to their defaults"""
+        self._time = 0.0
+        self._state = self._to_blocks(self._default_state)
+        self._activation_times = np.full(self._ncells, np.nan)
+
+    def pre(self, duration, progress=None):
+        """Run without logging, then use the final state as default state"""
+        self.run(duration, log=[], progress=progress)
+        self._default_state = self._from_blocks(self._state)
+        self._time = 0.0
+
+    def run(self, duration, log=None, log_interval=1.0, progress=None):
+        """Run the simulation for the given duration
+
+        Args:
+            duration: time to simulate
+            log: list of variables to log (states, or engine.time), defaults
+                to engine.time and the membrane potential, or myokit.LOG_NONE,
+                or a DataLog from a previous run to append to. States are
+                logged for all cells, or for one cell if given with its index
+                (e.g. 12.membrane.V)
+            log_interval: time between logged points
+            progress: optional myokit.ProgressReporter
+
+        Returns:
+            myokit.DataLog - with global entry engine.time and entries
+                <cell index>.<variable> for each logged state of each logged
+                cell
+        """
+
+        log, log_cells, log_previous = self._parse_log(log)
+        log_rows = [self._layout[var.index()] for var in log_cells]
+
+        pacing = myokit.PacingSystem(self._protocol) if self._protocol else None
+        paced = self._paced.astype(self._dtype)
+        zeros = np.zeros(self._ncells, dtype=self._dtype)
+        y = self._state
+        dy = [np.empty_like(block) for block in y]
+        rhs, c, laplacian = self._rhs, self._constants, self._laplacian
+        if self._fields or self._backend == "numba":
+            c = np.tile(c[:, None], (1, self._ncells))
+            for i, values in self._fields.items():
+                c[i] = values
+        (bv, iv), dt = self._layout[self._iv], self._step_size
+        # Kernels without a layout take a single array
+        args = (lambda ys: ys[0]) if len(y) == 1 else tuple
+        cast_v = self._precision == "mixed"
+        rush_larsen = self._integrator == "rush_larsen"
+        implicit = self._diffusion != "explicit"
+        record = self._activation_thresh is not None
+        counts = self._counts
+        active_set = self._v_rest is not None
+        if active_set and (self._abs_tol is not None or implicit or self._nthreads > 1):
+            raise ValueError(
+                "Active set integration requires fixed steps, explicit diffusion"
+                " and one thread"
+            )
+
+        # Blocks of cells of each thread, or all cells in one block, and the
+        # number of cells they contain
+        pool = None
+        parts = [(slice(None), laplacian, None)]
+        nstepped = self._ncells
+        if self._nthreads > 1:
+            parts = self._partition()
+            pool = ThreadPoolExecutor(self._nthreads)
+
+        def react(part, t, y, pace, h, out, v):
+            """Reaction step (with explicit diffusion current) of one block"""
+            cells, laplacian_part, halo = part
+            # Diffusion current, or none if diffusion is a separate step
+            if implicit:
+                i_diff = zeros[cells]
+            else:
+                i_diff = laplacian_part @ (v if halo is None else v[halo])
+            advance(cells, t, y, pace, i_diff, h, out)
+
+        def advance(cells, t, y, pace, i_diff, h, out):
+            """Reaction step of a slice of cells, given their diffusion current
+            (out None to only write the increments of the step to dy)"""
+            y_part = [block[:, cells] for block in y]
+            dy_part = [block[:, cells] for block in dy]
+            c_part = c[:, cells] if c.ndim == 2 else c
+            if rush_larsen:
+                rhs(t, args(y_part), pace[cells], i_diff, c_part, args(dy_part), h)
+            else:
+                rhs(t, args(y_part), pace[cells], i_diff, c_part, args(dy_part))
+            for b, (y_block, dy_block) in enumerate(zip(y_part, dy_part)):
+                np.multiply(dy_block, h, out=dy_block)
+                if out is not None:
+                    np.add(y_block, dy_block, out=out[b][:, cells])
+
+        def step(t, y, pace, h, out):
+            """Write the state after a step of size h from state y to out"""
+            v = None if implicit else y[bv][iv]
+            if cast_v:
+                v = v.astype(np.float32)
+            if pool is None:
+                react(parts[0], t, y, pace, h, out, v)
+            else:
+                # Blocks may update y in place, so the halos are gathered from
+                # a copy of the membrane potential
+                if v is not None and not cast_v:
+                    v = v.copy()
+                futures = [
+                    pool.submit(react, part, t, y, pace, h, out, v) for part in parts
+                ]
+                for future in futures:
+                    future.result()
+            if implicit:
+                out[bv][iv] = self._diffusion_step(out[bv][iv], h)
+            counts["rhs_evaluations"] += 1
+            counts["cell_evaluations"] += nstepped
+
+        if active_set:
+            v_rest = np.broadcast_to(self._v_rest, (self._ncells,))
+            # Cells connected to each cell (and the cell itself)
+            adjacency = abs(laplacian) + sparse.identity(
+                self._ncells, dtype=laplacian.dtype, format="csr"
+            )
+            coarse = self._coarse_steps
+            if laplacian.nnz:
+                # Stability limit of explicit diffusion (Gershgorin bound)
+                h_stable = 1 / (abs(self._diffusion_rate) * laplacian.diagonal().max())
+                coarse = max(1, min(coarse, int(h_stable / dt)))
+            t_coarse = self._time
+            resting = []
+
+        def finish_coarse(y):
+            """Add the increments of the coarse step to the cells at rest"""
+            for cells in resting:
+                for y_block, dy_block in zip(y, dy):
+                    y_block[:, cells] += dy_block[:, cells]
+
+        def update_active(t, y, pace, h):
+            """Update the active set, and start a coarse step of size h of the
+            cells at rest
+
+            The active cells are stepped as the range of cell indices spanning
+            them, and the cells before and after it as cells at rest. The
+            increments of the coarse step are computed from the state at its
+            start and added at its end (in finish_coarse), so that the active
+            cells next to them see the same state as with all cells stepped.
+            """
+            nonlocal parts, nstepped, resting
+            finish_coarse(y)
+            v = y[bv][iv]
+            i_diff = laplacian @ (v.astype(np.float32) if cast_v else v)
+            rate = np.abs(self._diffusion_rate * i_diff)
+            active = (np.abs(v - v_rest) > self._v_tol) | (rate > self._rate_tol)
+            active |= pace != 0
+            active = np.flatnonzero(adjacency @ active.astype(laplacian.dtype))
+            start, stop = 0, 0
+            if len(active):
+                start = active[0] // ACTIVE_BLOCK * ACTIVE_BLOCK
+                stop = -(-(active[-1] + 1) // ACTIVE_BLOCK) * ACTIVE_BLOCK
+                stop = min(stop, self._ncells)
+            resting = [
+                cells
+                for cells in [slice(0, start), slice(stop, self._ncells)]
+                if cells.stop > cells.start
+            ]
+            for cells in resting:
+                advance(cells, t, y, pace, i_diff[cells], h, None)
+                counts["cell_evaluations"] += cells.stop - cells.start
+            if parts[0][0] != slice(start, stop):
+                parts = [(slice(start, stop), laplacian[start:stop], None)]
+            nstepped = stop - start
+
+        def log_state(t_log, y_log):
+            logged_times.append(t_log)
+            logged_states.append(
+                [
+                    y_log[b][r, cells]
+                    for (b, r), cells in zip(log_rows, log_cells.values())
+                ]
+            )
+
+        if self._abs_tol is not None:
+            # Adaptive steps of size dt * 2^k, up to the maximum step size
+            h_max = self._max_step_size or 64 * dt
+            if not implicit and self._laplacian.nnz:
+                # Stability limit of explicit diffusion (Gershgorin bound)
+                h_max = min(
+                    h_max,
+                    1 / (abs(self._diffusion_rate) * self._laplacian.diagonal().max()),
+                )
+            h_max = dt * 2 ** max(0, int(np.floor(np.log2(h_max / dt))))
+            h = dt
+            y_full, y_half, y_prev = ([np.empty_like(b) for b in y] for _ in range(3))
+
+        # Time is counted in steps since the last protocol event, to avoid
+        # accumulating rounding errors
+        t = t_event = self._time
+        nsteps = 0
+        tmax = t + duration
+        eps = 1e-9 * max(1.0, abs(tmax))
+        next_log = t
+        logged_times, logged_states = [], []
+        level, pace = 0.0, zeros
+
+        if progress is not None:
+            progress.enter("Running CPU simulation")
+        try:
+            while t < tmax - eps:
+                if log and t >= next_log - eps:
+                    log_state(t, y)
+                    next_log += log_interval
+
+                # Protocol and end time, at which steps end (the pacing of
+                # each cell only changes with the level)
+                t_stop = tmax
+                if pacing is not None:
+                    pacing.advance(t)
+                    if pacing.pace() != level:
+                        level = pacing.pace()
+                        pace = level * paced
+                    t_stop = min(t_stop, pacing.next_time())
+
+                if active_set and t >= t_coarse - eps:
+                    # Coarse step of the cells at rest, ending at a step of the
+                    # active cells
+                    t_coarse = min(t_event + (nsteps + coarse) * dt, t_stop)
+                    update_active(t, y, pace, t_coarse - t)
+
+                if record:
+                    # Only active cells can cross the threshold
+                    recorded = parts[0][0] if active_set else slice(None)
+                    v_old = y[bv][iv][recorded].copy()
+
+                if self._abs_tol is None:
+                    # Fixed step
+                    t_next = min(t_event + (nsteps + 1) * dt, t_stop)
+                    step(t, y, pace, t_next - t, y)
+                    if t_next < t_event + (nsteps + 1) * dt - eps:
+                        t_event, nsteps = t_next, 0
+                    else:
+                        nsteps += 1
+                else:
+                    # Compare a full step with two half steps, halving the step
+                    # size if the voltage error is above tolerance and doubling
+                    # it if well below (local error of Euler is O(h^2))
+                    h_step = min(h, t_stop - t)
+                    step(t, y, pace, h_step, y_full)
+                    if rush_larsen:
+                        step(t, y, pace, h_step / 2, y_half)
+                    else:
+                        # Reuse the reaction rates of the full step, dy = h f(y)
+                        for y_block, dy_block, half_block in zip(y, dy, y_half):
+                            np.multiply(dy_block, 0.5, out=dy_block)
+                            np.add(y_block, dy_block, out=half_block)
+                        if implicit:
+                            y_half[bv][iv] = self._diffusion_step(
+                                y_half[bv][iv], h_step / 2
+                            )
+                    step(t + h_step / 2, y_half, pace, h_step / 2, y_prev)
+                    error = np.max(np.abs(y_prev[bv][iv] - y_full[bv][iv]))
+                    if error > self._abs_tol and h_step > dt * (1 + 1e-9):
+                        h = max(h / 2, dt)
+                        counts["rejected"] += 1
+                        continue
+                    if error < self._abs_tol / 8 and h_step == h:
+                        h = min(2 * h, h_max)
+                    # Accept the Richardson extrapolation 2 y_half2 - y_full of the
+                    # two half steps (second order), y_prev becomes the old state
+                    for prev_block, full_block in zip(y_prev, y_full):
+                        prev_block *= 2
+                        prev_block -= full_block
+                    y, y_prev = y_prev, y
+                    t_next = t + h_step
+                    if log:
+                        # Log at times within the step by linear interpolation
+                        while next_log < t_next - eps:
+                            frac = (next_log - t) / h_step
+                            log_state(
+                                next_log,
+                                [a + frac * (b - a) for a, b in zip(y_prev, y)],
+                            )
+                            next_log += log_interval
+
+                if record:
+                    # First upward crossings of the threshold in this step,
+                    # linearly interpolated
+                    v_new, thresh = y[bv][iv][recorded], self._activation_thresh
+                    activation_times = self._activation_times[recorded]
+                    crossed = (v_old <= thresh) & (v_new > thresh)
+                    crossed &= np.isnan(activation_times)
+                    frac = (thresh - v_old[crossed]) / (v_new[crossed] - v_old[crossed])
+                    activation_times[crossed] = t + frac * (t_next - t)
+
+                counts["steps"] += 1
+                t = t_next
+
+                if progress is not None:
+                    if not progress.update((t - self._time) / duration):
+                        raise myokit.SimulationCancelledError()
+        finally:
+            if progress is not None:
+                progress.exit()
+            if pool is not None:
+                pool.shutdown()
+
+        if active_set:
+            finish_coarse(y)
+        self._state = y
+        self._time = t
+
+        # Convert to myokit DataLog
+        values = {}
+        for k, (var, cells) in enumerate(log_cells.items()):
+            values[var] = np.array([states[k] for states in logged_states])
+            values[var] = values[var].reshape(len(logged_times), len(cells))
+
+        return self._make_log(logged_times, values, log_cells, log_previous)
+
+    def _parse_log(self, log):
+        """Cells to log for each logged state, and the DataLog to append to
+
+        Args:
+            log: log argument of run
+
+        Returns:
+            tuple - list of logged variable names, dict of logged states and
+                arrays of their logged cells, and the DataLog from a previous
+                run to append to (or None)
+        """
+
+        time_key = self._model.binding("time").qname()
+        log_previous = None
+        if log is None:
+            log = ["engine.time", self._model.label("membrane_potential").qname()]
+        elif isinstance(log, myokit.DataLog):
+            # Continue logging the same entries
+            log_previous = log
+            log = [time_key] + [key for key in log_previous if key != time_key]
+        elif log == myokit.LOG_NONE:
+            log = []
+
+        # Cells to log for each logged state, from names like membrane.V (all
+        # cells) or 12.membrane.V (cell 12 only)
+        log_cells = {}
+        for name in log:
+            head, _, tail = name.partition(".")
+            cell = int(head) if head.isdigit() else None
+            var = self._model.get(tail if cell is not None else name)
+            if var.is_state():
+                cells = log_cells.setdefault(var, [])
+                cells.extend(range(self._ncells) if cell is None else [cell])
+            elif var.binding() != "time":
+                raise ValueError(f"Can only log states and time, not {name}")
+        log_cells = {
+            var: np.array(list(dict.fromkeys(cells)), dtype=np.int64)
+            for var, cells in log_cells.items()
+        }
+
+        return log, log_cells, log_previous
+
+    def _make_log(self, times, values, log_cells, log_previous=None):
+        """DataLog of the logged times and the (n_times, n_cells) values of each
+        logged state, appended to log_previous if given"""
+
+        time_key = self._model.binding("time").qname()
+        d = myokit.DataLog(time=time_key)
+        d[time_key] = np.array(times)
+        for var, cells in log_cells.items():
+            for j, i in enumerate(cells):
+                d[f"{i}.{var.qname()}"] = values[var][:, j]
+
+        if log_previous is not None:
+            for key in log_previous:
+                log_previous[key] = np.concatenate([log_previous[key], d[key]])
+            return log_previous
+
+        return d
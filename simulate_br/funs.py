@@ -10,8 +10,46 @@ Functions for simulation on branch geometry
 
 import numpy as np
 import pandas as pd
+from scipy import sparse
+from scipy.sparse import csgraph
+from scipy import ndimage
 
 import os
+import time
+import json
+import hashlib
+import itertools
+
+
+def fill_channel(mesh, y, left_x, width, x_min, x_max):
+    """Fill in a channel of the mesh row by row, using whole-array operations
+
+    Sets mesh[y, x] = 1 wherever left_x <= x < left_x + width, for each row
+    in y and each column x in [x_min, x_max). The column grid is broadcast
+    against the left and right edge of the channel in every row at once.
+
+    Args:
+        mesh: two-dimensional array of cell mesh (modified in place)
+        y: consecutive row indices of the channel
+        left_x: position of left edge of channel in each row of y
+        width: horizontal width of channel
+        x_min: first column that may be filled
+        x_max: column after the last column that may be filled
+
+    Returns:
+        np.array - the mesh
+    """
+
+    if len(y) == 0:
+        return mesh
+
+    x = np.arange(x_min, x_max)
+    left_x = np.asarray(left_x)[:, None]
+    right_x = left_x + width
+    inside = (x >= left_x) & (x < right_x)
+    mesh[y[0] : y[-1] + 1, x_min:x_max][inside] = 1
+
+    return mesh
 
 
 def mesh_single_branch(l1=15, w1=2, l2=5, w2=3, l_solo=3, slope=1):
@@ -41,12 +79,9 @@ def mesh_single_branch(l1=15, w1=2, l2=5, w2=3, l_solo=3, slope=1):
     mesh[:w1, :] = 1
 
     # fill in diagonal channel
-    for y in np.arange(w1, w1 + l2):
-        left_x = l_solo + (y - w1) / slope
-        right_x = left_x + w2
-        for x in np.arange(l1):
-            if (x >= left_x) & (x < right_x):
-                mesh[y, x] = 1
+    y = np.arange(w1, w1 + l2)
+    left_x = l_solo + (y - w1) / slope
+    fill_channel(mesh, y, left_x, w2, 0, l1)
 
     return mesh
 
@@ -78,20 +113,14 @@ def mesh_double_branch(l1=15, w1=3, l2=5, w2=4, l_solo=3, slope=1):
     mesh[l2 : l2 + w1, :] = 1
 
     # fill in upper diagonal channel
-    for y in np.arange(l2):
-        left_x = l_solo + (l2 - y - 1) / slope
-        right_x = left_x + w2
-        for x in np.arange(l1):
-            if (x >= left_x) & (x < right_x):
-                mesh[y, x] = 1
+    y = np.arange(l2)
+    left_x = l_solo + (l2 - y - 1) / slope
+    fill_channel(mesh, y, left_x, w2, 0, l1)
 
     # fill in lower diagonal channel
-    for y in np.arange(l2 + w1, l2 + w1 + l2):
-        left_x = l_solo + (y - w1 - l2) / slope
-        right_x = left_x + w2
-        for x in np.arange(l1):
-            if (x >= left_x) & (x < right_x):
-                mesh[y, x] = 1
+    y = np.arange(l2 + w1, l2 + w1 + l2)
+    left_x = l_solo + (y - w1 - l2) / slope
+    fill_channel(mesh, y, left_x, w2, 0, l1)
     return mesh
 
 
@@ -126,20 +155,14 @@ def mesh_double_branch_2(l1=15, w1=3, h=5, w2=4, theta=45):
     mesh[h : h + w1, :] = 1
 
     # fill in upper diagonal channel
-    for y in np.arange(h):
-        left_x = l1 + (h - y - 1) / np.tan(theta_rad)
-        right_x = left_x + len_intersection
-        for x in np.arange(l1, 2 * l1 + len_intersection):
-            if (x >= left_x) & (x < right_x):
-                mesh[y, x] = 1
+    y = np.arange(h)
+    left_x = l1 + (h - y - 1) / np.tan(theta_rad)
+    fill_channel(mesh, y, left_x, len_intersection, l1, 2 * l1 + len_intersection)
 
-    # fill in upper diagonal channel
-    for y in np.arange(h + w1, 2 * h + w1):
-        left_x = l1 + (y - w1 - h) / np.tan(theta_rad)
-        right_x = left_x + len_intersection
-        for x in np.arange(l1, 2 * l1 + len_intersection):
-            if (x >= left_x) & (x < right_x):
-                mesh[y, x] = 1
+    # fill in lower diagonal channel
+    y = np.arange(h + w1, 2 * h + w1)
+    left_x = l1 + (y - w1 - h) / np.tan(theta_rad)
+    fill_channel(mesh, y, left_x, len_intersection, l1, 2 * l1 + len_intersection)
 
     return mesh
 
@@ -189,67 +212,480 @@ def mesh_single_branch_2(l1=15, w1=3, h=5, w2=4, theta=45, w2_horiz=False):
         return mesh
 
     # Add diagonal channel
+    y = np.arange(h)
     if theta < 90:
-        for y in np.arange(h):
-            left_x = l1 + (h - y - 1) / np.tan(theta_rad)
-            right_x = left_x + len_intersection
-            for x in np.arange(l1, 2 * l1 + len_intersection):
-                if (x >= left_x) & (x < right_x):
-                    mesh[y, x] = 1
+        left_x = l1 + (h - y - 1) / np.tan(theta_rad)
+        fill_channel(mesh, y, left_x, len_intersection, l1, 2 * l1 + len_intersection)
 
     if theta > 90:
         theta_rad_c = np.pi - theta_rad
-        for y in np.arange(h):
-            left_x = l1 - (h - y - 1) / np.tan(theta_rad_c)
-            right_x = left_x + len_intersection
-            for x in np.arange(0, l1 + len_intersection):
-                if (x >= left_x) & (x < right_x):
-                    mesh[y, x] = 1
+        left_x = l1 - (h - y - 1) / np.tan(theta_rad_c)
+        fill_channel(mesh, y, left_x, len_intersection, 0, l1 + len_intersection)
 
     return mesh
 
 
+def label_cells(mesh):
+    """Label each cell of the mesh with its cell index
+
+    Cells are numbered in raster order (row by row), using a cumulative sum
+    over the occupied sites.
+
+    Args:
+        mesh: two-dimensional array of cell mesh
+
+    Returns:
+        np.array - int32 array of mesh shape with cell index of each site (-1 if empty)
+    """
+
+    occupied = mesh == 1
+    labels = np.cumsum(occupied, dtype=np.int32).reshape(mesh.shape) - 1
+    labels[~occupied] = -1
+
+    return labels
+
+
+def cell_coords(labels):
+    """Get (row, col) position of each cell
+
+    Args:
+        labels: label image from label_cells
+
+    Returns:
+        np.array - int32 array of shape (ncells, 2), row i is the position of cell i
+    """
+
+    occupied = labels >= 0
+    coords = np.empty((np.count_nonzero(occupied), 2), dtype=np.int32)
+    coords[labels[occupied]] = np.argwhere(occupied)
+
+    return coords
+
+
+def cells_in(labels, region):
+    """Get indices of the cells within a region of the mesh
+
+    Args:
+        labels: label image from label_cells
+        region: boolean mask of mesh shape, or index into the mesh
+            (e.g. np.s_[h : h + w1, :stim_width])
+
+    Returns:
+        np.array - int32 array of cell indices in region, in raster order
+    """
+
+    idx = np.asarray(labels[region]).ravel()
+
+    return idx[idx >= 0]
+
+
+def cells_to_image(coords, values, shape, fill=np.nan):
+    """Scatter values of each cell into a two-dimensional array of mesh shape
+
+    Args:
+        coords: position of each cell from cell_coords
+        values: value of each cell (ordered by cell index)
+        shape: shape of the mesh
+        fill: value of sites without cells
+
+    Returns:
+        np.array - two-dimensional array of cell values
+    """
+
+    image = np.full(shape, fill, dtype=float)
+    image[coords[:, 0], coords[:, 1]] = values
+
+    return image
+
+
+def get_edges(labels):
+    """Get connections between neighbouring cells as arrays of cell indices
+
+    Each cell is connected to the cell to its right and the cell below it,
+    found by comparing the label image with shifted copies of itself. Edges
+    are ordered by source cell, with the right connection before the down one.
+
+    Args:
+        labels: label image from label_cells
+
+    Returns:
+        np.array, np.array - int32 arrays of source and destination cell indices
+    """
+
+    # Connections going right
+    left, right = labels[:, :-1], labels[:, 1:]
+    mask = (left >= 0) & (right >= 0)
+    src_right, dst_right = left[mask], right[mask]
+
+    # Connections going down
+    up, down = labels[:-1, :], labels[1:, :]
+    mask = (up >= 0) & (down >= 0)
+    src_down, dst_down = up[mask], down[mask]
+
+    src = np.concatenate([src_right, src_down])
+    dst = np.concatenate([dst_right, dst_down])
+    order = np.argsort(src, kind="stable")
+
+    return src[order], dst[order]
+
+
+def get_laplacian(src, dst, ncells, conductance=1):
+    """Get weighted graph Laplacian of the cell connections
+
+    The diffusion current of cell i is (L @ v)[i] = sum_j g_ij * (v_i - v_j),
+    as used by myokit for a list of connections.
+
+    Args:
+        src: source cell index of each connection
+        dst: destination cell index of each connection
+        ncells: number of cells
+        conductance: conductance of connections (scalar or one value per connection)
+
+    Returns:
+        scipy.sparse.csr_matrix - (ncells, ncells) Laplacian
+    """
+
+    g = np.broadcast_to(np.asarray(conductance, dtype=float), src.shape)
+    adjacency = sparse.coo_matrix((g, (src, dst)), shape=(ncells, ncells)).tocsr()
+    adjacency = adjacency + adjacency.T
+    degree = sparse.diags(np.asarray(adjacency.sum(axis=1)).ravel())
+
+    return (degree - adjacency).tocsr()
+
+
+def edges_to_connections(src, dst, conductance=1):
+    """Convert edge arrays into the list of (i, j, conductance) tuples
+    expected by myokit.SimulationOpenCL.set_connections
+    """
+
+    return list(zip(src.tolist(), dst.tolist(), itertools.repeat(conductance)))
+
+
 def get_connections(mesh, conductance=1):
     """
     Create dictionary to map from position index to cell index
     Get list of connections in mesh
     """
 
-    connections = []
-    rows, cols = mesh.shape
-
-    # Get connections going right and connections going down
-    directions = [(1, 0), (0, 1)]
+    labels = label_cells(mesh)
+    src, dst = get_edges(labels)
+    connections = edges_to_connections(src, dst, conductance)
 
     # Dictionary to store index of each cell
-    pos_to_cell = {}
-
-    # Assign indices to each cell
-    index = 0
-    for y in range(rows):
-        for x in range(cols):
-            if mesh[y, x] == 1:
-                pos_to_cell[(y, x)] = index
-                index += 1
-
-    # Iterate through the rows and columns
-    for y in range(rows):
-        for x in range(cols):
-            # Check if the current cell is a one
-            if mesh[y, x] == 1:
-                current_index = pos_to_cell[(y, x)]
-                # Iterate through the directions to find neighboring cells
-                for dx, dy in directions:
-                    ny, nx = y + dy, x + dx
-                    # Check if the neighboring cell is within bounds and is also a one
-                    if (ny, nx) in pos_to_cell:
-                        neighbor_index = pos_to_cell[(ny, nx)]
-                        # Add connection between current cell and neighboring cell
-                        connections.append((current_index, neighbor_index, conductance))
+    ys, xs = np.nonzero(labels >= 0)
+    pos_to_cell = dict(zip(zip(ys.tolist(), xs.tolist()), range(len(ys))))
 
     return pos_to_cell, connections
 
 
+def renumber_cells(geometry, method="rcm"):
+    """Renumber cells so that neighbouring cells have nearby indices
+
+    Raster-order numbering puts vertically adjacent cells a full row apart,
+    which scatters the neighbours of diagonal branches in memory. Reordering
+    the cells improves cache use of diffusion kernels and reduces the
+    bandwidth of the connection matrix.
+
+    Args:
+        geometry: dict from get_geometry
+        method: "rcm" (reverse Cuthill-McKee on the connection graph) or
+            "morton" (Z-order curve over cell positions)
+
+    Returns:
+        dict - geometry with labels, coords, src and dst in the new numbering,
+            and order (raster-order index of each renumbered cell)
+    """
+
+    coords = geometry["coords"]
+    ncells = len(coords)
+
+    if method == "rcm":
+        src, dst = geometry["src"], geometry["dst"]
+        adjacency = sparse.coo_matrix(
+            (np.ones(len(src), dtype=np.int8), (src, dst)), shape=(ncells, ncells)
+        ).tocsr()
+        order = csgraph.reverse_cuthill_mckee(adjacency + adjacency.T, True)
+    elif method == "morton":
+        # Interleave the bits of the row and column of each cell
+        code = np.zeros(ncells, dtype=np.uint64)
+        rows, cols = coords[:, 0].astype(np.uint64), coords[:, 1].astype(np.uint64)
+        for bit in range(32):
+            code |= ((rows >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit + 1)
+            code |= ((cols >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit)
+        order = np.argsort(code, kind="stable")
+    else:
+        raise ValueError(f"Unknown renumbering method {method}")
+
+    # order maps new index to old index, new_index maps old index to new index
+    new_index = np.empty(ncells, dtype=np.int32)
+    new_index[order] = np.arange(ncells, dtype=np.int32)
+
+    labels = geometry["labels"]
+    labels = np.where(labels >= 0, new_index[labels], -1).astype(np.int32)
+    src, dst = new_index[geometry["src"]], new_index[geometry["dst"]]
+    edge_order = np.argsort(src, kind="stable")
+
+    return dict(
+        geometry,
+        labels=labels,
+        coords=coords[order],
+        src=src[edge_order],
+        dst=dst[edge_order],
+        order=geometry["order"][order].astype(np.int32),
+    )
+
+
+def prune_mesh(mesh, seed_region):
+    """Remove cells that are not connected to a seed region of the mesh
+
+    Connected components are labelled with the same nearest-neighbour
+    connectivity as get_edges, and every component without a cell in the
+    seed region is removed (e.g. isolated pixels left by thin diagonals).
+
+    Args:
+        mesh: two-dimensional array of cell mesh
+        seed_region: boolean mask of mesh shape, or index into the mesh
+
+    Returns:
+        np.array, int - pruned mesh and number of cells removed
+    """
+
+    components, _ = ndimage.label(mesh == 1)
+    seed_components = np.unique(components[seed_region])
+    keep = np.isin(components, seed_components[seed_components > 0])
+    pruned = np.where(keep, mesh, 0).astype(mesh.dtype)
+
+    return pruned, int(np.count_nonzero(mesh == 1) - np.count_nonzero(pruned == 1))
+
+
+def check_connected(geometry, seed_cells, probe_cells):
+    """Check that probe cells can be reached from seed cells
+
+    Raises a ValueError if a group of probe cells is empty or not in the same
+    connected component as one of the seed cells, in which case its
+    activation time can never be measured.
+
+    Args:
+        geometry: dict from get_geometry
+        seed_cells: indices of the seed (e.g. paced) cells
+        probe_cells: dict mapping the name of each group of probe cells to
+            their indices
+    """
+
+    ncells = len(geometry["coords"])
+    src, dst = geometry["src"], geometry["dst"]
+    adjacency = sparse.coo_matrix(
+        (np.ones(len(src), dtype=np.int8), (src, dst)), shape=(ncells, ncells)
+    )
+    _, components = csgraph.connected_components(adjacency, directed=False)
+    seed_components = np.unique(components[seed_cells])
+
+    for name, cells in probe_cells.items():
+        if len(cells) == 0:
+            raise ValueError(f"No cells at probe {name}")
+        if not np.isin(components[cells], seed_components).any():
+            raise ValueError(f"Probe {name} is not connected to the seed cells")
+
+
+def stack_geometries(geometries):
+    """Combine geometries into one network of disconnected blocks of cells
+
+    The cells of geometry k are numbered offsets[k] to offsets[k + 1] - 1 in the
+    combined network, so several geometries can be run in one simulation.
+
+    Args:
+        geometries: list of dicts from get_geometry
+
+    Returns:
+        tuple - offsets (array of length len(geometries) + 1, ending with the
+            total number of cells), src, dst (cell indices of each connection in
+            the combined network)
+    """
+
+    ncells = [len(geometry["coords"]) for geometry in geometries]
+    offsets = np.concatenate([[0], np.cumsum(ncells)]).astype(np.int64)
+    src = np.concatenate(
+        [geometry["src"] + offset for geometry, offset in zip(geometries, offsets)]
+    )
+    dst = np.concatenate(
+        [geometry["dst"] + offset for geometry, offset in zip(geometries, offsets)]
+    )
+
+    return offsets, src, dst
+
+
+def row_partition(coords, nblocks):
+    """Split cells into contiguous blocks of whole rows of the mesh
+
+    Block boundaries are moved to the nearest start of a mesh row, so that
+    with raster-order numbering each block is a band of rows whose only
+    connections to other blocks are with the rows just above and below.
+    Other numberings (or stacked geometries) are split at the nearest change
+    of row.
+
+    Args:
+        coords: (row, col) position of each cell, as from cell_coords (the
+            concatenated coords of stacked geometries also work)
+        nblocks: number of blocks
+
+    Returns:
+        np.array - nblocks + 1 boundaries, block k holds cells bounds[k] to
+            bounds[k + 1] - 1 (some blocks may be empty for small meshes)
+    """
+
+    ncells = len(coords)
+    rows = np.asarray(coords)[:, 0]
+    row_starts = np.concatenate(
+        [[0], np.nonzero(np.diff(rows) != 0)[0] + 1, [ncells]]
+    ).astype(np.int64)
+
+    targets = np.linspace(0, ncells, nblocks + 1)
+    nearest = np.searchsorted(row_starts, targets).clip(1, len(row_starts) - 1)
+    below, above = row_starts[nearest - 1], row_starts[nearest]
+    bounds = np.where(targets - below < above - targets, below, above)
+    bounds[0], bounds[-1] = 0, ncells
+
+    return np.maximum.accumulate(bounds)
+
+
+def graph_partition(src, dst, ncells, nparts):
+    """Split the cell graph into parts of equal size with few connections
+    between parts
+
+    Cells are ordered by reverse Cuthill-McKee on the connection graph, which
+    keeps connected cells close together in the ordering, and the ordering is
+    cut into nparts ranges. Each part then only connects to the parts before
+    and after it, through a number of cells of the order of the bandwidth of
+    the ordering (about the width of the mesh).
+
+    Args:
+        src, dst: cell indices of each connection (as from get_edges)
+        ncells: number of cells
+        nparts: number of parts
+
+    Returns:
+        np.array - int32 array with the part of each cell
+    """
+
+    adjacency = sparse.coo_matrix(
+        (np.ones(len(src), dtype=np.int8), (src, dst)), shape=(ncells, ncells)
+    ).tocsr()
+    order = csgraph.reverse_cuthill_mckee(adjacency + adjacency.T, True)
+
+    parts = np.empty(ncells, dtype=np.int32)
+    parts[order] = np.arange(ncells) * nparts // max(ncells, 1)
+
+    return parts
+
+
+# Builders available to get_geometry, and their length arguments scaled by scale_up
+MESH_BUILDERS = {
+    "mesh_single_branch": mesh_single_branch,
+    "mesh_double_branch": mesh_double_branch,
+    "mesh_double_branch_2": mesh_double_branch_2,
+    "mesh_single_branch_2": mesh_single_branch_2,
+}
+LENGTH_ARGS = ["l1", "w1", "l2", "w2", "h", "l_solo"]
+
+# Directory shared by all simulation folders for cached geometries
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cache")
+
+# Increment to invalidate cached geometries when the builders change
+GEOMETRY_VERSION = 3
+
+
+def get_geometry(
+    builder="mesh_single_branch_2",
+    scale_up=1,
+    prune_from=None,
+    renumber=None,
+    cache=True,
+    **kwargs,
+):
+    """Get mesh, label image and connections of a geometry, using an on-disk cache
+
+    The cache file is named after a hash of the builder name, scale_up and the
+    geometry arguments, so any script or worker asking for the same geometry
+    loads the stored arrays instead of rebuilding them.
+
+    Args:
+        builder: name of mesh builder in MESH_BUILDERS
+        scale_up: factor applied to all length arguments of the builder
+        prune_from: box [row_start, row_stop, col_start, col_stop] of the
+            (scaled) mesh passed to prune_mesh as seed region, or None to
+            keep all cells
+        renumber: method passed to renumber_cells ("rcm" or "morton"), or None
+            to keep raster-order numbering
+        cache: whether to read from and write to the cache
+        **kwargs: arguments of the mesh builder (e.g. l1, w1, h, w2, theta, w2_horiz)
+
+    Returns:
+        dict - mesh (float array of 0/1), labels (label image), coords (position
+            of each cell), src, dst (cell indices of each connection), order
+            (raster-order index of each cell in the unpruned mesh, to undo any
+            pruning and renumbering) and n_pruned (number of cells removed)
+    """
+
+    if renumber == "none":
+        renumber = None
+
+    key = dict(
+        builder=builder,
+        scale_up=scale_up,
+        prune_from=prune_from,
+        renumber=renumber,
+        version=GEOMETRY_VERSION,
+        **kwargs,
+    )
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+    filepath = os.path.join(CACHE_DIR, "geometry", f"{builder}-{digest[:16]}.npz")
+
+    if cache and os.path.exists(filepath):
+        with np.load(filepath) as data:
+            geometry = {name: data[name] for name in data.files}
+        geometry["mesh"] = geometry["mesh"].astype(float)
+        geometry["n_pruned"] = int(geometry["n_pruned"])
+        return geometry
+
+    args_builder = {
+        arg: value * scale_up if arg in LENGTH_ARGS else value
+        for arg, value in kwargs.items()
+    }
+    mesh = MESH_BUILDERS[builder](**args_builder)
+    labels_unpruned = label_cells(mesh)
+    n_pruned = 0
+    if prune_from is not None:
+        row_start, row_stop, col_start, col_stop = prune_from
+        seed_region = np.s_[row_start:row_stop, col_start:col_stop]
+        mesh, n_pruned = prune_mesh(mesh, seed_region)
+
+    labels = label_cells(mesh)
+    coords = cell_coords(labels)
+    src, dst = get_edges(labels)
+    geometry = dict(
+        mesh=mesh,
+        labels=labels,
+        coords=coords,
+        src=src,
+        dst=dst,
+        order=labels_unpruned[coords[:, 0], coords[:, 1]],
+        n_pruned=n_pruned,
+    )
+    if renumber is not None:
+        geometry = renumber_cells(geometry, renumber)
+
+    if cache:
+        # Write to a temporary file first so that concurrent workers never
+        # read a partially written file
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        filepath_tmp = f"{filepath}.{os.getpid()}.tmp"
+        with open(filepath_tmp, "wb") as fp:
+            np.savez(fp, **dict(geometry, mesh=mesh.astype(np.uint8)))
+        os.replace(filepath_tmp, filepath)
+
+    return geometry
+
+
 if __name__ == "__main__":
     print("Run tests")
 
@@ -259,3 +695,47 @@ if __name__ == "__main__":
     # pos_to_cell, connections = get_connections(mesh)
     # print(pos_to_cell)
     # print(connections)
+
+    # Meshes must be bit-identical to those of the original row/column loops.
+    # Reference digest was recorded from the loop implementation on this grid.
+    digest = hashlib.sha1()
+    for theta, w2, h, scale_up in itertools.product(
+        range(0, 181, 5), [2, 5, 10], [5, 20], [1, 2, 3]
+    ):
+        kwargs = dict(
+            l1=20 * scale_up, w1=5 * scale_up, h=h * scale_up, w2=w2 * scale_up
+        )
+        for w2_horiz in [False, True]:
+            mesh = mesh_single_branch_2(**kwargs, theta=theta, w2_horiz=w2_horiz)
+            digest.update(str(mesh.shape).encode() + mesh.tobytes())
+        if 0 < theta < 180:
+            mesh = mesh_double_branch_2(**kwargs, theta=theta)
+            digest.update(str(mesh.shape).encode() + mesh.tobytes())
+    for slope, w2, l2 in itertools.product([0.5, 1, 2, 3.7321], [2, 5, 10], [5, 20]):
+        for builder in [mesh_single_branch, mesh_double_branch]:
+            mesh = builder(l1=60, w1=5, l2=l2, w2=w2, l_solo=3, slope=slope)
+            digest.update(str(mesh.shape).encode() + mesh.tobytes())
+    assert digest.hexdigest() == "f7da76282baa261b064931dfc8be73d23dbcc2ce"
+    print("Meshes match loop implementation")
+
+    # Time construction of large meshes
+    for scale_up in [5, 10, 20]:
+        tic = time.perf_counter()
+        mesh = mesh_single_branch_2(
+            l1=120 * scale_up,
+            w1=10 * scale_up,
+            h=40 * scale_up,
+            w2=30 * scale_up,
+            theta=150,
+        )
+        toc = time.perf_counter()
+        print(
+            f"scale_up={scale_up}: {mesh.size} sites, {int(mesh.sum())} cells, built in {toc - tic:0.4f} seconds"
+        )
+
+        tic = time.perf_counter()
+        labels = label_cells(mesh)
+        src, dst = get_edges(labels)
+        laplacian = get_laplacian(src, dst, int(mesh.sum()))
+        toc = time.perf_counter()
+        print(f"    {len(src)} connections built in {toc - tic:0.4f} seconds")
@@ -27,7 +27,7 @@ source $SLURM_TMPDIR/venv/bin/activate
 echo Install python packages
 pip install --no-index --upgrade pip
 #pip install --no-index -r /home/tbury/projects/def-glass/tbury/torord-sims/requirements.txt
-pip install --no-index pandas numpy
+pip install --no-index pandas numpy scipy
 # pip install git+https://github.com/MichaelClerx/myokit.git
 #pip install myokit==1.33.0
 pip install --no-index myokit==1.36
@@ -36,5 +36,14 @@ pip install --no-index tyro
 # # Print opencl info found by myokit
 # python -m myokit opencl
 
+# THETA and W2 may hold several values (batch mode, see run_multi_cedar.sh)
+declare -a THETA_VALS=($THETA);
+declare -a W2_VALS=($W2);
+if [ ${#THETA_VALS[@]} -eq 1 ] && [ ${#W2_VALS[@]} -eq 1 ]; then
+	GRID_ARGS="--theta $THETA --w2=$W2"
+else
+	GRID_ARGS="--thetas ${THETA_VALS[*]} --w2s ${W2_VALS[*]}"
+fi
+
 echo "Running job for THETA=$THETA, w2=$W2"
-python -u sim_branch.py --run_name id$SLURM_JOB_ID --theta $THETA --w2=$W2 --double_precision
+python -u sim_branch.py --run_name id$SLURM_JOB_ID $GRID_ARGS --double_precision
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18 October, 2026
+
+Cellular automaton surrogate of conduction on branch geometry, for screening
+sweeps of the geometry before running the ionic model (see the automata in
+miguel_files/CellularAutomata_Compilation.pdf).
+
+Cells are at rest, excited or refractory (Greenberg-Hastings automaton). A
+resting cell is excited when the excited fraction of its neighbourhood, the
+cells within a graph distance radius on the connection graph, reaches a
+threshold. With a radius above 1, the fraction ahead of a front depends on
+its curvature: a front expanding into a wide branch excites fewer cells
+ahead of it than a planar front (source-sink mismatch), and blocks if the
+fraction falls below the threshold.
+
+@author: tbury
+"""
+
+import numpy as np
+from scipy import sparse
+
+# States of a cell: 0 at rest, 1 to n_excited excited, then n_refractory
+# refractory states before returning to rest
+REST = 0
+
+
+def get_neighbourhood(src, dst, ncells, radius=3, conductance=1):
+    """Get weights of the neighbourhood of each cell
+
+    The neighbourhood of a cell are the other cells within graph distance
+    radius. Weights are the conductance of the connections for radius 1, and
+    equal otherwise, normalized so that the weights of each cell sum to 1.
+
+    Args:
+        src, dst: cell indices of each connection (as from get_edges)
+        ncells: number of cells
+        radius: graph distance of the neighbourhood
+        conductance: conductance of each connection (scalar or one value per
+            connection)
+
+    Returns:
+        sparse.csr_matrix - (ncells, ncells) float32 matrix of weights
+    """
+
+    conductance = np.broadcast_to(np.asarray(conductance, dtype=np.float32), len(src))
+    adjacency = sparse.coo_matrix((conductance, (src, dst)), shape=(ncells, ncells))
+    adjacency = (adjacency + adjacency.T).tocsr()
+
+    if radius > 1:
+        # Cells reachable in radius steps, through cells of the mesh
+        reach = adjacency.astype(bool).astype(np.int8)
+        neighbourhood = reach
+        for _ in range(radius - 1):
+            neighbourhood = neighbourhood + neighbourhood @ reach
+            neighbourhood.data[:] = 1
+        neighbourhood.setdiag(0)
+        neighbourhood.eliminate_zeros()
+        adjacency = neighbourhood.astype(np.float32)
+
+    total = np.asarray(adjacency.sum(axis=1)).ravel()
+    total[total == 0] = 1
+
+    return sparse.diags(1 / total).astype(np.float32) @ adjacency
+
+
+def run_automaton(
+    weights, cells_pace, thresh=0.35, n_excited=5, n_refractory=20, nsteps=10000
+):
+    """Run the automaton from a stimulus of the paced cells at step 0
+
+    All cells are updated at once each step. The drive of each cell (the
+    weighted excited fraction of its neighbourhood) is scattered from the
+    excited cells only, through the transposed weights, so the cost of a step
+    is set by the size of the wavefront rather than of the mesh. The run stops
+    once no cell is excited.
+
+    Args:
+        weights: neighbourhood weights from get_neighbourhood
+        cells_pace: indices of the cells excited at step 0
+        thresh: excited fraction of the neighbourhood that excites a cell
+        n_excited: number of steps a cell stays excited
+        n_refractory: number of steps a cell stays refractory
+        nsteps: largest number of steps
+
+    Returns:
+        np.array - step at which each cell was first excited (-1 if never)
+    """
+
+    ncells = weights.shape[0]
+    weights_t = sparse.csr_matrix(weights.T)
+    state = np.full(ncells, REST, dtype=np.int16)
+    t_act = np.full(ncells, -1, dtype=np.int32)
+    state[cells_pace] = 1
+    t_act[cells_pace] = 0
+
+    for step in range(1, nsteps + 1):
+        excited = np.flatnonzero((state > REST) & (state <= n_excited))
+        if len(excited) == 0:
+            break
+        rows = weights_t[excited]
+        drive = np.bincount(rows.indices, weights=rows.data, minlength=ncells)
+        fire = (state == REST) & (drive >= thresh)
+
+        # Excited and refractory cells advance, and return to rest at the end
+        state[state > REST] += 1
+        state[state > n_excited + n_refractory] = REST
+        state[fire] = 1
+        t_act[fire & (t_act < 0)] = step
+
+    return t_act
+
+
+def channel_speed(width=10, stim_width=2, length=200, radius=3, **kwargs):
+    """Speed of a planar front in a straight channel, in cells per step
+
+    Used to convert steps of the automaton to time, given the conduction
+    velocity of the ionic model in a straight channel of the same width.
+
+    Args:
+        width: width of the channel
+        stim_width: number of paced columns at the left end
+        length: length of the channel
+        radius: radius of the neighbourhood (see get_neighbourhood)
+        **kwargs: arguments of run_automaton
+
+    Returns:
+        float - speed in cells per step, or NaN if the front does not reach
+            the end of the channel
+    """
+
+    labels = np.arange(width * length).reshape(width, length)
+    right = np.stack([labels[:, :-1].ravel(), labels[:, 1:].ravel()])
+    down = np.stack([labels[:-1].ravel(), labels[1:].ravel()])
+    src, dst = np.concatenate([right, down], axis=1)
+    weights = get_neighbourhood(src, dst, width * length, radius=radius)
+    t_act = run_automaton(weights, labels[:, :stim_width].ravel(), **kwargs)
+
+    # Speed over the middle half of the channel
+    x1, x2 = length // 4, 3 * length // 4
+    if np.any(t_act[labels[:, x2]] < 0):
+        return np.nan
+    steps = np.median(t_act[labels[:, x2]]) - np.median(t_act[labels[:, x1]])
+    return (x2 - x1) / steps
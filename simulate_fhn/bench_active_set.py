@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18 October, 2026
+
+Benchmark of active set integration of the CPU engine (see
+SimulationCPU.set_active_set) against integration of all cells, for a planar
+wave crossing branch geometries of increasing length l1. Each geometry is
+run until the wave has crossed the mesh (from the conduction velocity cv),
+and the speedup, the fraction of cell evaluations and the largest
+difference in activation time are reported.
+
+The active set is about as long as the wavelength, so the fraction of
+cells that are active, and the cost of the run relative to integrating all
+cells, fall as the mesh gets longer than the wavelength, down to the cost of
+the coarse steps of the cells at rest (1 / coarse_steps of the cells).
+The mesh size where the active set breaks even is interpolated from the
+speedups. With the defaults it breaks even at about 4600 cells (l1 near
+200), and is 1.7x faster at 10100 cells and 2.2x at 19700 cells. Below that
+it runs at 0.76x to 0.97x.
+
+@author: tbury
+"""
+
+import numpy as np
+import pandas as pd
+import time
+
+import myokit as myokit
+
+import tyro
+from dataclasses import dataclass
+from typing import Tuple
+
+from engine import SimulationCPU
+from funs import get_geometry, edges_to_connections, cells_in
+
+
+@dataclass
+class Args:
+    model: str = "../mmt_files/fhn.mmt"
+    """mmt file of the cell model"""
+    fhn_eps: float = 0.015
+    """relaxation speed of recovery variable"""
+    fhn_a: float = 0.12
+    """excitability of cell"""
+    l1s: Tuple[int, ...] = (60, 90, 120, 180, 240, 480, 960)
+    """lengths of horizontal channel before and after junction"""
+    active_tol: float = 0.01
+    """largest distance of the membrane potential from rest of cells at rest"""
+    coarse_steps: int = 8
+    """number of steps per step of the cells at rest"""
+    cpu_backend: str = "numpy"
+    """right-hand side kernel of the cpu engine: numpy or numba (see codegen.py)"""
+    cpu_integrator: str = "euler"
+    """time stepping of the engine: euler or rush_larsen"""
+    active_thresh: float = 0.5
+    """threshold in membrane potential to register as active"""
+    conductance: float = 4
+    """Cell-to-cell conductance"""
+    dt: float = 5e-3
+    """integration time step"""
+    cv: float = 0.89
+    """conduction velocity in cells/ms, to set the time for the wave to cross the mesh"""
+    renumber: str = "rcm"
+    """renumber cells before simulating (none, rcm or morton)"""
+
+    # Geometry (defaults of sim_branch2.py)
+    w1: int = 10
+    """width of horizontal channel"""
+    h: int = 40
+    """height of the diagonal channel"""
+    w2: int = 10
+    """width of diagonal channel"""
+    theta: int = 90
+    """angle of diagonal channel"""
+    stim_width: int = 2
+    """width of area in which to stimulate"""
+
+
+args = tyro.cli(Args)
+print(args)
+
+m = myokit.load_model(args.model)
+if m.has_variable("membrane.epsilon"):
+    m.set_value("membrane.epsilon", args.fhn_eps)
+    m.set_value("membrane.a", args.fhn_a)
+v_rest = m.initial_values(as_floats=True)[m.label("membrane_potential").index()]
+p = myokit.Protocol()
+p.schedule(1, 15, 1)
+
+rows = np.s_[args.h : args.h + args.w1]
+list_dict = []
+for l1 in args.l1s:
+    geometry = get_geometry(
+        "mesh_single_branch_2",
+        l1=l1,
+        w1=args.w1,
+        h=args.h,
+        w2=args.w2,
+        theta=args.theta,
+        prune_from=[rows.start, rows.stop, 0, args.stim_width],
+        renumber=args.renumber,
+    )
+    ncells = len(geometry["coords"])
+    connections = edges_to_connections(
+        geometry["src"], geometry["dst"], conductance=args.conductance
+    )
+    list_cells_pace = cells_in(
+        geometry["labels"], (rows, np.s_[: args.stim_width])
+    ).tolist()
+    length = geometry["labels"].shape[1]
+    tmax = 15 + length / args.cv
+    print(f"l1={l1}: {ncells} cells, length {length}, tmax {tmax:0.1f}")
+
+    results = {}
+    for mode in ["full", "active"]:
+        s = SimulationCPU(
+            m,
+            p,
+            ncells=ncells,
+            backend=args.cpu_backend,
+            integrator=args.cpu_integrator,
+        )
+        s.set_connections(connections)
+        s.set_step_size(step_size=args.dt)
+        s.set_paced_cell_list(list_cells_pace)
+        s.set_activation_threshold(args.active_thresh)
+        if mode == "active":
+            s.set_active_set(v_rest, args.active_tol, coarse_steps=args.coarse_steps)
+
+        # Warm-up step (kernel loading or compilation)
+        s.run(args.dt, log=myokit.LOG_NONE)
+        tic = time.perf_counter()
+        s.run(tmax - args.dt, log=myokit.LOG_NONE)
+        toc = time.perf_counter()
+        results[mode] = (
+            s.activation_times(),
+            toc - tic,
+            s.statistics()["cell_evaluations"],
+        )
+
+    t_full, runtime_full, evals_full = results["full"]
+    t_active, runtime, evals = results["active"]
+    activated = np.isfinite(t_full)
+    dict_bench = dict(
+        l1=l1,
+        ncells=ncells,
+        length=length,
+        tmax=tmax,
+        runtime_full=runtime_full,
+        runtime_active=runtime,
+        speedup=runtime_full / runtime,
+        evaluations=evals / evals_full,
+        error=np.max(np.abs(t_active - t_full)[activated], initial=0),
+        mismatch=int(np.sum(activated != np.isfinite(t_active))),
+    )
+    print(dict_bench)
+    list_dict.append(dict_bench)
+
+df = pd.DataFrame(list_dict)
+print(df.to_string(index=False))
+
+# Mesh size where the active set breaks even: the last crossing of speedup 1,
+# interpolated in log(ncells)
+above = df["speedup"].values >= 1
+crossings = np.flatnonzero(~above[:-1] & above[1:])
+if above.all():
+    print(f"Active set is faster on all meshes, from {df['ncells'].min()} cells")
+elif not above[-1]:
+    print("Active set is not faster on the largest mesh")
+else:
+    i = crossings[-1]
+    x0, x1 = np.log(df["ncells"].values[i : i + 2])
+    y0, y1 = df["speedup"].values[i : i + 2]
+    ncells_even = np.exp(x0 + (1 - y0) * (x1 - x0) / (y1 - y0))
+    print(f"Active set breaks even at about {ncells_even:0.0f} cells")
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18 October, 2026
+
+Benchmark effect of cell renumbering on the speed of the diffusion step
+for branch meshes of increasing size
+
+With --opencl on the pocl CPU driver (one core, no GPU was available), RCM
+ran at 0.9-1.1x the steps/s of raster order from 5.4k to 346k cells, which is
+within run-to-run noise, and Morton at 0.8-1.0x. On a GPU, the OpenCL timing is
+still unmeasured.
+
+@author: tbury
+"""
+
+import numpy as np
+import pandas as pd
+import time
+
+import tyro
+from dataclasses import dataclass
+
+from funs import get_geometry, get_laplacian, edges_to_connections
+
+
+@dataclass
+class Args:
+    scale_ups: tuple = (1, 2, 4, 8)
+    """values of scale_up to benchmark"""
+    methods: tuple = ("none", "rcm", "morton")
+    """renumbering methods to compare"""
+    nsteps: int = 200
+    """number of diffusion steps timed on the CPU"""
+    opencl: bool = False
+    """whether to also time the myokit OpenCL simulation"""
+    tmax_opencl: float = 10
+    """simulation time of each OpenCL run"""
+    dt: float = 5e-3
+    """integration time step"""
+
+
+args = tyro.cli(Args)
+print(args)
+
+
+def bench_cpu(geometry):
+    """Steps per second of an explicit diffusion update v -= dt * L @ v"""
+
+    ncells = len(geometry["coords"])
+    laplacian = get_laplacian(geometry["src"], geometry["dst"], ncells, conductance=4)
+    v = np.random.rand(ncells)
+    laplacian @ v
+    tic = time.perf_counter()
+    for _ in range(args.nsteps):
+        v -= args.dt * (laplacian @ v)
+    toc = time.perf_counter()
+    return args.nsteps / (toc - tic)
+
+
+def bench_opencl(geometry):
+    """Steps per second of a myokit OpenCL simulation of the FHN model"""
+
+    import myokit
+
+    m = myokit.load_model("../mmt_files/fhn.mmt")
+    p = myokit.Protocol()
+    p.schedule(1, 15, 1)
+    ncells = len(geometry["coords"])
+    s = myokit.SimulationOpenCL(m, p, ncells=ncells, diffusion=True)
+    s.set_connections(
+        edges_to_connections(geometry["src"], geometry["dst"], conductance=4)
+    )
+    s.set_step_size(step_size=args.dt)
+    s.set_paced_cell_list(geometry["order"].argsort()[:10].tolist())
+    s.run(args.dt * 10, log=myokit.LOG_NONE)
+    tic = time.perf_counter()
+    s.run(args.tmax_opencl, log=myokit.LOG_NONE)
+    toc = time.perf_counter()
+    return args.tmax_opencl / args.dt / (toc - tic)
+
+
+list_dict = []
+for scale_up in args.scale_ups:
+    for method in args.methods:
+        geometry = get_geometry(
+            "mesh_single_branch_2",
+            scale_up=scale_up,
+            l1=120,
+            w1=10,
+            h=40,
+            w2=30,
+            theta=150,
+            renumber=method,
+        )
+        src, dst = geometry["src"], geometry["dst"]
+        dict_bench = dict(
+            scale_up=scale_up,
+            method=method,
+            ncells=len(geometry["coords"]),
+            bandwidth=int(np.abs(src.astype(np.int64) - dst).max()),
+            steps_per_sec_cpu=bench_cpu(geometry),
+        )
+        if args.opencl:
+            dict_bench["steps_per_sec_opencl"] = bench_opencl(geometry)
+        print(dict_bench)
+        list_dict.append(dict_bench)
+
+df = pd.DataFrame(list_dict)
+print(df.to_string(index=False))
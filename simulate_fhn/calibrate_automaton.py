@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18 October, 2026
+
+Calibrate the delay flag of the automaton screen (screen_automaton.py)
+against tissue simulations of the FHN model, and report how often it misses
+conduction block.
+
+The points of a screen (summary.csv in screen_dir) are simulated with the
+ionic model, stacked in tissue runs of chunk_size geometries (as in batch mode
+of sim_branch2.py), from the pre-paced state of a single cell (prepace.py) and
+with an instrumented model (instrument.py) recording activation times. A point
+blocks in the tissue if x2 of the screen is not activated by tmax.
+
+Points are split by theta into a calibration set and a held-out set
+(alternate values of theta). The delay margin is the largest relative delay
+over a straight channel that flags all blocking points of the calibration
+set. On the held-out set, the false negative rate (blocking points that are
+not flagged) and the fraction of points flagged are reported for that margin.
+Results are written to output_automaton_calibration/, with the margin and
+rates in calibration.json.
+
+@author: tbury
+"""
+
+import numpy as np
+import pandas as pd
+import os
+import time
+
+import myokit as myokit
+
+import tyro
+from dataclasses import dataclass
+
+from engine import SimulationCPU
+from prepace import get_prepaced_state
+from instrument import get_instrumented_model, initial_state, activation_map
+from funs import get_geometry, edges_to_connections, cells_in, stack_geometries
+
+import datetime
+import pytz
+
+import json
+
+# Get date and time in zone ET
+newYorkTz = pytz.timezone("America/New_York")
+datetime_now = datetime.datetime.now(newYorkTz).strftime("%Y%m%d-%H%M%S")
+
+
+@dataclass
+class Args:
+    screen_dir: str
+    """output directory of screen_automaton.py (with config.json and summary.csv)"""
+    run_name: str = "mac"
+    """name of the run"""
+    engine: str = "cpu"
+    """simulation engine: opencl (myokit.SimulationOpenCL) or cpu (SimulationCPU in engine.py)"""
+    model: str = "../mmt_files/fhn.mmt"
+    """mmt file of the cell model"""
+    fhn_eps: float = 0.015
+    """relaxation speed of recovery variable"""
+    fhn_a: float = 0.12
+    """excitability of cell"""
+    conductance: float = 4
+    """Cell-to-cell conductance"""
+    active_thresh: float = 0.5
+    """threshold in membrane potential to register as active"""
+    stim_duration: float = 1
+    """duration of stimulus applied to the paced cells"""
+    dt: float = 5e-3
+    """integration time step"""
+    tmax: float = 400
+    """time to run simulation up to (conduction to x2 after this counts as block)"""
+    chunk_size: int = 100
+    """number of geometries simulated together"""
+    held_out: int = 1
+    """parity of the index of theta in the screen of the held-out points (0 or 1)"""
+
+
+args = tyro.cli(Args)
+print(args)
+
+dir_name = f"output_automaton_calibration/{datetime_now}-{args.run_name}/"
+os.makedirs(dir_name, exist_ok=True)
+json.dump(vars(args), open(dir_name + "config.json", "w"))
+
+# Screen to calibrate, with the geometry and probes it used
+config = json.load(open(os.path.join(args.screen_dir, "config.json")))
+df = pd.read_csv(os.path.join(args.screen_dir, "summary.csv"))
+conduction_time_straight = (config["x2"] - config["x1"]) / config["cv"]
+df["delay_ratio"] = df["conduction_time"] / conduction_time_straight - 1
+print(f"Simulating {len(df)} points of {args.screen_dir}")
+
+# Model with the parameters as set by sim_branch2.py, so that the pre-paced
+# state is shared through the cache
+m = myokit.load_model(args.model)
+params = {
+    "membrane.epsilon": args.fhn_eps,
+    "membrane.a": args.fhn_a,
+    "membrane.b": 0.5,
+    "membrane.c": 1,
+    "membrane.d": 0,
+}
+for key, value in params.items():
+    m.set_value(key, value)
+state0, info_pre = get_prepaced_state(
+    m,
+    args.model,
+    params,
+    bcl=1000,
+    duration=args.stim_duration,
+    offset=15,
+    level=1,
+    num_beats=1000,
+)
+print("Pre-pacing of single cell finished after {} beats".format(info_pre["beats"]))
+state0 = initial_state(state0)
+m = get_instrumented_model(m, args.active_thresh)
+p = myokit.Protocol()
+p.schedule(1, config["stim_offset"], args.stim_duration)
+
+
+def active_time(t_act, cells):
+    """Activation time of the cells at a location (median over the cells, NaN
+    if fewer than half of them activated)"""
+
+    t = t_act[cells]
+    if np.mean(np.isfinite(t)) < 0.5:
+        return np.nan
+    return np.median(t[np.isfinite(t)])
+
+
+def simulate(chunk):
+    """Simulate the points of a chunk (rows of df) in one tissue run, and
+    return the activation times at x1 and x2 of each"""
+
+    list_points = []
+    for _, row in chunk.iterrows():
+        row_start, row_stop = config["h"], config["h"] + int(row["w1"])
+        rows = np.s_[row_start:row_stop]
+        kwargs_geometry = dict(
+            l1=config["l1"],
+            w1=int(row["w1"]),
+            h=config["h"],
+            w2=int(row["w2"]),
+            theta=int(row["theta"]),
+        )
+        if config["builder"] == "mesh_single_branch_2":
+            kwargs_geometry["w2_horiz"] = config["w2_horiz"]
+        geometry = get_geometry(
+            config["builder"],
+            prune_from=[row_start, row_stop, 0, config["stim_width"]],
+            **kwargs_geometry,
+        )
+        labels = geometry["labels"]
+        list_points.append(
+            dict(
+                geometry=geometry,
+                cells_pace=cells_in(labels, (rows, np.s_[: config["stim_width"]])),
+                cells_x1=cells_in(labels, (rows, config["x1"])),
+                cells_x2=cells_in(labels, (rows, config["x2"])),
+            )
+        )
+
+    offsets, src, dst = stack_geometries([point["geometry"] for point in list_points])
+    ncells = int(offsets[-1])
+    if args.engine == "cpu":
+        s = SimulationCPU(m, p, ncells=ncells)
+    else:
+        s = myokit.SimulationOpenCL(m, p, ncells=ncells, diffusion=True, precision=64)
+    s.set_connections(edges_to_connections(src, dst, conductance=args.conductance))
+    s.set_state(state0)
+    s.set_step_size(step_size=args.dt)
+    s.set_paced_cell_list(
+        np.concatenate(
+            [
+                point["cells_pace"] + offset
+                for point, offset in zip(list_points, offsets)
+            ]
+        ).tolist()
+    )
+    s.run(args.tmax, log=myokit.LOG_NONE)
+    t_act = activation_map(m, s.state(), ncells)["t_act"].values
+
+    return [
+        (
+            active_time(t_act[offset:], point["cells_x1"]),
+            active_time(t_act[offset:], point["cells_x2"]),
+        )
+        for point, offset in zip(list_points, offsets)
+    ]
+
+
+tic = time.perf_counter()
+times = []
+for i_chunk in range(0, len(df), args.chunk_size):
+    times += simulate(df.iloc[i_chunk : i_chunk + args.chunk_size])
+    print(f"Simulated {len(times)} of {len(df)} points")
+runtime_tissue = time.perf_counter() - tic
+print(f"Tissue simulations took {runtime_tissue:0.4f} seconds")
+df["active_left_tissue"], df["active_right_tissue"] = np.array(times).T
+df["block_tissue"] = np.isnan(df["active_right_tissue"])
+
+# Calibration and held-out sets, by alternate values of theta
+thetas = sorted(df["theta"].unique())
+held_out = [theta for i, theta in enumerate(thetas) if i % 2 == args.held_out]
+df["held_out"] = df["theta"].isin(held_out)
+df_cal = df[~df["held_out"]]
+
+# Largest margin that flags all blocking points of the calibration set (the
+# automaton blocking counts as flagged for any margin)
+delay_block = df_cal.loc[df_cal["block_tissue"], "delay_ratio"]
+delay_block = delay_block[np.isfinite(delay_block)]
+delay_margin = (
+    float(np.nextafter(delay_block.min(), -np.inf)) if len(delay_block) else 0
+)
+
+
+def rates(df_set, margin):
+    """Block rate in the tissue, false negative rate and fraction flagged of a
+    set of points, with the given delay margin"""
+
+    flagged = (df_set["stop_reason"] == "block") | (df_set["delay_ratio"] > margin)
+    block = df_set["block_tissue"]
+    return dict(
+        points=len(df_set),
+        block_tissue=int(block.sum()),
+        flagged=float(flagged.mean()),
+        false_negative_rate=float((block & ~flagged).sum() / max(block.sum(), 1)),
+        false_positive_rate=float((flagged & ~block).sum() / max((~block).sum(), 1)),
+    )
+
+
+df["flagged"] = (df["stop_reason"] == "block") | (df["delay_ratio"] > delay_margin)
+df.to_csv(dir_name + "points.csv", index=False)
+
+calibration = dict(
+    screen_dir=args.screen_dir,
+    delay_margin=delay_margin,
+    calibration=rates(df_cal, delay_margin),
+    held_out=rates(df[df["held_out"]], delay_margin),
+    held_out_screen_margin=rates(df[df["held_out"]], config["delay_margin"]),
+    runtime_tissue_per_geometry=runtime_tissue / len(df),
+)
+json.dump(calibration, open(dir_name + "calibration.json", "w"), indent=1)
+print(json.dumps(calibration, indent=1))
+print(f"Calibration written to {dir_name}calibration.json")
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18 October, 2026
+
+Calibrate the eikonal model (eikonal.py) against tissue simulations of the
+FHN model on branch geometries, and report its error envelope.
+
+All geometries of the sweep are simulated together (as in batch mode of
+sim_branch2.py), recording the activation time of every cell with an
+instrumented model (instrument.py), from the pre-paced state of a single cell
+(prepace.py) as in the sim script. The conduction velocity and the
+activation time of the paced cells are fitted to the activation times in the
+horizontal channel before the junction, then the eikonal model is solved for
+each diffusion length of the curvature correction (by default only D = 0,
+without correction). Errors in the activation times at x1 and x2 (past the
+junction), in the conduction time between them, and over the whole activation
+map, and whether each model blocks (x_block, past the junction, is not
+activated) are written to output_eikonal/, with the calibration (the
+diffusion length with the fewest points where only one model blocks, then the
+smallest mean error over the activation maps) in calibration.json, as read by
+sim_eikonal.py.
+
+@author: tbury
+"""
+
+import numpy as np
+import pandas as pd
+import os
+import time
+
+import myokit as myokit
+
+import tyro
+from dataclasses import dataclass
+from typing import Tuple
+
+from engine import SimulationCPU
+from prepace import get_prepaced_state
+from eikonal import solve_eikonal
+from instrument import get_instrumented_model, initial_state, activation_map
+from funs import get_geometry, edges_to_connections, cells_in, stack_geometries
+
+import datetime
+import pytz
+
+import json
+
+# Get date and time in zone ET
+newYorkTz = pytz.timezone("America/New_York")
+datetime_now = datetime.datetime.now(newYorkTz).strftime("%Y%m%d-%H%M%S")
+
+
+@dataclass
+class Args:
+    run_name: str = "mac"
+    """name of the run"""
+    engine: str = "cpu"
+    """simulation engine: opencl (myokit.SimulationOpenCL) or cpu (SimulationCPU in engine.py)"""
+    model: str = "../mmt_files/fhn.mmt"
+    """mmt file of the cell model"""
+    fhn_eps: float = 0.015
+    """relaxation speed of recovery variable"""
+    fhn_a: float = 0.12
+    """excitability of cell"""
+    conductance: float = 4
+    """Cell-to-cell conductance"""
+    active_thresh: float = 0.5
+    """threshold in membrane potential to register as active"""
+    stim_duration: float = 1
+    """duration of stimulus applied to the paced cells"""
+    dt: float = 5e-3
+    """integration time step"""
+    tmax: float = 300
+    """time to run simulation up to"""
+    prepace_tol: float = 0
+    """stop pre-pacing once the relative change in state per beat stays below this (0 to pace all 1000 beats)"""
+    prepace_n_stable: int = 5
+    """number of consecutive beats below prepace_tol required to stop pre-pacing"""
+    prepace_scale_floor: float = 1.0
+    """smallest magnitude the change in each state is relative to when checking prepace_tol (states of FHN rest at 0 and vary over about 1)"""
+    prepace_method: str = "pacing"
+    """pre-pacing method: pacing (beat by beat) or shooting (Newton-Krylov, see prepace.py)"""
+
+    # Sweep of geometries (defaults of sim_branch2.py)
+    thetas: Tuple[int, ...] = (30, 60, 90, 120, 150)
+    """angles of diagonal channel"""
+    w2s: Tuple[int, ...] = (5, 10, 20, 30)
+    """widths of diagonal channel"""
+    l1: int = 120
+    """length of horizontal channel before and after junction"""
+    w1: int = 10
+    """width of horizontal channel"""
+    h: int = 40
+    """height of the diagonal channel"""
+    stim_width: int = 2
+    """width of area in which to stimulate"""
+    x1: int = 20
+    """left location of where to record activation time"""
+    x2: int = 230
+    """right location of where to record activation time (past the junction at l1)"""
+    x_block: int = 180
+    """location past the junction that is not activated in case of conduction block"""
+
+    # Eikonal model
+    diffusion_lengths: Tuple[float, ...] = (0,)
+    """diffusion lengths D of the curvature correction to try (in cells, 0 for none; the correction is experimental and off by default, see eikonal.py)"""
+    iterations: int = 3
+    """number of solves with curvature correction"""
+
+
+args = tyro.cli(Args)
+print(args)
+
+dir_name = f"output_eikonal/{datetime_now}-{args.run_name}/"
+os.makedirs(dir_name, exist_ok=True)
+json.dump(vars(args), open(dir_name + "config.json", "w"))
+
+# Geometries
+row_start, row_stop = args.h, args.h + args.w1
+rows = np.s_[row_start:row_stop]
+list_points = []
+for theta in args.thetas:
+    for w2 in args.w2s:
+        geometry = get_geometry(
+            "mesh_single_branch_2",
+            l1=args.l1,
+            w1=args.w1,
+            h=args.h,
+            w2=w2,
+            theta=theta,
+            prune_from=[row_start, row_stop, 0, args.stim_width],
+        )
+        labels = geometry["labels"]
+        list_points.append(
+            dict(
+                theta=theta,
+                w2=w2,
+                geometry=geometry,
+                cells_pace=cells_in(labels, (rows, np.s_[: args.stim_width])),
+                cells_x1=cells_in(labels, (rows, args.x1)),
+                cells_x2=cells_in(labels, (rows, args.x2)),
+                cells_block=cells_in(labels, (rows, args.x_block)),
+            )
+        )
+
+offsets, src, dst = stack_geometries([point["geometry"] for point in list_points])
+ncells = int(offsets[-1])
+connections = edges_to_connections(src, dst, conductance=args.conductance)
+list_cells_pace = np.concatenate(
+    [point["cells_pace"] + offset for point, offset in zip(list_points, offsets)]
+).tolist()
+print(f"Simulating {len(list_points)} geometries with {ncells} cells")
+
+# Tissue simulation of all geometries, recording activation times
+m = myokit.load_model(args.model)
+params = {}
+if m.has_variable("membrane.epsilon"):
+    # Parameters as set by sim_branch2.py, so that the pre-paced state is
+    # shared through the cache
+    params["membrane.epsilon"] = args.fhn_eps
+    params["membrane.a"] = args.fhn_a
+    params["membrane.b"] = 0.5
+    params["membrane.c"] = 1
+    params["membrane.d"] = 0
+for key, value in params.items():
+    m.set_value(key, value)
+
+# Pre-pacing of a single cell with the protocol of the sim script (loaded
+# from cache if already done for this model, parameters and protocol)
+state0, info_pre = get_prepaced_state(
+    m,
+    args.model,
+    params,
+    bcl=1000,
+    duration=args.stim_duration,
+    offset=15,
+    level=1,
+    num_beats=1000,
+    tol=args.prepace_tol or None,
+    n_stable=args.prepace_n_stable,
+    scale_floor=args.prepace_scale_floor,
+    method=args.prepace_method,
+)
+print("Pre-pacing of single cell finished after {} beats".format(info_pre["beats"]))
+state0 = initial_state(state0)
+m = get_instrumented_model(m, args.active_thresh)
+p = myokit.Protocol()
+p.schedule(1, 15, args.stim_duration)
+
+if args.engine == "cpu":
+    s = SimulationCPU(m, p, ncells=ncells)
+else:
+    s = myokit.SimulationOpenCL(m, p, ncells=ncells, diffusion=True, precision=64)
+s.set_connections(connections)
+s.set_state(state0)
+s.set_step_size(step_size=args.dt)
+s.set_paced_cell_list(list_cells_pace)
+tic = time.perf_counter()
+s.run(args.tmax, log=myokit.LOG_NONE)
+runtime_tissue = time.perf_counter() - tic
+print(f"Tissue simulation took {runtime_tissue:0.4f} seconds")
+df_map = activation_map(m, s.state(), ncells)
+for point, offset in zip(list_points, offsets):
+    point["t_tissue"] = df_map["t_act"].values[
+        offset : offset + len(point["geometry"]["coords"])
+    ]
+
+
+def active_time(t_act, cells):
+    """Activation time of the cells at a location (median over the cells, NaN
+    if fewer than half of them activated)"""
+
+    t = t_act[cells]
+    if np.mean(np.isfinite(t)) < 0.5:
+        return np.nan
+    return np.median(t[np.isfinite(t)])
+
+
+# Conduction velocity (cells/ms) and activation time of the paced cells,
+# from a linear fit of activation time against column in the horizontal
+# channel between x1 and halfway to the junction
+cols_fit = np.arange(args.x1, (args.x1 + args.l1) // 2)
+t_fit, c_fit = [], []
+for point in list_points:
+    labels = point["geometry"]["labels"]
+    for col in cols_fit:
+        cells = cells_in(labels, (rows, col))
+        t_fit.append(point["t_tissue"][cells])
+        c_fit.append(np.full(len(cells), col))
+t_fit, c_fit = np.concatenate(t_fit), np.concatenate(c_fit)
+valid = np.isfinite(t_fit)
+slope, intercept = np.polyfit(c_fit[valid], t_fit[valid], 1)
+cv = 1 / slope
+# Seeds are the paced columns, ending at column stim_width - 1
+t_seeds = intercept + (args.stim_width - 1) * slope
+print(f"Fitted conduction velocity {cv:0.4f} cells/ms, seed time {t_seeds:0.4f} ms")
+
+# Eikonal model for each diffusion length
+list_dict = []
+for diffusion_length in args.diffusion_lengths:
+    for point in list_points:
+        tic = time.perf_counter()
+        t_eik = solve_eikonal(
+            point["geometry"],
+            point["cells_pace"],
+            cv,
+            t_seeds=t_seeds,
+            diffusion_length=diffusion_length,
+            iterations=args.iterations,
+        )
+        runtime = time.perf_counter() - tic
+        # Cells activated after the end of the tissue simulation count as not
+        # activated, as in the tissue
+        t_eik = np.where(t_eik <= args.tmax, t_eik, np.nan)
+        t_tissue = point["t_tissue"]
+
+        both = np.isfinite(t_eik) & np.isfinite(t_tissue)
+        dict_point = dict(
+            diffusion_length=diffusion_length,
+            theta=point["theta"],
+            w2=point["w2"],
+            runtime=runtime,
+        )
+        for name, t_act in [("tissue", t_tissue), ("eikonal", t_eik)]:
+            dict_point[f"active_left_{name}"] = active_time(t_act, point["cells_x1"])
+            dict_point[f"active_right_{name}"] = active_time(t_act, point["cells_x2"])
+            dict_point[f"conduction_time_{name}"] = (
+                dict_point[f"active_right_{name}"] - dict_point[f"active_left_{name}"]
+            )
+            dict_point[f"block_{name}"] = bool(
+                np.isnan(active_time(t_act, point["cells_block"]))
+            )
+        dict_point["error_conduction_time"] = abs(
+            dict_point["conduction_time_eikonal"] - dict_point["conduction_time_tissue"]
+        )
+        dict_point["error_map_max"] = np.max(np.abs(t_eik - t_tissue)[both])
+        dict_point["error_map_mean"] = np.mean(np.abs(t_eik - t_tissue)[both])
+        dict_point["mismatch"] = int(
+            np.sum(np.isfinite(t_eik) != np.isfinite(t_tissue))
+        )
+        list_dict.append(dict_point)
+
+df = pd.DataFrame(list_dict)
+df.to_csv(dir_name + "errors.csv", index=False)
+
+# Error envelope of each diffusion length, with errors in conduction time
+# over the points where both models reach x2, and the points that block in
+# the tissue but not in the eikonal model (missed) or the other way round
+df["block_mismatch"] = df["block_tissue"] != df["block_eikonal"]
+df["block_missed"] = df["block_tissue"] & ~df["block_eikonal"]
+df_envelope = df.groupby("diffusion_length").agg(
+    block_tissue=("block_tissue", "sum"),
+    block_eikonal=("block_eikonal", "sum"),
+    block_missed=("block_missed", "sum"),
+    block_mismatch=("block_mismatch", "sum"),
+    max_error_conduction_time=("error_conduction_time", "max"),
+    mean_error_conduction_time=("error_conduction_time", "mean"),
+    max_error_map=("error_map_max", "max"),
+    mean_error_map=("error_map_mean", "mean"),
+    mismatch=("mismatch", "sum"),
+    runtime=("runtime", "mean"),
+)
+print(df_envelope.to_string())
+print("Points that block in the tissue or the eikonal model")
+print(
+    df[df["block_tissue"] | df["block_eikonal"]][
+        ["diffusion_length", "theta", "w2", "block_tissue", "block_eikonal"]
+    ].to_string(index=False)
+)
+
+# Best diffusion length: fewest points where only one model blocks, then
+# smallest mean error over the activation maps
+best = df_envelope.sort_values(["block_mismatch", "mean_error_map"]).index[0]
+calibration = dict(
+    model=args.model,
+    cv=float(cv),
+    t_seeds=float(t_seeds),
+    diffusion_length=float(best),
+    iterations=args.iterations,
+    runtime_tissue_per_geometry=runtime_tissue / len(list_points),
+    **{key: float(value) for key, value in df_envelope.loc[best].items()},
+)
+json.dump(calibration, open(dir_name + "calibration.json", "w"), indent=1)
+print(f"Calibration written to {dir_name}calibration.json")
+print(calibration)
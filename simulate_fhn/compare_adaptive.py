@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18 October, 2026
+
+Compare adaptive time stepping of the CPU engine (engine.py) with fixed steps
+on a branch geometry. Activation times of all cells (first upward crossing of
+active_thresh, interpolated within steps) are compared with a fixed step
+reference run at a smaller time step, along with the number of steps,
+right-hand side evaluations and run time.
+
+@author: tbury
+"""
+
+import numpy as np
+import pandas as pd
+import time
+
+import myokit as myokit
+
+import tyro
+from dataclasses import dataclass
+from typing import Tuple
+
+from engine import SimulationCPU
+from funs import get_geometry, edges_to_connections, cells_in
+
+
+@dataclass
+class Args:
+    model: str = "../mmt_files/fhn.mmt"
+    """mmt file of the cell model"""
+    fhn_eps: float = 0.015
+    """relaxation speed of recovery variable"""
+    fhn_a: float = 0.12
+    """excitability of cell"""
+    active_thresh: float = 0.5
+    """threshold in membrane potential to register as active"""
+    conductance: float = 4
+    """Cell-to-cell conductance"""
+    dt: float = 5e-3
+    """time step of the fixed step run, and smallest adaptive step"""
+    refine: int = 8
+    """factor by which dt is reduced for the reference run"""
+    tols: Tuple[float, ...] = (1e-2, 1e-3, 1e-4)
+    """tolerances of the adaptive runs"""
+    max_error: float = 0.5
+    """largest acceptable error in activation time"""
+    integrator: str = "euler"
+    """time stepping of the cpu engine: euler or rush_larsen"""
+    diffusion: str = "explicit"
+    """diffusion step of the cpu engine: explicit, backward_euler or crank_nicolson"""
+    tmax: float = 300
+    """time to run simulation up to"""
+    l1: int = 60
+    """length of horizontal channel before and after junction"""
+    w1: int = 10
+    """width of horizontal channel"""
+    h: int = 20
+    """height of the diagonal channel"""
+    w2: int = 10
+    """width of diagonal channel"""
+    theta: int = 150
+    """angle of diagonal channel"""
+    stim_width: int = 5
+    """width of area in which to stimulate"""
+
+
+args = tyro.cli(Args)
+print(args)
+
+# Geometry
+rows = np.s_[args.h : args.h + args.w1]
+geometry = get_geometry(
+    "mesh_single_branch_2",
+    l1=args.l1,
+    w1=args.w1,
+    h=args.h,
+    w2=args.w2,
+    theta=args.theta,
+    prune_from=[args.h, args.h + args.w1, 0, args.stim_width],
+)
+ncells = len(geometry["coords"])
+connections = edges_to_connections(
+    geometry["src"], geometry["dst"], conductance=args.conductance
+)
+list_cells_pace = cells_in(
+    geometry["labels"], (rows, np.s_[: args.stim_width])
+).tolist()
+print(f"Geometry has {ncells} cells")
+
+# Model and protocol (starting from the initial state of the model file)
+m = myokit.load_model(args.model)
+if m.has_variable("membrane.epsilon"):
+    m.set_value("membrane.epsilon", args.fhn_eps)
+    m.set_value("membrane.a", args.fhn_a)
+p = myokit.Protocol()
+p.schedule(1, 15, 1)
+
+
+def run(dt, tol=None, integrator="euler", diffusion="explicit"):
+    """Run simulation and return activation times, statistics and run time"""
+
+    s = SimulationCPU(m, p, ncells=ncells, integrator=integrator, diffusion=diffusion)
+    s.set_connections(connections)
+    s.set_step_size(step_size=dt)
+    s.set_paced_cell_list(list_cells_pace)
+    s.set_adaptive(tol)
+    s.set_activation_threshold(args.active_thresh)
+    tic = time.perf_counter()
+    s.run(args.tmax, log=myokit.LOG_NONE)
+    toc = time.perf_counter()
+    return s.activation_times(), s.statistics(), toc - tic
+
+
+t_ref, _, _ = run(args.dt / args.refine)
+
+runs = {"fixed": run(args.dt, integrator=args.integrator, diffusion=args.diffusion)}
+for tol in args.tols:
+    runs[f"adaptive {tol:g}"] = run(
+        args.dt, tol, integrator=args.integrator, diffusion=args.diffusion
+    )
+
+list_dict = []
+for name, (t_act, stats, runtime) in runs.items():
+    error = np.abs(t_act - t_ref)
+    list_dict.append(
+        dict(
+            run=name,
+            runtime=runtime,
+            **stats,
+            max_error=np.nanmax(error),
+            mean_error=np.nanmean(error),
+            mismatch=int(np.sum(np.isnan(t_act) != np.isnan(t_ref))),
+            ok=bool(np.nanmax(error) <= args.max_error),
+        )
+    )
+
+df = pd.DataFrame(list_dict)
+print(df.to_string(index=False))
@@ -22,7 +22,8 @@ import imageio.v2 as imageio
 
 from funs import (
     mesh_single_branch_2,
-    get_connections,
+    get_geometry,
+    cells_in,
 )
 
 import json
@@ -43,21 +44,23 @@ df = pd.read_csv(filepath)
 # Get mapping from cell index to cell position
 # ----------
 
-# Create cell mesh that defines geometry
-cell_mesh = mesh_single_branch_2(
+# Create cell mesh that defines geometry (loaded from cache if already built)
+geometry = get_geometry(
+    "mesh_single_branch_2",
     l1=config["l1"],
     w1=config["w1"],
     h=config["h"],
     # l2=config["l2"],
     w2=config["w2"],
     theta=config["theta"],
+    w2_horiz=config.get("w2_horiz", False),
     # slope=config["slope"],
     # l_solo=config["l_solo"],
 )
+cell_mesh = geometry["mesh"]
 
-# Get connections
-pos_to_index, connections = get_connections(cell_mesh)
-index_to_pos = {value: key for key, value in pos_to_index.items()}
+# Label image of cell indices (-1 for no cell)
+labels = geometry["labels"]
 
 
 # ----------
@@ -65,12 +68,11 @@ index_to_pos = {value: key for key, value in pos_to_index.items()}
 # ----------
 
 
-def get_active_time(list_coords, thresh=0.5):
+def get_active_time(list_idx, thresh=0.5):
     """
-    Compute first activation time of cells at cell_coords (averaged)
+    Compute first activation time of cells with indices list_idx (averaged)
     """
 
-    list_idx = [pos_to_index[coord] for coord in list_coords]
     list_cols = ["time"] + [f"cell {idx}" for idx in list_idx]
     df_left = df[list_cols]
     # Take mean over each cell at these positions
@@ -87,12 +89,10 @@ def get_active_time(list_coords, thresh=0.5):
 
 x1 = 20
 x2 = 120
-yvals = np.arange(config["h"], config["h"] + config["w1"])
+rows = np.s_[config["h"] : config["h"] + config["w1"]]
 
 # Left activation
-list_coords = [(y, x1) for y in yvals]
-active_time_left = get_active_time(list_coords)
+active_time_left = get_active_time(cells_in(labels, (rows, x1)))
 
 # Right activation
-list_coords = [(y, x2) for y in yvals]
-active_time_right = get_active_time(list_coords)
+active_time_right = get_active_time(cells_in(labels, (rows, x2)))
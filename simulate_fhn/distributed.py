@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18 October, 2026
+
+Multi-process version of the CPU engine for meshes too large for one process.
+The cell graph is split into partitions (funs.graph_partition), each simulated
+by its own process over state buffers in shared memory, with the membrane
+potential of ghost cells synchronised every step. Processes are forked, so
+this requires Linux (or another system with the fork start method).
+
+@author: tbury
+"""
+
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+import traceback
+import weakref
+
+import myokit
+
+from engine import SimulationCPU
+from funs import get_laplacian, graph_partition
+
+
+def _release(shm):
+    """Close and remove a shared memory block"""
+    shm.close()
+    shm.unlink()
+
+
+class SimulationDistributed(SimulationCPU):
+    """Simulate a model on a network of connected cells with several processes
+
+    The cells are split into nprocs partitions with few connections between
+    them (see funs.graph_partition), and stored partition by partition in two
+    (n_states, n_cells) state buffers in shared memory. At each step, every
+    process reads the state of its cells and the membrane potential of its
+    ghost cells (the cells of other partitions they are connected to) from
+    one buffer, writes the new state of its cells to the other buffer, and
+    waits at a barrier for the other processes. Each buffer is therefore only
+    read or only written during a step, and ghost cells are exchanged through
+    shared memory without copies between processes.
+
+    The interface is that of SimulationCPU, with fixed steps and explicit
+    diffusion (forward Euler or Rush-Larsen), so the same logs and probes as
+    in the sim_branch scripts can be used. Each run starts one process per
+    partition. Logged cells are gathered from the processes at the end of
+    the run.
+
+    Args:
+        model: myokit.Model with variables bound to pace and diffusion_current
+        protocol: myokit.Protocol applied to the paced cells
+        ncells: number of cells
+        nprocs: number of processes (partitions)
+        backend: right-hand side kernel, "numpy" or "numba" (see codegen.py)
+        integrator: "euler" or "rush_larsen"
+    """
+
+    def __init__(
+        self,
+        model,
+        protocol=None,
+        ncells=1,
+        nprocs=2,
+        backend="numpy",
+        integrator="euler",
+    ):
+        if "fork" not in mp.get_all_start_methods():
+            raise RuntimeError("SimulationDistributed requires the fork start method")
+        super().__init__(
+            model, protocol, ncells=ncells, backend=backend, integrator=integrator
+        )
+        self._nprocs = nprocs
+
+        # Two state buffers in shared memory, in partition order, of which
+        # self._current holds the current state
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=max(1, 2 * self._nstates * ncells * 8)
+        )
+        self._finalizer = weakref.finalize(self, _release, self._shm)
+        self._buffers = np.ndarray(
+            (2, self._nstates, ncells), dtype=np.float64, buffer=self._shm.buf
+        )
+        self._current = 0
+
+        # Cells in partition order, position of each cell in that order, and
+        # boundaries of the positions of each partition
+        self._order = np.arange(ncells)
+        self._position = np.arange(ncells)
+        self._bounds = np.linspace(0, ncells, nprocs + 1).round().astype(np.int64)
+        self._state = None
+        self._write_state(self._default_state)
+
+    def close(self):
+        """Release the shared memory (the simulation can no longer be used)"""
+        self._buffers = None
+        self._finalizer()
+
+    def _read_state(self):
+        """Current state as an (n_states, n_cells) array in cell order"""
+        return self._buffers[self._current][:, self._position]
+
+    def _write_state(self, state):
+        self._buffers[self._current][:, self._position] = state
+
+    def set_connections(self, connections):
+        """Set connections from a list of (cell1, cell2, conductance) tuples,
+        and partition the cells"""
+
+        connections = np.asarray(connections, dtype=float).reshape(-1, 3)
+        src = connections[:, 0].astype(np.int64)
+        dst = connections[:, 1].astype(np.int64)
+        self.set_laplacian(
+            get_laplacian(src, dst, self._ncells, conductance=connections[:, 2])
+        )
+        self.set_parts(graph_partition(src, dst, self._ncells, self._nprocs))
+
+    def set_parts(self, parts):
+        """Set the partition (process index) of each cell"""
+
+        parts = np.asarray(parts, dtype=np.int64)
+        if parts.size != self._ncells or parts.min() < 0 or parts.max() >= self._nprocs:
+            raise ValueError("parts must give a partition below nprocs for each cell")
+        state = self._read_state()
+        self._order = np.argsort(parts, kind="stable")
+        self._position = np.empty_like(self._order)
+        self._position[self._order] = np.arange(self._ncells)
+        counts = np.bincount(parts, minlength=self._nprocs)
+        self._bounds = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self._write_state(state)
+
+    def set_adaptive(self, abs_tol=None, max_step_size=None):
+        if abs_tol is not None:
+            raise ValueError("SimulationDistributed uses fixed steps")
+
+    def set_active_set(self, v_rest=None, v_tol=1.0, rate_tol=None, coarse_steps=8):
+        if v_rest is not None:
+            raise ValueError("SimulationDistributed steps all cells")
+
+    def set_activation_threshold(self, thresh=None):
+        if thresh is not None:
+            raise ValueError(
+                "SimulationDistributed does not record activation times, use an"
+                " instrumented model (see instrument.py)"
+            )
+
+    def set_state(self, state):
+        """Set state of one cell (applied to all) or of all cells (cell-major)"""
+        self._write_state(self._state_array(state))
+
+    def state(self):
+        """Current state of all cells as a flat cell-major list"""
+        return list(self._read_state().T.ravel())
+
+    def reset(self):
+        """Reset time and state to their defaults"""
+        self._time = 0.0
+        self._write_state(self._default_state)
+
+    def pre(self, duration, progress=None):
+        """Run without logging, then use the final state as default state"""
+        self.run(duration, log=[], progress=progress)
+        self._default_state = self._read_state()
+        self._time = 0.0
+
+    def _worker(self, rank, duration, log_interval, log, log_cells, barrier, conn, now):
+        """Simulate the cells of one partition, and send the logged values"""
+
+        try:
+            start, stop = self._bounds[rank], self._bounds[rank + 1]
+            cells = self._order[start:stop]
+
+            # Laplacian of the cells of the partition, acting on the membrane
+            # potential of the partition and its ghost cells
+            laplacian = self._laplacian[cells][:, self._order].tocsr()
+            halo = np.unique(laplacian.indices)
+            laplacian = laplacian[:, halo].tocsr()
+
+            pacing = myokit.PacingSystem(self._protocol) if self._protocol else None
+            paced = self._paced[cells].astype(float)
+            zeros = np.zeros(stop - start)
+            c = self._constants
+            if self._fields or self._backend == "numba":
+                c = np.tile(c[:, None], (1, stop - start))
+                for i, values in self._fields.items():
+                    c[i] = values[cells]
+            rhs, iv, dt = self._rhs, self._iv, self._step_size
+            rush_larsen = self._integrator == "rush_larsen"
+            buffers, current = self._buffers, self._current
+            dy = np.empty((self._nstates, stop - start))
+
+            # Logged cells of this partition, as (index in the log of the
+            # variable, column in the partition) for each logged state
+            log_local = {}
+            for var, logged in log_cells.items():
+                position = self._position[logged]
+                mine = np.nonzero((position >= start) & (position < stop))[0]
+                log_local[var] = (mine, position[mine] - start)
+
+            # Steps as in SimulationCPU.run, so all processes take the same steps
+            t = t_event = self._time
+            nsteps = 0
+            tmax = t + duration
+            eps = 1e-9 * max(1.0, abs(tmax))
+            next_log = t
+            logged_times, logged_states = [], []
+            while t < tmax - eps:
+                y = buffers[current][:, start:stop]
+                if log and t >= next_log - eps:
+                    logged_times.append(t)
+                    logged_states.append(
+                        [
+                            y[var.index(), columns]
+                            for var, (_, columns) in log_local.items()
+                        ]
+                    )
+                    next_log += log_interval
+
+                t_stop = tmax
+                pace = zeros
+                if pacing is not None:
+                    pacing.advance(t)
+                    pace = pacing.pace() * paced
+                    t_stop = min(t_stop, pacing.next_time())
+                t_next = min(t_event + (nsteps + 1) * dt, t_stop)
+                h = t_next - t
+
+                i_diff = laplacian @ buffers[current][iv, halo]
+                if rush_larsen:
+                    rhs(t, y, pace, i_diff, c, dy, h)
+                else:
+                    rhs(t, y, pace, i_diff, c, dy)
+                np.multiply(dy, h, out=dy)
+                np.add(y, dy, out=buffers[1 - current][:, start:stop])
+
+                # Wait until all partitions have read the current buffer
+                barrier.wait()
+                current = 1 - current
+
+                if t_next < t_event + (nsteps + 1) * dt - eps:
+                    t_event, nsteps = t_next, 0
+                else:
+                    nsteps += 1
+                t = t_next
+                if rank == 0:
+                    now.value = t
+
+            # Logged values of each logged state, in the order of log_cells
+            # (variables can not be sent between processes)
+            values = [
+                (
+                    mine,
+                    np.array([states[k] for states in logged_states]).reshape(
+                        len(logged_times), len(mine)
+                    ),
+                )
+                for k, (mine, _) in enumerate(log_local.values())
+            ]
+            conn.send(("done", logged_times, values, t, current))
+        except Exception:
+            # Release the other processes waiting at the barrier
+            barrier.abort()
+            conn.send(("error", traceback.format_exc()))
+        finally:
+            conn.close()
+
+    def run(self, duration, log=None, log_interval=1.0, progress=None):
+        """Run the simulation for the given duration
+
+        Arguments and the returned DataLog are as in SimulationCPU.run.
+        """
+
+        log, log_cells, log_previous = self._parse_log(log)
+
+        ctx = mp.get_context("fork")
+        barrier = ctx.Barrier(self._nprocs)
+        now = ctx.Value("d", self._time, lock=False)
+        processes, conns = [], []
+        for rank in range(self._nprocs):
+            conn_recv, conn_send = ctx.Pipe(duplex=False)
+            process = ctx.Process(
+                target=self._worker,
+                args=(
+                    rank,
+                    duration,
+                    log_interval,
+                    bool(log),
+                    log_cells,
+                    barrier,
+                    conn_send,
+                    now,
+                ),
+                daemon=True,
+            )
+            process.start()
+            conn_send.close()
+            processes.append(process)
+            conns.append(conn_recv)
+
+        if progress is not None:
+            progress.enter("Running distributed CPU simulation")
+        results = {}
+        try:
+            while len(results) < self._nprocs:
+                for conn in wait([c for c in conns if c not in results], timeout=0.1):
+                    try:
+                        results[conn] = conn.recv()
+                    except EOFError:
+                        results[conn] = ("error", "worker process exited")
+                if progress is not None:
+                    if not progress.update((now.value - self._time) / duration):
+                        raise myokit.SimulationCancelledError()
+        finally:
+            if progress is not None:
+                progress.exit()
+            for process in processes:
+                if len(results) < self._nprocs:
+                    process.terminate()
+                process.join()
+
+        errors = [result[1] for result in results.values() if result[0] == "error"]
+        if errors:
+            raise myokit.SimulationError("Worker process failed:\n" + errors[0])
+
+        # Merge the logged cells of all partitions
+        results = [results[conn] for conn in conns]
+        logged_times = results[0][1]
+        values = {
+            var: np.empty((len(logged_times), len(cells)))
+            for var, cells in log_cells.items()
+        }
+        for _, _, values_part, _, _ in results:
+            for var, (mine, values_var) in zip(log_cells, values_part):
+                values[var][:, mine] = values_var
+        self._time, self._current = results[0][3], results[0][4]
+
+        return self._make_log(logged_times, values, log_cells, log_previous)
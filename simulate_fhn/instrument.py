@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18 October, 2026
+
+Add state variables to a myokit model that record activation times, so that
+the activation map of a tissue simulation can be read from its final state
+instead of being computed from the logged voltage of every cell.
+Instrumented models are stored in the cache directory.
+
+@author: tbury
+"""
+
+import numpy as np
+import pandas as pd
+import os
+import hashlib
+
+import myokit
+
+from funs import CACHE_DIR
+
+# Name of the component added to the model
+COMPONENT = "activation"
+
+# States added to the model, appended (in this order) to the model states
+ACTIVATION_STATES = ["activation.below", "activation.apd", "activation.t_act"]
+
+# Version of the added states, part of the cache key of instrumented models
+INSTRUMENT_VERSION = 2
+
+
+def add_activation_times(model, thresh):
+    """Add states recording the activation time of a cell
+
+    The states are accumulators that only change at a rate 0 or 1, so they do
+    not depend on the integration method (forward Euler in
+    myokit.SimulationOpenCL and SimulationCPU):
+        below: total time the membrane potential is at or below thresh
+        apd: total time the membrane potential is above thresh, after it was
+            below thresh
+        t_act: time until the membrane potential first crosses thresh
+            upwards
+    All start at 0 at the start of the simulation. A cell has activated if
+    apd > 0, at time t_act (the first time step at which the membrane
+    potential is above thresh after having been below it), and repolarized at
+    t_act + apd if it activated only once (as with the single stimulus of the
+    sim_branch scripts). A cell that starts above thresh only activates once
+    it has fallen below thresh and crossed it again.
+
+    Args:
+        model: myokit.Model with a variable labelled membrane_potential
+        thresh: threshold in membrane potential (the literal constant
+            activation.thresh of the new model)
+
+    Returns:
+        myokit.Model - copy of model with the component activation
+    """
+
+    model = model.clone()
+    vm = model.label("membrane_potential")
+    if vm is None:
+        raise ValueError("model has no variable labelled membrane_potential")
+
+    component = model.add_component(COMPONENT)
+    var = component.add_variable("thresh")
+    var.set_rhs(float(thresh))
+    var.meta["desc"] = "Threshold in membrane potential to register as active"
+
+    var = component.add_variable("below")
+    var.promote(0)
+    var.set_rhs(f"if({vm.qname()} > thresh, 0, 1)")
+    var.meta["desc"] = "Total time below the threshold"
+
+    var = component.add_variable("apd")
+    var.promote(0)
+    var.set_rhs(f"if({vm.qname()} > thresh and below > 0, 1, 0)")
+    var.meta["desc"] = "Total time active"
+
+    var = component.add_variable("t_act")
+    var.promote(0)
+    var.set_rhs(f"if(apd > 0 or ({vm.qname()} > thresh and below > 0), 0, 1)")
+    var.meta["desc"] = "Time until the first activation"
+
+    model.validate()
+
+    return model
+
+
+def get_instrumented_model(model, thresh, cache=True):
+    """Get the model from add_activation_times, using an on-disk cache
+
+    The cache file is named after a hash of the model code (including
+    parameter values), the threshold and INSTRUMENT_VERSION.
+
+    Args:
+        model: myokit.Model
+        thresh: threshold in membrane potential
+        cache: whether to read from and write to the cache
+
+    Returns:
+        myokit.Model - instrumented model
+    """
+
+    if not cache:
+        return add_activation_times(model, thresh)
+
+    key = f"{model.code()}-{float(thresh)!r}-{INSTRUMENT_VERSION}"
+    digest = hashlib.sha1(key.encode()).hexdigest()
+    filepath = os.path.join(CACHE_DIR, "models", f"{model.name()}-{digest[:16]}.mmt")
+
+    if os.path.exists(filepath):
+        return myokit.load_model(filepath)
+
+    model = add_activation_times(model, thresh)
+
+    # Write to a temporary file first so that concurrent runs never read a
+    # partially written file
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    filepath_tmp = f"{filepath}.{os.getpid()}.tmp"
+    myokit.save_model(filepath_tmp, model)
+    os.replace(filepath_tmp, filepath)
+
+    return model
+
+
+def initial_state(state):
+    """State of the instrumented model, given the state of the original model
+
+    The activation states are appended and set to zero, so that activation
+    times are counted from the start of the simulation.
+    """
+
+    return [float(x) for x in state] + [0.0] * len(ACTIVATION_STATES)
+
+
+def activation_map(model, state, ncells):
+    """Get the activation and repolarization time of each cell
+
+    Args:
+        model: instrumented myokit.Model
+        state: flat cell-major state of all cells (as from Simulation.state)
+        ncells: number of cells
+
+    Returns:
+        pd.DataFrame - t_act and t_rep of each cell (NaN if not activated)
+    """
+
+    state = np.asarray(state, dtype=float).reshape(ncells, model.count_states())
+    t_act = state[:, model.get("activation.t_act").index()]
+    apd = state[:, model.get("activation.apd").index()]
+    activated = apd > 0
+
+    return pd.DataFrame(
+        dict(
+            t_act=np.where(activated, t_act, np.nan),
+            t_rep=np.where(activated, t_act + apd, np.nan),
+        )
+    )
@@ -9,6 +9,15 @@
 declare -a THETA_VALS=(15 45 75)
 declare -a W2_VALS=(5);
 
+# Set BATCH=1 to simulate the whole grid in one job (batch mode of the sim script)
+if [ "${BATCH:-0}" = "1" ]; then
+	export THETA="${THETA_VALS[*]}"
+	export W2="${W2_VALS[*]}"
+	echo "Running batch job for THETA=($THETA), W2=($W2)"
+	sbatch single_job_cedar.sh
+	exit 0
+fi
+
 for THETA in "${THETA_VALS[@]}"; do
 	for W2 in "${W2_VALS[@]}"; do
 		export THETA=$THETA
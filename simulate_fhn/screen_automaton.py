@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18 October, 2026
+
+Screen a sweep of branch geometries (theta x w2 x w1) with the cellular
+automaton surrogate (automaton.py), to find where ionic model runs are worth
+doing. Geometries are run in chunks of stacked, disconnected networks.
+
+Steps of the automaton are converted to ms with the conduction velocity cv of
+the ionic model in a straight channel, so that activation times are written
+in the active_times.json format of sim_branch2.py (one directory per point),
+with stop_reason activated or block. A summary of all points flags those
+with block, or with a conduction time between x1 and x2 more than
+delay_margin above that of a straight channel. x2 is past the junction, as
+the front is only delayed (or blocked) by the branch past it.
+
+The automaton rarely blocks where the ionic model does, but it delays the
+front past wide branches, and block is inferred from that delay. The default
+delay_margin is calibrated against FHN tissue runs of the theta x w2 sweep
+with w1 10 (calibrate_automaton.py), fitted on alternate values of theta and
+tested on the others. On the 96 held-out points (19 blocking in the tissue),
+no block was missed and 35% of points were flagged, against 20% that block.
+The smallest delay of a blocking point is one automaton step above the margin
+in both sets, so misses are possible elsewhere. For other w1, models or
+settings of the automaton, recalibrate with calibrate_automaton.py.
+
+Before the sweep, a geometry known to block in the ionic model (known_block)
+is screened, and the run stops if it is not flagged, so that settings of the
+automaton or probes that cannot tell geometries apart are caught.
+
+@author: tbury
+"""
+
+import numpy as np
+import pandas as pd
+import os
+import time
+
+import tyro
+from dataclasses import dataclass
+from typing import Tuple
+
+from automaton import get_neighbourhood, run_automaton, channel_speed
+from funs import get_geometry, cells_in, stack_geometries
+
+import datetime
+import pytz
+
+import json
+
+# Get date and time in zone ET
+newYorkTz = pytz.timezone("America/New_York")
+datetime_now = datetime.datetime.now(newYorkTz).strftime("%Y%m%d-%H%M%S")
+
+
+@dataclass
+class Args:
+    run_name: str = "mac"
+    """name of the run"""
+    builder: str = "mesh_single_branch_2"
+    """mesh builder: mesh_single_branch_2 or mesh_double_branch_2"""
+    thetas: Tuple[int, ...] = tuple(range(10, 175, 5))
+    """angles of diagonal channel"""
+    w2s: Tuple[int, ...] = (2, 5, 10, 15, 20, 30)
+    """widths of diagonal channel"""
+    w1s: Tuple[int, ...] = (5, 10, 15)
+    """widths of horizontal channel"""
+    l1: int = 120
+    """length of horizontal channel before and after junction"""
+    h: int = 40
+    """height of the diagonal channel"""
+    w2_horiz: bool = False
+    """whether to use horizontal or perpendicular width to define width of branch (single branch only)"""
+    stim_width: int = 2
+    """width of area in which to stimulate"""
+    x1: int = 20
+    """left location of where to record activation time"""
+    x2: int = 230
+    """right location of where to record activation time (past the junction at l1)"""
+    probes: Tuple[int, ...] = ()
+    """additional locations where to record activation time"""
+
+    # Automaton
+    radius: int = 3
+    """graph distance of the neighbourhood of each cell"""
+    thresh: float = 0.35
+    """excited fraction of the neighbourhood that excites a cell"""
+    n_excited: int = 5
+    """number of steps a cell stays excited"""
+    n_refractory: int = 20
+    """number of steps a cell stays refractory"""
+    nsteps: int = 2000
+    """largest number of steps"""
+
+    # Conversion to time
+    cv: float = 0.89
+    """conduction velocity of the ionic model in a straight channel in cells/ms (0.89 for FHN defaults of sim_branch2.py)"""
+    stim_offset: float = 15
+    """time of the stimulus in ms"""
+    delay_margin: float = 0.065
+    """relative increase of conduction time over a straight channel to flag as delay (calibrated for w1 10, see calibrate_automaton.py)"""
+    known_block: Tuple[int, ...] = (90, 30, 10)
+    """geometry (theta, w2, w1) that blocks in the ionic model, checked to be flagged (empty to skip)"""
+    chunk_size: int = 100
+    """number of geometries run together"""
+    write_points: bool = True
+    """whether to write config.json and active_times.json of each point"""
+
+
+args = tyro.cli(Args)
+print(args)
+
+dir_name = f"output_automaton/{datetime_now}-{args.run_name}/"
+os.makedirs(dir_name, exist_ok=True)
+json.dump(vars(args), open(dir_name + "config.json", "w"))
+
+kwargs_automaton = dict(
+    thresh=args.thresh,
+    n_excited=args.n_excited,
+    n_refractory=args.n_refractory,
+    nsteps=args.nsteps,
+)
+
+# Time per step for each width of the horizontal channel, from the speed of
+# a planar front in a straight channel of that width
+ms_per_step = {
+    w1: channel_speed(w1, args.stim_width, radius=args.radius, **kwargs_automaton)
+    / args.cv
+    for w1 in set(args.w1s) | set(args.known_block[2:])
+}
+for w1, value in ms_per_step.items():
+    if np.isnan(value):
+        print(f"w1={w1}: planar front does not propagate, all points will block")
+
+list_points = [
+    dict(theta=theta, w2=w2, w1=w1)
+    for w1 in args.w1s
+    for theta in args.thetas
+    for w2 in args.w2s
+]
+print(f"Screening {len(list_points)} geometries")
+
+
+def get_active_time(t_act, cells, w1):
+    """Activation time of the cells at a location in ms (median over the
+    cells, NaN if fewer than half of them activated)"""
+
+    steps = t_act[cells]
+    if np.mean(steps >= 0) < 0.5:
+        return np.nan
+    return args.stim_offset + np.median(steps[steps >= 0]) * ms_per_step[w1]
+
+
+def screen(chunk):
+    """Run the automaton on the geometries of a chunk of points as one
+    network, and add the activation times at x1, x2 and probes to each point"""
+
+    geometries = []
+    for point in chunk:
+        row_start, row_stop = args.h, args.h + point["w1"]
+        kwargs_geometry = dict(
+            l1=args.l1, w1=point["w1"], h=args.h, w2=point["w2"], theta=point["theta"]
+        )
+        if args.builder == "mesh_single_branch_2":
+            kwargs_geometry["w2_horiz"] = args.w2_horiz
+        geometry = get_geometry(
+            args.builder,
+            prune_from=[row_start, row_stop, 0, args.stim_width],
+            **kwargs_geometry,
+        )
+        labels = geometry["labels"]
+        rows = np.s_[row_start:row_stop]
+        point.update(
+            cells_pace=cells_in(labels, (rows, np.s_[: args.stim_width])),
+            cells_x1=cells_in(labels, (rows, args.x1)),
+            cells_x2=cells_in(labels, (rows, args.x2)),
+            cells_probes=[cells_in(labels, (rows, x)) for x in args.probes],
+        )
+        geometries.append(geometry)
+
+    offsets, src, dst = stack_geometries(geometries)
+    weights = get_neighbourhood(src, dst, int(offsets[-1]), radius=args.radius)
+    cells_pace = np.concatenate(
+        [point["cells_pace"] + offset for point, offset in zip(chunk, offsets)]
+    )
+    t_act = run_automaton(weights, cells_pace, **kwargs_automaton)
+
+    for point, offset in zip(chunk, offsets):
+        t_point = t_act[offset:]
+        point["active_left"] = get_active_time(t_point, point["cells_x1"], point["w1"])
+        point["active_right"] = get_active_time(t_point, point["cells_x2"], point["w1"])
+        point["active_probes"] = {
+            str(x): get_active_time(t_point, cells, point["w1"])
+            for x, cells in zip(args.probes, point["cells_probes"])
+        }
+
+
+# Conduction time of a straight channel between x1 and x2
+conduction_time_straight = (args.x2 - args.x1) / args.cv
+
+
+def is_delayed(point):
+    """Whether the conduction time between x1 and x2 is more than
+    delay_margin above that of a straight channel"""
+
+    conduction_time = point["active_right"] - point["active_left"]
+    return bool(conduction_time > (1 + args.delay_margin) * conduction_time_straight)
+
+
+if args.known_block:
+    theta, w2, w1 = args.known_block
+    point = dict(theta=theta, w2=w2, w1=w1)
+    screen([point])
+    if not (np.isnan(point["active_right"]) or is_delayed(point)):
+        raise ValueError(
+            f"Geometry theta={theta}, w2={w2}, w1={w1} blocks in the ionic model "
+            "but is not flagged by the automaton (conduction time "
+            f"{point['active_right'] - point['active_left']:0.2f} ms, straight "
+            f"channel {conduction_time_straight:0.2f} ms): check x2 is past the "
+            "junction and the settings of the automaton"
+        )
+    print(f"Known block theta={theta}, w2={w2}, w1={w1} is flagged")
+
+tic = time.perf_counter()
+for i_chunk in range(0, len(list_points), args.chunk_size):
+    screen(list_points[i_chunk : i_chunk + args.chunk_size])
+toc = time.perf_counter()
+print(f"Automaton took {toc - tic:0.4f} seconds")
+
+list_dict = []
+for point in list_points:
+    conduction_time = point["active_right"] - point["active_left"]
+    blocked = np.isnan(point["active_right"])
+    list_dict.append(
+        dict(
+            theta=point["theta"],
+            w2=point["w2"],
+            w1=point["w1"],
+            active_left=point["active_left"],
+            active_right=point["active_right"],
+            conduction_time=conduction_time,
+            stop_reason="block" if blocked else "activated",
+            delay=is_delayed(point),
+        )
+    )
+
+    if args.write_points:
+        # Output directory of the point, as in batch mode of sim_branch2.py
+        dir_point = f"{dir_name}theta{point['theta']}-w2{point['w2']}-w1{point['w1']}/"
+        os.makedirs(dir_point, exist_ok=True)
+        config = dict(vars(args), theta=point["theta"], w2=point["w2"], w1=point["w1"])
+        json.dump(config, open(dir_point + "config.json", "w"))
+        dict_active_times = dict(
+            active_left=str(round(point["active_left"], 3)),
+            active_right=str(round(point["active_right"], 3)),
+            active_probes={
+                x: str(round(value, 3)) for x, value in point["active_probes"].items()
+            },
+            stop_reason=list_dict[-1]["stop_reason"],
+            t_sim=round(args.stim_offset + args.nsteps * ms_per_step[point["w1"]], 3),
+        )
+        json.dump(dict_active_times, open(dir_point + "active_times.json", "w"))
+
+df = pd.DataFrame(list_dict)
+df["interesting"] = (df["stop_reason"] == "block") | df["delay"]
+df.to_csv(dir_name + "summary.csv", index=False)
+print(df.groupby("w1")[["interesting"]].sum().to_string())
+print(f"{df['interesting'].sum()} of {len(df)} points with block or delay")
+print("Summary written to {}".format(dir_name + "summary.csv"))
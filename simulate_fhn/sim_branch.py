@@ -21,14 +21,20 @@ import myokit as myokit
 import tyro
 from dataclasses import dataclass
 
-from funs import mesh_single_branch, get_connections, mesh_double_branch
+from prepace import get_prepaced_state
+from funs import (
+    mesh_single_branch,
+    mesh_double_branch,
+    get_geometry,
+    edges_to_connections,
+    cells_in,
+)
 
 import datetime
 import pytz
 
 import json
 
-
 # Get date and time in zone ET
 newYorkTz = pytz.timezone("America/New_York")
 datetime_now = datetime.datetime.now(newYorkTz).strftime("%Y%m%d-%H%M%S")
@@ -86,36 +92,37 @@ json.dump(vars(args), open(dir_name + "config.json", "w"))
 # Geometry
 # ---------------
 
-# Create cell mesh that defines geometry
-cell_mesh = mesh_double_branch(
-    l1=args.l1, w1=args.w1, l2=args.l2, w2=args.w2, slope=args.slope, l_solo=args.l_solo
+# Create cell mesh that defines geometry (loaded from cache if already built)
+geometry = get_geometry(
+    "mesh_double_branch",
+    l1=args.l1,
+    w1=args.w1,
+    l2=args.l2,
+    w2=args.w2,
+    slope=args.slope,
+    l_solo=args.l_solo,
 )
+cell_mesh = geometry["mesh"]
 
 # Count the number of cells
 args.ncells = int(cell_mesh.sum())
 
-# Get connections
-pos_to_index, connections = get_connections(cell_mesh)
-index_to_pos = {value: key for key, value in pos_to_index.items()}
+# Label image of cell indices (-1 for no cell) and connections
+labels = geometry["labels"]
+connections = edges_to_connections(geometry["src"], geometry["dst"])
 
 # Define which cells to pace
-list_coords_pace = []
+rows = np.s_[args.l2 : args.l2 + args.w1]
 
 # if stim on the left
 if not args.stim_right:
-    for y in np.arange(args.l2, args.l2 + args.w1):
-        for x in range(args.stim_width):
-            list_coords_pace.append((y, x))
+    region_pace = (rows, np.s_[: args.stim_width])
 
 # if stim on the right
 else:
-    for y in np.arange(args.l2, args.l2 + args.w1):
-        for x in np.arange(args.l1 - args.stim_width, args.l1):
-            list_coords_pace.append((y, x))
+    region_pace = (rows, np.s_[args.l1 - args.stim_width : args.l1])
 
-list_cells_pace = []
-for coord in list_coords_pace:
-    list_cells_pace.append(pos_to_index[coord])
+list_cells_pace = cells_in(labels, region_pace).tolist()
 
 
 # ----------------
@@ -123,7 +130,8 @@ for coord in list_coords_pace:
 # ----------------
 
 # Load in model from mmt file
-m = myokit.load_model("../mmt_files/fhn.mmt")
+model_file = "../mmt_files/fhn.mmt"
+m = myokit.load_model(model_file)
 
 # Model parameters
 eps = args.fhn_eps
@@ -138,9 +146,6 @@ duration = 1  # Duration of impulse (ms)
 level = 1  # Level of stimulus (1=full)
 offset = 15
 
-# Pre-pacing protocol for each cell
-p_pre = myokit.pacing.blocktrain(bcl, duration, offset=offset, level=level)
-
 # Pacing protocol for simulation
 p = myokit.Protocol()
 p.schedule(level, offset, duration)
@@ -165,15 +170,21 @@ for key in params.keys():
         "{} is not a valid parameter".format(key)
 
 # Prepacing of single cell to set initial condition
-s_cell = myokit.Simulation(m, p_pre)
+# (loaded from cache if already done for this model, parameters and protocol)
 num_beats_pre = 1000
 print("Run pre-pacing of {} beats for single cell".format(num_beats_pre))
-s_cell.pre(num_beats_pre * bcl)
+state0, _ = get_prepaced_state(
+    m,
+    model_file,
+    params,
+    bcl=bcl,
+    duration=duration,
+    offset=offset,
+    level=level,
+    num_beats=num_beats_pre,
+)
 print("Pre-pacing of single cell finished")
 
-# Get current state of cell to use as IC for cable simulation
-state0 = s_cell.default_state()
-
 print("Make OpenCL simulation object")
 s = myokit.SimulationOpenCL(
     m,
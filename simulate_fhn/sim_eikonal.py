@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18 October, 2026
+
+Activation maps of a sweep of branch geometries (theta x w2 x w1) from the
+eikonal model (eikonal.py), with the conduction velocity, seed time and
+diffusion length of a calibration against tissue simulations
+(calibration.json from calibrate_eikonal.py).
+
+Each point is written in the format of batch mode of sim_branch2.py (one
+directory per point, with active_times.json and activation_map.csv), and
+the conduction time between x1 and x2 of all points to summary.csv.
+
+@author: tbury
+"""
+
+import numpy as np
+import pandas as pd
+import os
+import time
+
+import tyro
+from dataclasses import dataclass
+from typing import Tuple
+
+from eikonal import solve_eikonal
+from funs import get_geometry, cells_in
+
+import datetime
+import pytz
+
+import json
+
+# Get date and time in zone ET
+newYorkTz = pytz.timezone("America/New_York")
+datetime_now = datetime.datetime.now(newYorkTz).strftime("%Y%m%d-%H%M%S")
+
+
+@dataclass
+class Args:
+    calibration: str
+    """calibration.json from calibrate_eikonal.py"""
+    run_name: str = "mac"
+    """name of the run"""
+    builder: str = "mesh_single_branch_2"
+    """mesh builder: mesh_single_branch_2 or mesh_double_branch_2"""
+    thetas: Tuple[int, ...] = tuple(range(10, 175, 5))
+    """angles of diagonal channel"""
+    w2s: Tuple[int, ...] = (2, 5, 10, 15, 20, 30)
+    """widths of diagonal channel"""
+    w1s: Tuple[int, ...] = (10,)
+    """widths of horizontal channel"""
+    l1: int = 120
+    """length of horizontal channel before and after junction"""
+    h: int = 40
+    """height of the diagonal channel"""
+    w2_horiz: bool = False
+    """whether to use horizontal or perpendicular width to define width of branch (single branch only)"""
+    stim_width: int = 2
+    """width of area in which to stimulate"""
+    x1: int = 20
+    """left location of where to record activation time"""
+    x2: int = 230
+    """right location of where to record activation time (past the junction at l1)"""
+    probes: Tuple[int, ...] = ()
+    """additional locations where to record activation time"""
+    activation_map: bool = True
+    """save the activation map of each point"""
+
+
+args = tyro.cli(Args)
+print(args)
+calibration = json.load(open(args.calibration))
+print(calibration)
+
+dir_name = f"output_eikonal/{datetime_now}-{args.run_name}/"
+os.makedirs(dir_name, exist_ok=True)
+json.dump(dict(vars(args), **calibration), open(dir_name + "config.json", "w"))
+
+
+def get_active_time(t_act, cells):
+    """Activation time of the cells at a location (median over the cells, NaN
+    if fewer than half of them activated)"""
+
+    t = t_act[cells]
+    if np.mean(np.isfinite(t)) < 0.5:
+        return np.nan
+    return np.median(t[np.isfinite(t)])
+
+
+list_dict = []
+tic = time.perf_counter()
+for w1 in args.w1s:
+    for theta in args.thetas:
+        for w2 in args.w2s:
+            row_start, row_stop = args.h, args.h + w1
+            rows = np.s_[row_start:row_stop]
+            kwargs_geometry = dict(l1=args.l1, w1=w1, h=args.h, w2=w2, theta=theta)
+            if args.builder == "mesh_single_branch_2":
+                kwargs_geometry["w2_horiz"] = args.w2_horiz
+            geometry = get_geometry(
+                args.builder,
+                prune_from=[row_start, row_stop, 0, args.stim_width],
+                **kwargs_geometry,
+            )
+            labels = geometry["labels"]
+
+            t_act = solve_eikonal(
+                geometry,
+                cells_in(labels, (rows, np.s_[: args.stim_width])),
+                calibration["cv"],
+                t_seeds=calibration["t_seeds"],
+                diffusion_length=calibration["diffusion_length"],
+                iterations=calibration["iterations"],
+            )
+            t_act = np.where(np.isfinite(t_act), t_act, np.nan)
+
+            active_left = get_active_time(t_act, cells_in(labels, (rows, args.x1)))
+            active_right = get_active_time(t_act, cells_in(labels, (rows, args.x2)))
+            list_dict.append(
+                dict(
+                    theta=theta,
+                    w2=w2,
+                    w1=w1,
+                    active_left=active_left,
+                    active_right=active_right,
+                    conduction_time=active_right - active_left,
+                )
+            )
+
+            # Output directory of the point, as in batch mode of sim_branch2.py
+            dir_point = f"{dir_name}theta{theta}-w2{w2}-w1{w1}/"
+            os.makedirs(dir_point, exist_ok=True)
+            config = dict(vars(args), theta=theta, w2=w2, w1=w1)
+            json.dump(config, open(dir_point + "config.json", "w"))
+            dict_active_times = dict(
+                active_left=str(round(active_left, 3)),
+                active_right=str(round(active_right, 3)),
+                active_probes={
+                    str(x): str(
+                        round(get_active_time(t_act, cells_in(labels, (rows, x))), 3)
+                    )
+                    for x in args.probes
+                },
+                stop_reason="block" if np.isnan(active_right) else "activated",
+                t_sim=round(float(np.nanmax(t_act)), 3),
+            )
+            json.dump(dict_active_times, open(dir_point + "active_times.json", "w"))
+
+            if args.activation_map:
+                # Activation map, by raster-order index of each cell in the
+                # unpruned mesh and its position
+                df_map = pd.DataFrame(
+                    dict(
+                        cell=geometry["order"],
+                        row=geometry["coords"][:, 0],
+                        col=geometry["coords"][:, 1],
+                        t_act=t_act,
+                    )
+                )
+                df_map = df_map.sort_values("cell")
+                df_map.to_csv(dir_point + "activation_map.csv", index=False)
+toc = time.perf_counter()
+print(f"Eikonal model of {len(list_dict)} geometries took {toc - tic:0.4f} seconds")
+
+df = pd.DataFrame(list_dict)
+df.to_csv(dir_name + "summary.csv", index=False)
+print("Summary written to {}".format(dir_name + "summary.csv"))
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18 October, 2026
+
+Validate active set integration of the CPU engine (see
+SimulationCPU.set_active_set) against integration of all cells with the step
+size, on branch geometries with and without conduction block. The activation
+time of every cell must agree within max_error, or within the difference
+with a run of all cells with half the step size (the error of the time
+discretization, which is largest for fronts that nearly block), with the
+same cells activated. The run times and the fraction of cell evaluations are
+reported. These meshes are small and mostly excited, so the active set is
+not faster on them: it only breaks even above about 4600 cells (see
+bench_active_set.py).
+
+@author: tbury
+"""
+
+import numpy as np
+import pandas as pd
+import time
+
+import myokit as myokit
+
+import tyro
+from dataclasses import dataclass
+from typing import Tuple
+
+from engine import SimulationCPU
+from funs import get_geometry, edges_to_connections, cells_in
+
+
+@dataclass
+class Args:
+    model: str = "../mmt_files/fhn.mmt"
+    """mmt file of the cell model"""
+    fhn_eps: float = 0.015
+    """relaxation speed of recovery variable"""
+    fhn_a: float = 0.12
+    """excitability of cell"""
+    active_tol: float = 0.01
+    """largest distance of the membrane potential from rest of cells at rest"""
+    coarse_steps: int = 8
+    """number of steps per step of the cells at rest"""
+    max_error: float = 0.05
+    """largest acceptable difference in activation time (ms)"""
+    cpu_integrator: str = "euler"
+    """time stepping of the engine: euler or rush_larsen"""
+    active_thresh: float = 0.5
+    """threshold in membrane potential to register as active"""
+    conductance: float = 4
+    """Cell-to-cell conductance"""
+    dt: float = 5e-3
+    """integration time step"""
+    tmax: float = 300
+    """time to run simulation up to"""
+    renumber: str = "rcm"
+    """renumber cells before simulating (none, rcm or morton)"""
+
+    # Geometries (defaults of sim_branch2.py)
+    thetas: Tuple[int, ...] = (30, 90, 150)
+    """angles of diagonal channel"""
+    w2s: Tuple[int, ...] = (5, 30)
+    """widths of diagonal channel"""
+    l1: int = 120
+    """length of horizontal channel before and after junction"""
+    w1: int = 10
+    """width of horizontal channel"""
+    h: int = 40
+    """height of the diagonal channel"""
+    stim_width: int = 2
+    """width of area in which to stimulate"""
+
+
+args = tyro.cli(Args)
+print(args)
+
+# Model and protocol (starting from the initial state of the model file, at
+# rest)
+m = myokit.load_model(args.model)
+if m.has_variable("membrane.epsilon"):
+    m.set_value("membrane.epsilon", args.fhn_eps)
+    m.set_value("membrane.a", args.fhn_a)
+v_rest = m.initial_values(as_floats=True)[m.label("membrane_potential").index()]
+p = myokit.Protocol()
+p.schedule(1, 15, 1)
+
+rows = np.s_[args.h : args.h + args.w1]
+list_dict = []
+for theta in args.thetas:
+    for w2 in args.w2s:
+        geometry = get_geometry(
+            "mesh_single_branch_2",
+            l1=args.l1,
+            w1=args.w1,
+            h=args.h,
+            w2=w2,
+            theta=theta,
+            prune_from=[rows.start, rows.stop, 0, args.stim_width],
+            renumber=args.renumber,
+        )
+        ncells = len(geometry["coords"])
+        connections = edges_to_connections(
+            geometry["src"], geometry["dst"], conductance=args.conductance
+        )
+        list_cells_pace = cells_in(
+            geometry["labels"], (rows, np.s_[: args.stim_width])
+        ).tolist()
+
+        results = {}
+        for mode in ["full", "active", "half_step"]:
+            s = SimulationCPU(m, p, ncells=ncells, integrator=args.cpu_integrator)
+            s.set_connections(connections)
+            s.set_step_size(step_size=args.dt / 2 if mode == "half_step" else args.dt)
+            s.set_paced_cell_list(list_cells_pace)
+            s.set_activation_threshold(args.active_thresh)
+            if mode == "active":
+                s.set_active_set(
+                    v_rest, args.active_tol, coarse_steps=args.coarse_steps
+                )
+            tic = time.perf_counter()
+            s.run(args.tmax, log=myokit.LOG_NONE)
+            toc = time.perf_counter()
+            results[mode] = (
+                s.activation_times(),
+                toc - tic,
+                s.statistics()["cell_evaluations"],
+            )
+
+        t_full, runtime_full, evals_full = results["full"]
+        t_active, runtime, evals = results["active"]
+        activated = np.isfinite(t_full)
+        mismatch = int(np.sum(activated != np.isfinite(t_active)))
+        error = np.max(np.abs(t_active - t_full)[activated], initial=0)
+        error_dt = np.nanmax(np.abs(results["half_step"][0] - t_full), initial=0)
+        list_dict.append(
+            dict(
+                theta=theta,
+                w2=w2,
+                ncells=ncells,
+                activated=int(activated.sum()),
+                runtime_full=runtime_full,
+                runtime_active=runtime,
+                speedup=runtime_full / runtime,
+                evaluations=evals / evals_full,
+                error=error,
+                error_dt=error_dt,
+                mismatch=mismatch,
+                ok=bool(error <= max(args.max_error, error_dt) and mismatch == 0),
+            )
+        )
+        print(list_dict[-1])
+
+df = pd.DataFrame(list_dict)
+print(df.to_string(index=False))
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18 October, 2026
+
+Validate the distributed engine (distributed.py) against the CPU engine on a
+branch geometry, with several local processes standing in for nodes. The
+logged membrane potential of all cells and the final state must agree, and
+the run times are reported.
+
+@author: tbury
+"""
+
+import numpy as np
+import pandas as pd
+import time
+
+import myokit as myokit
+
+import tyro
+from dataclasses import dataclass
+from typing import Tuple
+
+from engine import SimulationCPU
+from distributed import SimulationDistributed
+from funs import get_geometry, edges_to_connections, cells_in
+
+
+@dataclass
+class Args:
+    model: str = "../mmt_files/fhn.mmt"
+    """mmt file of the cell model"""
+    nprocs: Tuple[int, ...] = (1, 2, 4)
+    """numbers of processes of the distributed engine"""
+    max_error: float = 1e-9
+    """largest acceptable difference with the CPU engine"""
+    cpu_integrator: str = "euler"
+    """time stepping of the engines: euler or rush_larsen"""
+    conductance: float = 4
+    """Cell-to-cell conductance"""
+    dt: float = 5e-3
+    """integration time step"""
+    tmax: float = 120
+    """time to run simulation up to"""
+    log_interval: float = 1
+    """time between logged points"""
+    scale_up: int = 1
+    """parameter to scale up all length parameters of geometry"""
+    l1: int = 60
+    """length of horizontal channel before and after junction"""
+    w1: int = 10
+    """width of horizontal channel"""
+    h: int = 20
+    """height of the diagonal channel"""
+    w2: int = 10
+    """width of diagonal channel"""
+    theta: int = 150
+    """angle of diagonal channel"""
+    stim_width: int = 5
+    """width of area in which to stimulate"""
+
+
+args = tyro.cli(Args)
+print(args)
+
+# Geometry
+rows = np.s_[args.h * args.scale_up : (args.h + args.w1) * args.scale_up]
+geometry = get_geometry(
+    "mesh_single_branch_2",
+    scale_up=args.scale_up,
+    l1=args.l1,
+    w1=args.w1,
+    h=args.h,
+    w2=args.w2,
+    theta=args.theta,
+    prune_from=[rows.start, rows.stop, 0, args.stim_width * args.scale_up],
+)
+ncells = len(geometry["coords"])
+connections = edges_to_connections(
+    geometry["src"], geometry["dst"], conductance=args.conductance
+)
+list_cells_pace = cells_in(
+    geometry["labels"], (rows, np.s_[: args.stim_width * args.scale_up])
+).tolist()
+print(f"Geometry has {ncells} cells")
+
+# Model and protocol (starting from the initial state of the model file)
+m = myokit.load_model(args.model)
+vm = m.label("membrane_potential").qname()
+p = myokit.Protocol()
+p.schedule(1, 15, 1)
+
+
+def run(s):
+    """Run simulation and return logged voltage, final state and run time"""
+
+    s.set_connections(connections)
+    s.set_step_size(step_size=args.dt)
+    s.set_paced_cell_list(list_cells_pace)
+    tic = time.perf_counter()
+    log = s.run(args.tmax, log=["engine.time", vm], log_interval=args.log_interval)
+    toc = time.perf_counter()
+    v = np.array([log[f"{i}.{vm}"] for i in range(ncells)])
+    return v, np.array(s.state()), toc - tic
+
+
+v_ref, state_ref, runtime_ref = run(
+    SimulationCPU(m, p, ncells=ncells, integrator=args.cpu_integrator)
+)
+
+list_dict = [dict(engine="cpu", nprocs=1, runtime=runtime_ref, error=0.0, ok=True)]
+for nprocs in args.nprocs:
+    s = SimulationDistributed(
+        m, p, ncells=ncells, nprocs=nprocs, integrator=args.cpu_integrator
+    )
+    v, state, runtime = run(s)
+    s.close()
+    error = max(np.abs(v - v_ref).max(), np.abs(state - state_ref).max())
+    list_dict.append(
+        dict(
+            engine="distributed",
+            nprocs=nprocs,
+            runtime=runtime,
+            error=error,
+            ok=bool(error <= args.max_error),
+        )
+    )
+
+df = pd.DataFrame(list_dict)
+print(df.to_string(index=False))
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18 October, 2026
+
+Benchmark the Rush-Larsen integrator of the CPU engine against forward Euler
+on the default branch geometry. For each integrator, the largest stable time
+step and the largest accurate time step are found, and the wall times at these
+step sizes are compared.
+
+A run is stable if the membrane potential stays finite and within bounds. It
+is accurate if it is stable and the activation time at x2 is within tol of a
+forward Euler reference run at the smallest time step.
+
+@author: tbury
+"""
+
+import numpy as np
+import pandas as pd
+import time
+
+import myokit as myokit
+
+import tyro
+from dataclasses import dataclass
+from typing import Tuple
+
+from engine import SimulationCPU
+from funs import get_geometry, edges_to_connections, cells_in
+
+
+@dataclass
+class Args:
+    model: str = "../mmt_files/ord-2011_1d.mmt"
+    """mmt file of the cell model"""
+    integrators: Tuple[str, ...] = ("euler", "rush_larsen")
+    """integrators of the CPU engine to compare"""
+    dts: Tuple[float, ...] = (2e-3, 5e-3, 1e-2, 2e-2, 5e-2, 0.1)
+    """time steps to try, in increasing order (the first is also the reference)"""
+    tol: float = 0.5
+    """largest error in activation time at x2 for a run to count as accurate"""
+    v_bounds: Tuple[float, float] = (-150, 100)
+    """bounds on the membrane potential for a run to count as stable"""
+    cpu_backend: str = "numpy"
+    """right-hand side kernel of the cpu engine: numpy or numba (see codegen.py)"""
+    active_thresh: float = 0
+    """threshold in membrane potential to register as active"""
+    conductance: float = 2
+    """Cell-to-cell conductance"""
+    stim_duration: float = 1
+    """duration of stimulus applied to the paced cells"""
+    tmax: float = 160
+    """time to run simulation up to"""
+    log_interval: float = 0.1
+    """how often to log the probes at x2"""
+
+    # Geometry (defaults of sim_branch.py)
+    l1: int = 60
+    """length of horizontal channel before and after junction"""
+    w1: int = 5
+    """width of horizontal channel"""
+    h: int = 20
+    """height of the diagonal channel"""
+    w2: int = 10
+    """width of diagonal channel"""
+    theta: int = 60
+    """angle of diagonal channel"""
+    stim_width: int = 5
+    """width of area in which to stimulate"""
+    x2: int = 120
+    """right location of where to record activation time"""
+
+
+args = tyro.cli(Args)
+print(args)
+
+# Geometry
+row_start, row_stop = args.h, args.h + args.w1
+rows = np.s_[row_start:row_stop]
+geometry = get_geometry(
+    "mesh_single_branch_2",
+    l1=args.l1,
+    w1=args.w1,
+    h=args.h,
+    w2=args.w2,
+    theta=args.theta,
+    prune_from=[row_start, row_stop, 0, args.stim_width],
+)
+labels = geometry["labels"]
+ncells = len(geometry["coords"])
+connections = edges_to_connections(
+    geometry["src"], geometry["dst"], conductance=args.conductance
+)
+list_cells_pace = cells_in(labels, (rows, np.s_[: args.stim_width])).tolist()
+cells_x2 = cells_in(labels, (rows, args.x2))
+print(f"Geometry has {ncells} cells")
+
+# Model and protocol (starting from the initial state of the model file)
+m = myokit.load_model(args.model)
+vm = m.label("membrane_potential").qname()
+p = myokit.Protocol()
+p.schedule(1, 15, args.stim_duration)
+
+
+def run(integrator, dt):
+    """Run the simulation and return activation time at x2, bounds and timing"""
+
+    s = SimulationCPU(
+        m, p, ncells=ncells, backend=args.cpu_backend, integrator=integrator
+    )
+    s.set_connections(connections)
+    s.set_step_size(step_size=dt)
+    s.set_paced_cell_list(list_cells_pace)
+    log = ["engine.time"] + [f"{i}.{vm}" for i in cells_x2]
+    tic = time.perf_counter()
+    with np.errstate(all="ignore"):
+        log = s.run(args.tmax, log_interval=args.log_interval, log=log)
+    toc = time.perf_counter()
+
+    v_end = np.array(s.state()).reshape(ncells, -1)[:, m.get(vm).index()]
+    v_x2 = np.array([log[f"{i}.{vm}"] for i in cells_x2])
+    bounded = np.all(np.isfinite(v_end)) and np.all(np.isfinite(v_x2))
+    bounded = bounded and v_x2.min() > args.v_bounds[0]
+    bounded = bounded and v_x2.max() < args.v_bounds[1]
+
+    active = np.nonzero(v_x2.mean(axis=0) > args.active_thresh)[0]
+    t_x2 = np.array(log["engine.time"])[active[0]] if len(active) else np.nan
+    return t_x2, bounded, toc - tic
+
+
+t_ref, _, _ = run("euler", args.dts[0])
+print(f"Reference activation time at x2: {t_ref}")
+
+list_dict = []
+for integrator in args.integrators:
+    for dt in args.dts:
+        t_x2, bounded, runtime = run(integrator, dt)
+        error = abs(t_x2 - t_ref)
+        dict_bench = dict(
+            integrator=integrator,
+            dt=dt,
+            runtime=runtime,
+            active_x2=t_x2,
+            error=error,
+            stable=bool(bounded),
+            accurate=bool(bounded and error <= args.tol),
+        )
+        print(dict_bench)
+        list_dict.append(dict_bench)
+        if not bounded:
+            # Larger steps are not expected to be stable either
+            break
+
+df = pd.DataFrame(list_dict)
+print(df.to_string(index=False))
+
+# Largest stable and accurate time step of each integrator, and speedup over
+# forward Euler
+for criterion in ["stable", "accurate"]:
+    df_best = df[df[criterion]].groupby("integrator").last()
+    print(f"\nLargest {criterion} time step")
+    print(df_best[["dt", "runtime", "error"]].to_string())
+    if {"euler", "rush_larsen"} <= set(df_best.index):
+        speedup = (
+            df_best.loc["euler", "runtime"] / df_best.loc["rush_larsen", "runtime"]
+        )
+        print(f"Speedup of rush_larsen over euler: {speedup:.2f}")
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18 October, 2026
+
+Strong-scaling benchmark of the threaded CPU engine (engine.py) on branch
+geometries enlarged with scale_up. For each mesh size, the time per step is
+measured with 1 to N threads, each thread owning a band of mesh rows
+(funs.row_partition), and the speedup and parallel efficiency over one thread
+are reported.
+
+Mesh sizes are approximate: the default geometry of sim_branch.py is scaled
+up by the nearest integer factor giving the requested number of cells. The
+largest meshes need several GB of memory per state array with the ORd model.
+
+The speedup of threading is unverified: this benchmark was run on a machine
+with one core, where it only measures one thread (numpy backend, double
+precision: 7950 cells 20 ms per step, 107525 cells 295 ms, 1026800 cells
+2.4 s). With the cap lifted, 2 and 4 threads sharing that core ran at 0.97x
+to 1.35x of one thread, from smaller blocks per kernel call rather than
+parallelism. Strong-scaling numbers still need to be recorded on a
+multi-core node, and the sim scripts default to one thread until then.
+
+@author: tbury
+"""
+
+import numpy as np
+import pandas as pd
+import os
+import time
+
+import myokit as myokit
+
+import tyro
+from dataclasses import dataclass
+from typing import Tuple
+
+from engine import SimulationCPU
+from funs import get_geometry, edges_to_connections, cells_in, row_partition
+
+
+@dataclass
+class Args:
+    model: str = "../mmt_files/ord-2011_1d.mmt"
+    """mmt file of the cell model"""
+    ncells: Tuple[int, ...] = (10**4, 10**5, 10**6, 10**7)
+    """approximate numbers of cells of the meshes"""
+    threads: Tuple[int, ...] = (1, 2, 4, 8, 16, 32)
+    """numbers of threads (capped at the number of cores)"""
+    nsteps: int = 20
+    """number of time steps to time (after one warm-up step)"""
+    cpu_backend: str = "numpy"
+    """right-hand side kernel of the cpu engine: numpy or numba (see codegen.py)"""
+    cpu_precision: str = "double"
+    """precision of the cpu engine: double, single, or mixed"""
+    conductance: float = 2
+    """Cell-to-cell conductance"""
+    dt: float = 5e-3
+    """integration time step"""
+
+    # Geometry (defaults of sim_branch.py, before scaling)
+    l1: int = 60
+    """length of horizontal channel before and after junction"""
+    w1: int = 5
+    """width of horizontal channel"""
+    h: int = 20
+    """height of the diagonal channel"""
+    w2: int = 10
+    """width of diagonal channel"""
+    theta: int = 60
+    """angle of diagonal channel"""
+    stim_width: int = 5
+    """width of area in which to stimulate"""
+
+
+args = tyro.cli(Args)
+print(args)
+
+ncores = os.cpu_count()
+threads = sorted({min(n, ncores) for n in args.threads})
+print(f"{ncores} cores, benchmarking {threads} threads")
+
+m = myokit.load_model(args.model)
+p = myokit.Protocol()
+p.schedule(1, 0, 1)
+
+
+def make_geometry(scale_up):
+    row_start, row_stop = args.h * scale_up, (args.h + args.w1) * scale_up
+    return get_geometry(
+        "mesh_single_branch_2",
+        scale_up=scale_up,
+        l1=args.l1,
+        w1=args.w1,
+        h=args.h,
+        w2=args.w2,
+        theta=args.theta,
+        prune_from=[row_start, row_stop, 0, args.stim_width * scale_up],
+    )
+
+
+# Cells scale with the square of scale_up
+ncells_base = len(make_geometry(1)["coords"])
+
+list_dict = []
+for ncells_target in args.ncells:
+    scale_up = max(1, int(round(np.sqrt(ncells_target / ncells_base))))
+    geometry = make_geometry(scale_up)
+    ncells = len(geometry["coords"])
+    connections = edges_to_connections(
+        geometry["src"], geometry["dst"], conductance=args.conductance
+    )
+    rows = np.s_[args.h * scale_up : (args.h + args.w1) * scale_up]
+    list_cells_pace = cells_in(
+        geometry["labels"], (rows, np.s_[: args.stim_width * scale_up])
+    )
+    print(f"scale_up={scale_up}: {ncells} cells")
+
+    for nthreads in threads:
+        s = SimulationCPU(
+            m,
+            p,
+            ncells=ncells,
+            backend=args.cpu_backend,
+            precision=args.cpu_precision,
+            nthreads=nthreads,
+        )
+        s.set_connections(connections)
+        s.set_step_size(step_size=args.dt)
+        s.set_paced_cell_list(list_cells_pace)
+        s.set_partition(row_partition(geometry["coords"], nthreads))
+
+        # Warm-up step (kernel loading or compilation)
+        s.run(args.dt, log=myokit.LOG_NONE)
+        tic = time.perf_counter()
+        s.run(args.nsteps * args.dt, log=myokit.LOG_NONE)
+        toc = time.perf_counter()
+
+        dict_bench = dict(
+            ncells=ncells,
+            scale_up=scale_up,
+            threads=nthreads,
+            time_per_step=(toc - tic) / args.nsteps,
+            cell_steps_per_s=ncells * args.nsteps / (toc - tic),
+        )
+        print(dict_bench)
+        list_dict.append(dict_bench)
+        del s
+
+df = pd.DataFrame(list_dict)
+time_1 = df[df["threads"] == threads[0]].set_index("ncells")["time_per_step"]
+df["speedup"] = df["ncells"].map(time_1) / df["time_per_step"]
+df["efficiency"] = df["speedup"] * threads[0] / df["threads"]
+print(df.to_string(index=False))
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18 October, 2026
+
+Generate vectorized right-hand side kernels from myokit models.
+Kernels are written to the cache directory as Python modules, so the code
+generation (and Numba compilation) is done once per model.
+
+@author: tbury
+"""
+
+import numpy as np
+import os
+import re
+import hashlib
+import importlib.util
+
+import myokit
+import myokit.lib.hh
+
+from funs import CACHE_DIR
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Bindings that are passed to the right-hand side function as arguments
+BOUND_ARGS = {"time": "t", "pace": "pace", "diffusion_current": "i_diff"}
+
+# Kernel backends: numpy (whole-array operations) or numba (parallel loop)
+BACKENDS = ["numpy", "numba"]
+
+# Time stepping of the states: forward Euler for all states, or the exact
+# exponential (Rush-Larsen) update for gating variables
+INTEGRATORS = ["euler", "rush_larsen"]
+
+# Increment to invalidate cached kernels when the generated code changes
+CODEGEN_VERSION = 3
+
+
+def variable_name(var):
+    """Name of a model variable in generated code"""
+    return var.qname().replace(".", "_")
+
+
+def get_constants(model):
+    """Get the literal constants of a model (passed to rhs as c)
+
+    Returns:
+        list - (variable, value) for each literal constant that is not bound
+    """
+
+    return [
+        (var, var.eval())
+        for var in model.variables(deep=True, const=True)
+        if var.is_literal() and var.binding() is None
+    ]
+
+
+def get_gates(model):
+    """Get the gating variables of a model and their steady state and time constant
+
+    Gates are states with an equation of the form dot(x) = (inf - x) / tau or
+    dot(x) = alpha * (1 - x) - beta * x, where inf and tau (or alpha and beta)
+    only depend on the membrane potential (see myokit.lib.hh).
+
+    Returns:
+        list - (state, inf, tau) for each gate, with inf and tau given as
+            myokit.Expression
+    """
+
+    vm = model.label("membrane_potential")
+    gates = []
+    for var in model.states():
+        if vm is None or var is vm:
+            continue
+        if myokit.lib.hh.has_inf_tau_form(var, vm):
+            inf, tau = myokit.lib.hh.get_inf_and_tau(var, vm)
+            gates.append((var, myokit.Name(inf), myokit.Name(tau)))
+        elif myokit.lib.hh.has_alpha_beta_form(var, vm):
+            alpha, beta = myokit.lib.hh.get_alpha_and_beta(var, vm)
+            rate = myokit.Plus(myokit.Name(alpha), myokit.Name(beta))
+            inf = myokit.Divide(myokit.Name(alpha), rate)
+            tau = myokit.Divide(myokit.Number(1), rate)
+            gates.append((var, inf, tau))
+
+    return gates
+
+
+def get_gate_variables(model):
+    """Get the variables that are only used to update the gating variables
+
+    These are the variables (e.g. steady states, time constants and rates of
+    gates) whose equations only depend on the membrane potential, literal
+    constants and other such variables, and that are only used by the
+    derivatives of gates (see get_gates) or by other such variables.
+
+    Returns:
+        set - myokit.Variable
+    """
+
+    vm = model.label("membrane_potential")
+    if vm is None:
+        return set()
+    gates = {var for var, _, _ in get_gates(model)}
+    constants = {var for var, _ in get_constants(model)}
+    equations = [eq for eqs in model.solvable_order().values() for eq in eqs]
+
+    # Variables that only depend on the membrane potential (in solvable order)
+    candidates = set()
+    for eq in equations:
+        var = eq.lhs.var()
+        if isinstance(eq.lhs, myokit.Derivative) or var in constants:
+            continue
+        if var.binding() is not None:
+            continue
+        refs = {ref.var() for ref in eq.rhs.references()}
+        if refs <= candidates | constants | {vm}:
+            candidates.add(var)
+
+    # Users of each variable: variables, or the derivative of a state
+    users = {}
+    for eq in equations:
+        user = eq.lhs.var() if isinstance(eq.lhs, myokit.Name) else eq.lhs
+        for ref in eq.rhs.references():
+            users.setdefault(ref.var(), set()).add(user)
+
+    # Drop candidates used outside the gate updates, until none are left
+    def gate_user(user):
+        if isinstance(user, myokit.Derivative):
+            return user.var() in gates
+        return user in candidates
+
+    changed = True
+    while changed:
+        changed = False
+        for var in list(candidates):
+            if not users.get(var) or not all(map(gate_user, users[var])):
+                candidates.discard(var)
+                changed = True
+
+    return candidates
+
+
+def generate_rhs_source(
+    model,
+    backend="numpy",
+    jit_cache=True,
+    integrator="euler",
+    layout=None,
+    float32_gates=False,
+):
+    """Generate source code of a module with a vectorized right-hand side function
+
+    The module defines STATES and CONSTANTS (qnames of the states and literal
+    constants, in the order used by the kernel) and a function
+    rhs(t, y, pace, i_diff, c, out) with y the (n_states, n_cells) state array,
+    pace and i_diff arrays of length n_cells, c the values of the constants and
+    out an array like y to which the derivatives are written. The constants
+    are given as an array of length n_constants, or as an (n_constants, n_cells)
+    array of values for each cell (always the latter for backend numba).
+
+    With backend numpy all cells are evaluated at once with whole-array
+    operations. With backend numba the equations are evaluated cell by cell in
+    a loop compiled with numba.njit(parallel=True, nogil=True).
+
+    With integrator rush_larsen the function takes the step size h as an
+    extra argument, rhs(t, y, pace, i_diff, c, out, h), and writes for each
+    gate (see get_gates) the rate (x_new - x) / h of the exact exponential
+    update x_new = inf + (x - inf) * exp(-h / tau). A forward Euler step of
+    size h then updates gates exactly for fixed inf and tau, and all other
+    states explicitly. The module also defines GATES, the qnames of the gates.
+
+    With a layout, the states are stored in several arrays (e.g. of different
+    precision), and y and out are tuples of (n_states_block, n_cells) arrays,
+    with state i stored in row layout[i][1] of array layout[i][0].
+
+    With float32_gates (backend numpy only), the derivatives of the gates and
+    the variables only used to compute them (see get_gate_variables) are
+    evaluated in float32, from float32 copies of the membrane potential and of
+    the constants they use. Gates stored in float32 are then updated without
+    promotion to float64, as in mixed precision (see engine.py).
+
+    Args:
+        model: myokit.Model
+        backend: "numpy" or "numba"
+        jit_cache: whether numba caches the compiled kernel (requires the
+            module to be loaded from a file)
+        integrator: "euler" or "rush_larsen"
+        layout: list of (array, row) for each state, or None for a single array
+        float32_gates: whether to evaluate the gate updates in float32
+
+    Returns:
+        str - Python source code
+    """
+
+    if backend == "numpy":
+        writer = myokit.numpy_writer()
+        indent = "    "
+        state_ref, out_ref, arg_ref = "y[{}]", "out[{}]", "{}"
+        if layout is not None:
+            state_ref, out_ref = "y[{}][{}]", "out[{}][{}]"
+        const_ref = "c[{}]"
+        expm1 = "numpy.expm1"
+    elif backend == "numba":
+        writer = myokit.python_writer()
+        indent = "        "
+        state_ref, out_ref, arg_ref = "y[{}, k]", "out[{}, k]", "{}[k]"
+        if layout is not None:
+            state_ref, out_ref = "y[{}][{}, k]", "out[{}][{}, k]"
+        const_ref = "c[{}, k]"
+        expm1 = "math.expm1"
+    else:
+        raise ValueError(f"Unknown backend {backend}, choose from {BACKENDS}")
+    if integrator not in INTEGRATORS:
+        raise ValueError(f"Unknown integrator {integrator}, choose from {INTEGRATORS}")
+    if float32_gates and backend != "numpy":
+        raise ValueError("float32_gates requires backend numpy")
+
+    def lhs_name(lhs):
+        if isinstance(lhs, myokit.Derivative):
+            return "dot_" + variable_name(lhs.var())
+        return variable_name(lhs.var())
+
+    writer.set_lhs_function(lhs_name)
+
+    states = list(model.states())
+    index = [(i,) for i in range(len(states))] if layout is None else layout
+    constants = [var for var, _ in get_constants(model)]
+    gates = get_gates(model) if integrator == "rush_larsen" else []
+    gate_index = {var: (inf, tau) for var, inf, tau in gates}
+
+    # Equations written in float32, in which the names of the membrane
+    # potential and of constants are replaced by the names of float32 copies
+    float32_vars, rename = set(), {}
+    if float32_gates:
+        vm = model.label("membrane_potential")
+        float32_vars = get_gate_variables(model)
+        float32_vars |= {var for var, _, _ in get_gates(model)}
+        for var in float32_vars:
+            for ref in var.rhs().references():
+                if ref.var() is vm or ref.var() in constants:
+                    rename[ref.var()] = f"{variable_name(ref.var())}_f32"
+
+    def float32_code(code):
+        """Code with the names in rename replaced by their float32 copies"""
+        for var, name in rename.items():
+            code = re.sub(rf"\b{variable_name(var)}\b", name, code)
+        return code
+
+    lines = [f"# Kernel generated by codegen.py from model {model.name()}", ""]
+    lines += ["import math", "import numpy"]
+    if backend == "numba":
+        lines += ["import numba"]
+    lines += ["", f"STATES = {[var.qname() for var in states]}"]
+    lines += [f"CONSTANTS = {[var.qname() for var in constants]}"]
+    if integrator == "rush_larsen":
+        lines += [f"GATES = {[var.qname() for var, _, _ in gates]}"]
+    lines += ["", ""]
+
+    if backend == "numba":
+        lines.append(f"@numba.njit(parallel=True, nogil=True, cache={jit_cache})")
+    if integrator == "rush_larsen":
+        lines.append("def rhs(t, y, pace, i_diff, c, out, h):")
+    else:
+        lines.append("def rhs(t, y, pace, i_diff, c, out):")
+    if backend == "numba":
+        lines.append("    for k in numba.prange(pace.shape[0]):")
+
+    lines.append(f"{indent}# States")
+    for i, var in enumerate(states):
+        lines.append(f"{indent}{variable_name(var)} = {state_ref.format(*index[i])}")
+    lines.append(f"{indent}# Literal constants")
+    for i, var in enumerate(constants):
+        lines.append(f"{indent}{variable_name(var)} = {const_ref.format(i)}")
+    if rename:
+        lines.append(f"{indent}# Float32 copies for the gate updates")
+    for var, name in rename.items():
+        lines.append(f"{indent}{name} = {variable_name(var)}.astype(numpy.float32)")
+
+    lines.append(f"{indent}# Equations")
+    for equations in model.solvable_order().values():
+        for eq in equations:
+            var = eq.lhs.var()
+            if var in constants:
+                continue
+            if isinstance(eq.lhs, myokit.Derivative) and var in gate_index:
+                # Replaced by the Rush-Larsen update
+                continue
+            binding = var.binding()
+            if binding is not None:
+                value = BOUND_ARGS.get(binding, "0.0")
+                if value in ("pace", "i_diff"):
+                    value = arg_ref.format(value)
+                lines.append(f"{indent}{variable_name(var)} = {value}")
+                continue
+            if var in float32_vars:
+                lines.append(f"{indent}{float32_code(writer.eq(eq))}")
+            else:
+                lines.append(f"{indent}{writer.eq(eq)}")
+
+    lines.append(f"{indent}# Derivatives")
+    for i, var in enumerate(states):
+        if var in gate_index:
+            continue
+        lines.append(f"{indent}{out_ref.format(*index[i])} = dot_{variable_name(var)}")
+    if gates:
+        lines.append(f"{indent}# Rush-Larsen update of gates, as rate over step h")
+    for i, var in enumerate(states):
+        if var not in gate_index:
+            continue
+        inf, tau = (writer.ex(x) for x in gate_index[var])
+        lines.append(
+            f"{indent}{out_ref.format(*index[i])} = ({variable_name(var)} - ({inf}))"
+            f" * {expm1}(-h / ({tau})) / h"
+        )
+    lines.append("    return out")
+
+    return "\n".join(lines) + "\n"
+
+
+def model_hash(model):
+    """Hash of the equations of a model, ignoring the values of literal constants
+
+    Models that only differ in parameter values (e.g. across a sweep) have the
+    same hash and share a kernel, since constants are passed to the kernel.
+    """
+
+    model = model.clone()
+    for var, _ in get_constants(model):
+        var.set_rhs(0)
+
+    return hashlib.sha1(model.code().encode()).hexdigest()
+
+
+def load_module(name, filepath):
+    """Import a Python module from a file"""
+
+    spec = importlib.util.spec_from_file_location(name, filepath)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+def get_rhs(
+    model,
+    backend="numpy",
+    cache=True,
+    integrator="euler",
+    layout=None,
+    float32_gates=False,
+):
+    """Get the right-hand side kernel of a model, using an on-disk cache
+
+    Args:
+        model: myokit.Model
+        backend: "numpy" or "numba"
+        cache: whether to read kernels from and write kernels to the cache
+        integrator: "euler" or "rush_larsen" (see generate_rhs_source)
+        layout: storage of the states (see generate_rhs_source)
+        float32_gates: whether to evaluate the gate updates in float32 (see
+            generate_rhs_source)
+
+    Returns:
+        tuple - kernel function (see generate_rhs_source) and list of the
+            qnames of the constants it takes as argument c
+    """
+
+    if backend == "numba" and numba is None:
+        raise ImportError("Backend numba requires the numba package")
+
+    if not cache:
+        source = generate_rhs_source(
+            model,
+            backend,
+            jit_cache=False,
+            integrator=integrator,
+            layout=layout,
+            float32_gates=float32_gates,
+        )
+        namespace = {}
+        exec(compile(source, f"<rhs {model.name()}>", "exec"), namespace)
+        return namespace["rhs"], namespace["CONSTANTS"]
+
+    key = f"{model_hash(model)}-{backend}-{integrator}-{CODEGEN_VERSION}"
+    if layout is not None:
+        key += f"-{[tuple(index) for index in layout]}"
+    if float32_gates:
+        key += "-float32_gates"
+    digest = hashlib.sha1(key.encode()).hexdigest()
+    suffix = "_rl" if integrator == "rush_larsen" else ""
+    name = f"rhs_{backend}{suffix}_{digest[:16]}"
+    filepath = os.path.join(CACHE_DIR, "kernels", f"{name}.py")
+
+    if not os.path.exists(filepath):
+        # Write to a temporary file first so that concurrent workers never
+        # import a partially written module
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        filepath_tmp = f"{filepath}.{os.getpid()}.tmp"
+        with open(filepath_tmp, "w") as fp:
+            fp.write(
+                generate_rhs_source(
+                    model,
+                    backend,
+                    integrator=integrator,
+                    layout=layout,
+                    float32_gates=float32_gates,
+                )
+            )
+        os.replace(filepath_tmp, filepath)
+
+    module = load_module(name, filepath)
+
+    return module.rhs, module.CONSTANTS
+
+
+if __name__ == "__main__":
+    print("Run tests")
+
+    # Check kernels against myokit for each model
+    for filename in ["fhn.mmt", "br-1977-opencl.mmt", "ord-2011_1d.mmt"]:
+        m = myokit.load_model(os.path.join("..", "mmt_files", filename))
+        rhs, constants = get_rhs(m)
+        c = np.array([m.get(qname).eval() for qname in constants])
+        y = np.array(m.initial_values(as_floats=True))[:, None]
+        out = np.empty_like(y)
+        rhs(0.0, y, np.ones(1), np.zeros(1), c, out)
+        inputs = {"pace": 1.0, "diffusion_current": 0.0}
+        expected = m.evaluate_derivatives(m.initial_values(True), inputs)
+        assert np.allclose(out[:, 0], expected, rtol=1e-10, atol=0)
+        print(f"{filename}: kernel matches myokit, hash {model_hash(m)[:16]}")
+
+        # Rush-Larsen kernel tends to the derivatives for small steps
+        rhs_rl, _ = get_rhs(m, integrator="rush_larsen")
+        rhs_rl(0.0, y, np.ones(1), np.zeros(1), c, out, 1e-9)
+        assert np.allclose(out[:, 0], expected, rtol=1e-6, atol=1e-12)
+        print(f"{filename}: Rush-Larsen kernel with {len(get_gates(m))} gates")
@@ -23,9 +23,9 @@ import imageio.v2 as imageio
 from funs import (
     mesh_single_branch,
     mesh_single_branch_2,
-    get_connections,
     mesh_double_branch,
     mesh_double_branch_2,
+    get_geometry,
 )
 
 import json
@@ -52,25 +52,33 @@ df = pd.read_csv(filepath)
 # Get mapping from cell index to cell position
 # ----------
 
-# Create cell mesh that defines geometry
-cell_mesh = mesh_single_branch_2(
+# Create cell mesh that defines geometry (loaded from cache if already built)
+geometry = get_geometry(
+    "mesh_single_branch_2",
+    scale_up=config.get("scale_up", 1),
     l1=config["l1"],
     w1=config["w1"],
     h=config["h"],
     w2=config["w2"],
     theta=config["theta"],
 )
+cell_mesh = geometry["mesh"]
 
-# Get connections
-pos_to_index, connections = get_connections(cell_mesh)
-index_to_pos = {value: key for key, value in pos_to_index.items()}
+# Position of each cell
+coords = geometry["coords"]
+
+# Cell index of each voltage column
+cols = df.columns[1:]
+cell_idx = np.array([int(col.split(" ")[-1]) for col in cols])
+rows_plot, cols_plot = coords[cell_idx, 0], coords[cell_idx, 1]
 
 # -----
 # Make gif of heatmap at given times
 # --------
 
 title = "FHN model on grid"
-times = np.arange(0, config["tmax"], 2)
+# Times to plot, up to the last logged time (runs may stop before tmax)
+times = np.arange(0, min(config["tmax"], df["time"].max() + 1e-9), 2)
 images = []
 for i, time in enumerate(times):
 
@@ -80,10 +88,7 @@ for i, time in enumerate(times):
     df_plot = df[df["time"] == time]
 
     # Assign values
-    for col in df_plot.columns[1:]:
-        cell_idx = int(col.split(" ")[-1])
-        cell_pos = index_to_pos[cell_idx]
-        ar_plot[cell_pos] = df_plot[col].values[0]
+    ar_plot[rows_plot, cols_plot] = df_plot[cols].values[0]
 
     # ar_plot = df_plot.drop("time", axis=1).values.reshape(
     #     ydim // scale_down, xdim // scale_down
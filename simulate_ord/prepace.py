@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18 October, 2026
+
+Pre-pacing of single cells to set the initial condition of tissue simulations.
+Pre-paced states are stored in the cache directory, so each combination of
+model, parameters and pacing protocol is only pre-paced once.
+
+@author: tbury
+"""
+
+import numpy as np
+import pandas as pd
+import os
+import json
+import hashlib
+
+import myokit
+from scipy import optimize
+
+from funs import CACHE_DIR
+from engine import SimulationCPU
+
+
+def file_hash(filepath):
+    """SHA1 hash of the contents of a file"""
+
+    with open(filepath, "rb") as fp:
+        return hashlib.sha1(fp.read()).hexdigest()
+
+
+def state_change(x_old, x_new, scale_floor=1e-12):
+    """Largest relative change of any state variable between two states
+
+    Each change is relative to the magnitude of the new state, or to
+    scale_floor (scalar or one value per state) if that is larger, so that
+    states resting near zero are compared by their absolute change.
+    """
+
+    x_old, x_new = np.asarray(x_old), np.asarray(x_new)
+    scale = np.maximum(np.abs(x_new), scale_floor)
+    return float(np.max(np.abs(x_new - x_old) / scale))
+
+
+def prepace(
+    model,
+    bcl,
+    duration,
+    offset,
+    level,
+    num_beats,
+    tol=None,
+    n_stable=5,
+    scale_floor=1e-12,
+):
+    """Pre-pace a single cell
+
+    With tol=None the cell is paced for num_beats beats. Otherwise it is paced
+    beat by beat, comparing the state at the start of consecutive beats, and
+    stops once the relative change (see state_change) has stayed below tol for
+    n_stable consecutive beats, with num_beats as upper bound. Cells resting
+    at zero (e.g. FHN) only stop with a scale_floor of the order of the range
+    of their states, since the relative change of a state near zero is that of
+    the noise of the solver.
+
+    Args:
+        model: myokit.Model
+        bcl, duration, offset, level: pacing protocol (see
+            myokit.pacing.blocktrain)
+        num_beats: number of beats (maximum number of beats if tol is given)
+        tol: tolerance on the relative change in state per beat
+        n_stable: number of consecutive beats below tol required to stop
+        scale_floor: smallest scale of the change of each state (see
+            state_change)
+
+    Returns:
+        tuple - state at the start of the next beat, number of beats paced and
+            relative change in state over the last beat (None if tol is None)
+    """
+
+    if num_beats < 1:
+        raise ValueError(f"num_beats must be at least 1, got {num_beats}")
+
+    p_pre = myokit.pacing.blocktrain(bcl, duration, offset=offset, level=level)
+    s_cell = myokit.Simulation(model, p_pre)
+
+    if tol is None:
+        s_cell.pre(num_beats * bcl)
+        return [float(x) for x in s_cell.default_state()], num_beats, None
+
+    state = s_cell.state()
+    count_stable = 0
+    for beat in range(1, num_beats + 1):
+        s_cell.run(bcl, log=myokit.LOG_NONE)
+        state_new = s_cell.state()
+        residual = state_change(state, state_new, scale_floor)
+        state = state_new
+        count_stable = count_stable + 1 if residual < tol else 0
+        if count_stable >= n_stable:
+            break
+
+    return [float(x) for x in state], beat, residual
+
+
+def prepace_shooting(
+    model,
+    bcl,
+    duration,
+    offset,
+    level,
+    num_beats,
+    tol=None,
+    n_stable=5,
+    scale_floor=1e-12,
+    n_init=20,
+    maxiter=30,
+):
+    """Find the periodic steady state of a paced cell by Newton-Krylov shooting
+
+    The state at the start of a beat is mapped to the state one beat later,
+    x -> P(x), and the fixed point of P is found by solving P(x) - x = 0 with
+    scipy.optimize.newton_krylov. Jacobian-vector products are finite
+    differences of one-beat simulations. States are scaled by their values
+    after n_init beats of pacing, so the residual is the relative change in
+    state per beat. If the solver does not converge, or stops with a relative
+    change per beat (see state_change) above tol, pre-pacing continues beat by
+    beat (see prepace), from the state of the solver if it stopped, or from
+    the state after n_init beats.
+
+    Args:
+        model: myokit.Model
+        bcl, duration, offset, level: pacing protocol (see
+            myokit.pacing.blocktrain)
+        num_beats, tol, n_stable, scale_floor: settings of prepace for the
+            fallback, where tol (default 1e-8) is also the tolerance of the
+            solver and scale_floor the smallest scale of the states
+        n_init: number of beats paced before starting the solver
+        maxiter: maximum number of Newton iterations
+
+    Returns:
+        tuple - state at the start of the next beat, number of beats
+            simulated and relative change in state over one beat
+    """
+
+    tol = 1e-8 if tol is None else tol
+
+    p_pre = myokit.pacing.blocktrain(bcl, duration, offset=offset, level=level)
+    s_cell = myokit.Simulation(model, p_pre)
+    # Tight solver tolerances, so finite differences are not swamped by noise
+    s_cell.set_tolerance(abs_tol=1e-10, rel_tol=1e-8)
+
+    s_cell.pre(n_init * bcl)
+    x0 = np.array(s_cell.default_state())
+    scale = np.maximum(np.abs(x0), max(scale_floor, 1e-6))
+    count_beats = [n_init]
+
+    def beat(x):
+        """State after one beat starting from state x"""
+        s_cell.set_time(0)
+        s_cell.set_state(x)
+        s_cell.run(bcl, log=myokit.LOG_NONE)
+        count_beats[0] += 1
+        return np.array(s_cell.state())
+
+    def residual(z):
+        x = z * scale
+        return (beat(x) - x) / scale
+
+    try:
+        z = optimize.newton_krylov(
+            residual, np.ones_like(x0), f_tol=tol, maxiter=maxiter, rdiff=1e-5
+        )
+        state = z * scale
+        residual_final = state_change(state, beat(state), scale_floor)
+        if residual_final <= tol:
+            return [float(x) for x in state], count_beats[0], residual_final
+        # The solver tolerance is on the scaled residual, which can pass while
+        # the relative change per beat does not
+        print(
+            f"Shooting stopped with relative change {residual_final:0.3g} per beat"
+            f" above tol {tol:0.3g}, continue pre-pacing beat by beat"
+        )
+        x_start = state
+
+    except (optimize.NoConvergence, ValueError, myokit.SimulationError) as e:
+        print(f"Shooting did not converge ({e}), continue pre-pacing beat by beat")
+        x_start = x0
+
+    model = model.clone()
+    model.set_state(x_start)
+    state, beats, res = prepace(
+        model,
+        bcl,
+        duration,
+        offset,
+        level,
+        num_beats,
+        tol=tol,
+        n_stable=n_stable,
+        scale_floor=scale_floor,
+    )
+    return state, count_beats[0] + beats, res
+
+
+def get_prepaced_state(
+    model,
+    model_file,
+    params,
+    bcl,
+    duration,
+    offset,
+    level,
+    num_beats,
+    tol=None,
+    n_stable=5,
+    scale_floor=1e-12,
+    method="pacing",
+    cache=True,
+):
+    """Get state of a single cell after pre-pacing, using an on-disk cache
+
+    The cache file is named after a hash of the model file contents, the
+    parameters, the pacing protocol and the pre-pacing settings. It is written
+    atomically, so runs on different nodes can share the cache directory.
+
+    Args:
+        model: myokit.Model loaded from model_file, with params already set
+        model_file: path of the mmt file of the model
+        params: dict of parameter values set in the model
+        bcl, duration, offset, level: pacing protocol (see
+            myokit.pacing.blocktrain)
+        num_beats, tol, n_stable, scale_floor: number of beats and
+            convergence criterion (see prepace)
+        method: "pacing" (prepace) or "shooting" (prepace_shooting)
+        cache: whether to read from and write to the cache
+
+    Returns:
+        tuple - state of the cell at the start of the next beat, and dict with
+            number of beats paced (beats) and final relative change in state
+            per beat (residual)
+    """
+
+    key = dict(
+        model=file_hash(model_file),
+        params=params,
+        protocol=[bcl, duration, offset, level],
+        num_beats=num_beats,
+        tol=tol,
+        method=method,
+    )
+    # n_stable and scale_floor only matter when pre-pacing stops on
+    # convergence (the fallback of shooting always does), so fixed-beat states
+    # share one cache file
+    if tol is not None or method == "shooting":
+        key["n_stable"] = n_stable
+        key["scale_floor"] = scale_floor
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+    name = os.path.splitext(os.path.basename(model_file))[0]
+    filepath = os.path.join(CACHE_DIR, "prepace", f"{name}-{digest[:16]}.json")
+
+    if cache and os.path.exists(filepath):
+        with open(filepath, "r") as fp:
+            data = json.load(fp)
+        return data["state"], dict(beats=data["beats"], residual=data["residual"])
+
+    if method == "pacing":
+        prepace_fun = prepace
+    elif method == "shooting":
+        prepace_fun = prepace_shooting
+    else:
+        raise ValueError(f"Unknown pre-pacing method {method}")
+    state, beats, residual = prepace_fun(
+        model,
+        bcl,
+        duration,
+        offset,
+        level,
+        num_beats,
+        tol=tol,
+        n_stable=n_stable,
+        scale_floor=scale_floor,
+    )
+
+    if cache:
+        # Write to a temporary file first so that concurrent runs never read a
+        # partially written file
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        filepath_tmp = f"{filepath}.{os.getpid()}.tmp"
+        with open(filepath_tmp, "w") as fp:
+            json.dump(dict(key, state=state, beats=beats, residual=residual), fp)
+        os.replace(filepath_tmp, filepath)
+
+    return state, dict(beats=beats, residual=residual)
+
+
+def prepace_population(
+    model,
+    param_sets,
+    bcl,
+    duration,
+    offset,
+    level,
+    num_beats,
+    engine="opencl",
+    dt=5e-3,
+    precision=64,
+):
+    """Pre-pace a population of cells with different parameter values at once
+
+    Each parameter set is simulated as an uncoupled cell of one multi-cell
+    simulation, with the parameters set as per-cell fields.
+
+    Args:
+        model: myokit.Model
+        param_sets: pd.DataFrame with one column per parameter (qname) and one
+            row per parameter set
+        bcl, duration, offset, level: pacing protocol (see
+            myokit.pacing.blocktrain)
+        num_beats: number of beats to pre-pace
+        engine: "opencl" (myokit.SimulationOpenCL) or "cpu" (SimulationCPU)
+        dt: time step
+        precision: precision of OpenCL simulation (32 or 64)
+
+    Returns:
+        pd.DataFrame - state of each cell at the start of the next beat, with
+            the index of param_sets and one column per state (qname)
+    """
+
+    # Parameters must be literal constants to be set as fields (as they are in
+    # a model after set_value)
+    model = model.clone()
+    for qname in param_sets.columns:
+        model.get(qname).set_rhs(float(param_sets[qname].iloc[0]))
+
+    ncells = len(param_sets)
+    p_pre = myokit.pacing.blocktrain(bcl, duration, offset=offset, level=level)
+    if engine == "cpu":
+        s = SimulationCPU(model, p_pre, ncells=ncells)
+    else:
+        s = myokit.SimulationOpenCL(
+            model, p_pre, ncells=ncells, diffusion=False, precision=precision
+        )
+    s.set_step_size(dt)
+    s.set_paced_cell_list(list(range(ncells)))
+    for qname in param_sets.columns:
+        s.set_field(model.get(qname), param_sets[qname].values.astype(float))
+
+    s.pre(num_beats * bcl)
+
+    states = np.array(s.default_state()).reshape(ncells, model.count_states())
+    columns = [var.qname() for var in model.states()]
+
+    return pd.DataFrame(states, index=param_sets.index, columns=columns)
+
+
+def get_population_states(
+    model,
+    model_file,
+    param_sets,
+    bcl,
+    duration,
+    offset,
+    level,
+    num_beats,
+    engine="opencl",
+    dt=5e-3,
+    precision=64,
+    cache=True,
+):
+    """Get state table of a pre-paced population, using an on-disk cache
+
+    Args:
+        model, param_sets, bcl, duration, offset, level, num_beats, engine, dt,
+            precision: see prepace_population
+        model_file: path of the mmt file of the model
+        cache: whether to read from and write to the cache
+
+    Returns:
+        pd.DataFrame - the columns of param_sets followed by the state of each
+            cell (see prepace_population)
+    """
+
+    key = dict(
+        model=file_hash(model_file),
+        param_sets=param_sets.to_json(orient="split"),
+        protocol=[bcl, duration, offset, level],
+        num_beats=num_beats,
+        engine=engine,
+        dt=dt,
+    )
+    # Precision is only used by the OpenCL engine
+    if engine != "cpu":
+        key["precision"] = precision
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+    name = os.path.splitext(os.path.basename(model_file))[0]
+    filepath = os.path.join(
+        CACHE_DIR, "prepace", f"{name}-population-{digest[:16]}.csv"
+    )
+
+    if cache and os.path.exists(filepath):
+        return pd.read_csv(filepath, index_col=0, float_precision="round_trip")
+
+    states = prepace_population(
+        model,
+        param_sets,
+        bcl,
+        duration,
+        offset,
+        level,
+        num_beats,
+        engine=engine,
+        dt=dt,
+        precision=precision,
+    )
+    table = pd.concat([param_sets, states], axis=1)
+
+    if cache:
+        # Write to a temporary file first so that concurrent runs never read a
+        # partially written file
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        filepath_tmp = f"{filepath}.{os.getpid()}.tmp"
+        table.to_csv(filepath_tmp)
+        os.replace(filepath_tmp, filepath)
+
+    return table
+
+
+def find_state(table, model, params):
+    """Get the state for given parameter values from a state table
+
+    Args:
+        table: pd.DataFrame from get_population_states
+        model: myokit.Model
+        params: dict of parameter values (qname: value)
+
+    Returns:
+        list - state of the first row of table matching all values in params,
+            or None if there is no such row
+    """
+
+    match = np.ones(len(table), dtype=bool)
+    for qname, value in params.items():
+        if qname not in table.columns:
+            return None
+        match &= np.isclose(table[qname].values, value, rtol=1e-9, atol=0)
+    if not match.any():
+        return None
+
+    row = table[match].iloc[0]
+    return [float(row[var.qname()]) for var in model.states()]
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18 October, 2026
+
+Pre-pace the ORd model for all combinations of channel conductance
+multipliers at once, as uncoupled cells of one simulation.
+Writes a state table that sim_branch.py reads with --state_table.
+
+@author: tbury
+"""
+
+import pandas as pd
+import os
+import itertools
+import time
+
+import myokit as myokit
+
+import tyro
+from dataclasses import dataclass
+from typing import Tuple
+
+from prepace import get_population_states
+
+import datetime
+import pytz
+
+import json
+
+# Get date and time in zone ET
+newYorkTz = pytz.timezone("America/New_York")
+datetime_now = datetime.datetime.now(newYorkTz).strftime("%Y%m%d-%H%M%S")
+
+
+### Define command line arguments
+@dataclass
+class Args:
+    run_name: str = "mac"
+    """name of the run"""
+    engine: str = "opencl"
+    """simulation engine: opencl (myokit.SimulationOpenCL) or cpu (SimulationCPU in engine.py)"""
+    dt: float = 5e-3
+    """integration time step"""
+    num_beats: int = 1000
+    """number of beats to pre-pace"""
+
+    # Values of multipliers (all combinations are pre-paced)
+    ina_mult: Tuple[float, ...] = (1,)
+    """multipliers of inward sodium current conductance"""
+    ical_mult: Tuple[float, ...] = (1,)
+    """multipliers of L-type calcium current permeability"""
+    ikr_mult: Tuple[float, ...] = (1,)
+    """multipliers of rapid late potassium current conductance"""
+    iks_mult: Tuple[float, ...] = (1,)
+    """multipliers of slow late potassium current conductance"""
+    tjca_mult: Tuple[float, ...] = (1,)
+    """multipliers of relaxation time of L-type Ca current"""
+    ito_mult: Tuple[float, ...] = (1,)
+    """multipliers of transient outward current conductance"""
+    inaca_mult: Tuple[float, ...] = (1,)
+    """multipliers of sodium calcium exchange current conductance"""
+
+
+# Get CLI arguments
+args = tyro.cli(Args)
+print(args)
+
+# Export config data
+dir_name = f"output_population/{datetime_now}-{args.run_name}/"
+os.makedirs(dir_name, exist_ok=True)
+json.dump(vars(args), open(dir_name + "config.json", "w"))
+
+
+# ----------------
+# Cell model
+# ----------------
+
+# Load in model from mmt file
+model_file = "../mmt_files/ord-2011_1d.mmt"
+m = myokit.load_model(model_file)
+
+# Dictionary to map to param labels used in Torord
+dict_par_labels = {
+    "ina": "ina.GNa",  # inward sodium current
+    "ito": "ito.Gto",  # transient outward current
+    "ical": "ical.PCa",  # L-type calcium current
+    "ikr": "ikr.GKr",  # Rapid late potassium current
+    "iks": "iks.GKs",  # Slow late potassium current
+    "inaca": "inaca.Gncx",  # sodium calcium exchange current
+    "tjca": "ical.tjca",  # relaxation time of L-type Ca current
+}
+
+# Get default parameter values used in Ord (required to apply multipliers)
+params_default = {
+    par: m.get(dict_par_labels[par]).value() for par in dict_par_labels.keys()
+}
+
+# Parameter values of each combination of multipliers, computed as in
+# sim_branch.py so that rows can be matched to its parameters
+dict_mults = {par: getattr(args, f"{par}_mult") for par in dict_par_labels.keys()}
+list_dict = []
+for mults in itertools.product(*dict_mults.values()):
+    list_dict.append(
+        {
+            dict_par_labels[par]: params_default[par] * mult
+            for par, mult in zip(dict_mults.keys(), mults)
+        }
+    )
+param_sets = pd.DataFrame(list_dict)
+print("Pre-pace {} parameter sets".format(len(param_sets)))
+
+# Create pacing protocol (as in sim_branch.py)
+bcl = 1000  # Pacing cycle length for cell
+duration = 1  # Duration of impulse (ms)
+level = 1  # Level of stimulus (1=full)
+offset = 15
+
+tic = time.perf_counter()
+table = get_population_states(
+    m,
+    model_file,
+    param_sets,
+    bcl=bcl,
+    duration=duration,
+    offset=offset,
+    level=level,
+    num_beats=args.num_beats,
+    engine=args.engine,
+    dt=args.dt,
+)
+toc = time.perf_counter()
+print(f"Pre-pacing took {toc - tic:0.4f} seconds")
+
+# Add multipliers to table for reference
+for par in reversed(list(dict_mults.keys())):
+    table.insert(0, f"{par}_mult", table[dict_par_labels[par]] / params_default[par])
+
+table.to_csv(dir_name + "state_table.csv")
+print("State table written to {}".format(dir_name + "state_table.csv"))
@@ -6,6 +6,13 @@
 declare -a W2_VALS=(5)
 declare -a THETA_VALS=(45)
 
+# Set BATCH=1 to simulate the whole grid in one process (batch mode)
+if [ "${BATCH:-0}" = "1" ]; then
+        echo "Running batch job for THETA=(${THETA_VALS[*]}), w2=(${W2_VALS[*]}), stim left"
+        python -u sim_branch.py --thetas ${THETA_VALS[@]} --w2s ${W2_VALS[@]} --double_precision --log_interval 0.1 --no-save_voltage_data
+        exit 0
+fi
+
 # for ((THETA=10; THETA<=170; THETA+=5)); do
 for THETA in "${W2_VALS[@]}"; do
 	for W2 in "${W2_VALS[@]}"; do
@@ -22,13 +22,23 @@ import myokit as myokit
 
 import tyro
 from dataclasses import dataclass
+from typing import Tuple
 
+from engine import SimulationCPU
+from distributed import SimulationDistributed
+from prepace import get_prepaced_state, find_state
+from instrument import get_instrumented_model, initial_state, activation_map
 from funs import (
     mesh_single_branch,
     mesh_single_branch_2,
-    get_connections,
     mesh_double_branch,
     mesh_double_branch_2,
+    get_geometry,
+    edges_to_connections,
+    cells_in,
+    check_connected,
+    stack_geometries,
+    row_partition,
 )
 
 import datetime
@@ -56,6 +66,38 @@ class Args:
     """time to run simulation up to"""
     double_precision: bool = False
     """whether to run OpenCL with 64-bit precision (doulbe) or 32-bit (single)"""
+    engine: str = "opencl"
+    """simulation engine: opencl (myokit.SimulationOpenCL), cpu (SimulationCPU in engine.py) or distributed (SimulationDistributed in distributed.py)"""
+    cpu_backend: str = "numpy"
+    """right-hand side kernel of the cpu engine: numpy or numba (see codegen.py)"""
+    cpu_integrator: str = "euler"
+    """time stepping of the cpu engine: euler, or rush_larsen for the exact exponential update of gating variables (see codegen.py)"""
+    cpu_diffusion: str = "explicit"
+    """diffusion step of the cpu engine: explicit, or backward_euler or crank_nicolson for an implicit step, stable for any conductance"""
+    cpu_diffusion_solver: str = "splu"
+    """solver of the implicit diffusion step: splu (factorized once) or cg (for very large meshes)"""
+    cpu_adaptive_tol: float = 0
+    """tolerance on the voltage error per step for adaptive steps of the cpu engine, with dt the smallest step (0 for fixed steps)"""
+    cpu_max_step: float = 0
+    """largest adaptive step of the cpu engine (0 for 64 dt)"""
+    cpu_precision: str = "double"
+    """precision of the cpu engine: double, single, or mixed (float32 gates and diffusion)"""
+    cpu_threads: int = 1
+    """number of threads of the cpu engine, each owning a band of mesh rows (default one: scaling over cores is unmeasured, see simulate_ord/bench_threads.py)"""
+    cpu_procs: int = 4
+    """number of processes of the distributed engine, each owning a partition of the cells"""
+    cpu_active_tol: float = 0
+    """distance of the membrane potential from rest (in mV, e.g. 0.5) below which cells of the cpu engine take coarse steps, unless driven by diffusion (0 to step all cells; only for meshes above about 5000 cells, where it breaks even in bench_active_set.py, with renumber rcm to keep the active cells in a compact range)"""
+    cpu_coarse_steps: int = 8
+    """number of steps per step of the cells at rest of the cpu engine"""
+    prepace_tol: float = 0
+    """stop pre-pacing once the relative change in state per beat stays below this (0 to pace all 1000 beats)"""
+    prepace_n_stable: int = 5
+    """number of consecutive beats below prepace_tol required to stop pre-pacing"""
+    prepace_scale_floor: float = 1e-12
+    """smallest magnitude the change in each state is relative to when checking prepace_tol (raise for models with states resting at 0)"""
+    prepace_method: str = "pacing"
+    """pre-pacing method: pacing (beat by beat) or shooting (Newton-Krylov, see prepace.py)"""
     dt: float = 5e-3
     """integration time step. 2e-3 or 5e-3 - smaller dt more stable"""
 
@@ -69,10 +111,34 @@ class Args:
     """width of diagonal channel"""
     theta: int = 60
     """angle of diagonal channel"""
+    thetas: Tuple[int, ...] = ()
+    """batch mode: angles to simulate together in one simulation (overrides theta)"""
+    w2s: Tuple[int, ...] = ()
+    """batch mode: widths to simulate together in one simulation (overrides w2)"""
     scale_up: int = 1
     """parameter to scale up all length parameters of geometry"""
+    prune: bool = True
+    """whether to remove cells not connected to the paced region"""
+    renumber: str = "none"
+    """renumber cells for memory locality before simulating (none, rcm or morton)"""
 
     # Ord parametes
+    ina_mult: float = 1
+    """multiplier of inward sodium current conductance"""
+    ical_mult: float = 1
+    """multiplier of L-type calcium current permeability"""
+    ikr_mult: float = 1
+    """multiplier of rapid late potassium current conductance"""
+    iks_mult: float = 1
+    """multiplier of slow late potassium current conductance"""
+    tjca_mult: float = 1
+    """multiplier of relaxation time of L-type Ca current"""
+    ito_mult: float = 1
+    """multiplier of transient outward current conductance"""
+    inaca_mult: float = 1
+    """multiplier of sodium calcium exchange current conductance"""
+    state_table: str = ""
+    """csv file of pre-paced states from prepace_population.py, used instead of pre-pacing if it has these multipliers"""
     conductance: float = 2
     """Cell-to-cell conductance g, resulting in a current sum(g*(v_k-v)))"""
 
@@ -85,6 +151,18 @@ class Args:
     """left location of where to record activation time"""
     x2: int = 120
     """right location of where to record activation time"""
+    probes: Tuple[int, ...] = ()
+    """additional locations where to record activation time"""
+    probes_only: bool = False
+    """only log the cells at x1, x2 and probes instead of all cells"""
+    field_stride: int = 0
+    """with probes_only, also log every field_stride-th row and column of the mesh, e.g. for figures (0 for none)"""
+    activation_map: bool = False
+    """record activation times in state variables of the model (see instrument.py) and save the activation map of all cells"""
+    chunk: float = 0
+    """run in chunks of this duration, stopping once x2 has activated (plus stop_margin) or conduction is blocked (0 to always run to tmax)"""
+    stop_margin: float = 320
+    """time to keep running after x2 has activated when running in chunks, to record repolarisation at x2 (APD90 of a single cell about 300 ms)"""
     active_thresh: float = 0
     """threshold in state variable to register as active"""
 
@@ -94,52 +172,142 @@ args = tyro.cli(Args)
 args.open_cl_precision = 64 if args.double_precision else 32
 print(args)
 
-# Export config data
-dir_name = f"output/{datetime_now}-{args.run_name}/"
-os.makedirs(dir_name, exist_ok=True)
-json.dump(vars(args), open(dir_name + "config.json", "w"))
-
+# Options of the cpu engine that the distributed engine does not support
+if args.engine == "distributed":
+    unsupported = dict(
+        cpu_diffusion="explicit",
+        cpu_diffusion_solver="splu",
+        cpu_precision="double",
+        cpu_threads=1,
+        cpu_adaptive_tol=0,
+        cpu_max_step=0,
+        cpu_active_tol=0,
+    )
+    for name, default in unsupported.items():
+        if getattr(args, name) != default:
+            raise ValueError(
+                f"--{name} {getattr(args, name)} is not supported by the distributed"
+                f" engine (only {default})"
+            )
 
 # ----------------
 # Geometry
 # ---------------
 
-# Create cell mesh that defines geometry
-cell_mesh = mesh_single_branch_2(
-    l1=args.l1 * args.scale_up,
-    w1=args.w1 * args.scale_up,
-    h=args.h * args.scale_up,
-    w2=args.w2 * args.scale_up,
-    theta=args.theta,
-)
+# Rows of the horizontal channel
+row_start = args.h * args.scale_up
+row_stop = args.h * args.scale_up + args.w1 * args.scale_up
+rows = np.s_[row_start:row_stop]
+
+# Geometries to simulate. In batch mode (thetas and/or w2s given), all
+# combinations are combined into one simulation of disconnected geometries.
+batch = len(args.thetas) > 0 or len(args.w2s) > 0
+list_points = []
+for theta in args.thetas or [args.theta]:
+    for w2 in args.w2s or [args.w2]:
+        # Create cell mesh that defines geometry (loaded from cache if already built)
+        geometry = get_geometry(
+            "mesh_single_branch_2",
+            scale_up=args.scale_up,
+            l1=args.l1,
+            w1=args.w1,
+            h=args.h,
+            w2=w2,
+            theta=theta,
+            prune_from=(
+                [row_start, row_stop, 0, args.stim_width] if args.prune else None
+            ),
+            renumber=args.renumber,
+        )
+        if args.prune:
+            print(
+                f"theta={theta}, w2={w2}: removed {geometry['n_pruned']} cells "
+                "not connected to the paced region"
+            )
+
+        # Label image of cell indices (-1 for no cell)
+        labels = geometry["labels"]
+
+        # Define which cells to pace
+        # Apply stim on the left
+        # if not args.stim_right:
+        region_pace = (rows, np.s_[: args.stim_width])
+
+        # # if stim on the right
+        # else:
+        #     region_pace = (rows, np.s_[labels.shape[1] - args.stim_width :])
+
+        cells_pace = cells_in(labels, region_pace)
+
+        # Cells at which to record activation time
+        cells_x1 = cells_in(labels, (rows, args.x1))
+        cells_x2 = cells_in(labels, (rows, args.x2))
+        cells_probes = [cells_in(labels, (rows, x)) for x in args.probes]
+
+        # Fail before simulating if the probes cannot be reached from the paced cells
+        check_connected(
+            geometry,
+            cells_pace,
+            dict(
+                {"x1": cells_x1, "x2": cells_x2},
+                **{f"x={x}": cells for x, cells in zip(args.probes, cells_probes)},
+            ),
+        )
+
+        # Cells to log: all cells, or only the probes and the coarse field
+        if args.probes_only:
+            coords = geometry["coords"]
+            cells_field = np.array([], dtype=np.int32)
+            if args.field_stride > 0:
+                cells_field = np.nonzero(
+                    (coords[:, 0] % args.field_stride == 0)
+                    & (coords[:, 1] % args.field_stride == 0)
+                )[0]
+            cells_log = np.unique(
+                np.concatenate([cells_x1, cells_x2, *cells_probes, cells_field])
+            )
+        else:
+            cells_log = np.arange(len(geometry["coords"]))
+
+        list_points.append(
+            dict(
+                theta=theta,
+                w2=w2,
+                geometry=geometry,
+                cells_pace=cells_pace,
+                cells_x1=cells_x1,
+                cells_x2=cells_x2,
+                cells_probes=cells_probes,
+                cells_log=cells_log,
+            )
+        )
+
+
+def export_config():
+    """Write config data to the output directory of each geometry"""
+    for point in list_points:
+        config = dict(vars(args), theta=point["theta"], w2=point["w2"])
+        json.dump(config, open(point["dir_name"] + "config.json", "w"))
+
+
+# Export config data (one output directory per geometry in batch mode)
+for point in list_points:
+    suffix = f"-theta{point['theta']}-w2{point['w2']}" if batch else ""
+    point["dir_name"] = f"output/{datetime_now}-{args.run_name}{suffix}/"
+    os.makedirs(point["dir_name"], exist_ok=True)
+export_config()
+
+# Number cells of all geometries consecutively, giving one disconnected network
+offsets, src, dst = stack_geometries([point["geometry"] for point in list_points])
 
 # Count the number of cells
-args.ncells = int(cell_mesh.sum())
-
-# Get connections
-pos_to_index, connections = get_connections(cell_mesh, conductance=args.conductance)
-index_to_pos = {value: key for key, value in pos_to_index.items()}
-
-# Define which cells to pace
-list_coords_pace = []
-
-# Apply stim on the left
-# if not args.stim_right:
-for y in np.arange(
-    args.h * args.scale_up, args.h * args.scale_up + args.w1 * args.scale_up
-):
-    for x in range(args.stim_width):
-        list_coords_pace.append((y, x))
-
-# # if stim on the right
-# else:
-#     for y in np.arange(args.h, args.h + args.w1):
-#         for x in np.arange(cell_mesh.shape[1] - args.stim_width, cell_mesh.shape[1]):
-#             list_coords_pace.append((y, x))
+args.ncells = int(offsets[-1])
 
-list_cells_pace = []
-for coord in list_coords_pace:
-    list_cells_pace.append(pos_to_index[coord])
+# Connections and paced cells of all geometries
+connections = edges_to_connections(src, dst, conductance=args.conductance)
+list_cells_pace = np.concatenate(
+    [point["cells_pace"] + offset for point, offset in zip(list_points, offsets)]
+).tolist()
 
 
 # ----------------
@@ -147,7 +315,8 @@ for coord in list_coords_pace:
 # ----------------
 
 # Load in model from mmt file
-m = myokit.load_model("../mmt_files/ord-2011_1d.mmt")
+model_file = "../mmt_files/ord-2011_1d.mmt"
+m = myokit.load_model(model_file)
 
 # Ord parameters
 
@@ -172,13 +341,13 @@ params_default = {
 params = {}
 
 # Channel conductance multipliers
-ina_mult = 1
-ical_mult = 1
-ikr_mult = 1
-iks_mult = 1
-tjca_mult = 1
-ito_mult = 1
-inaca_mult = 1
+ina_mult = args.ina_mult
+ical_mult = args.ical_mult
+ikr_mult = args.ikr_mult
+iks_mult = args.iks_mult
+tjca_mult = args.tjca_mult
+ito_mult = args.ito_mult
+inaca_mult = args.inaca_mult
 
 
 params[dict_par_labels["ina"]] = params_default["ina"] * ina_mult
@@ -196,9 +365,6 @@ duration = 1  # Duration of impulse (ms)
 level = 1  # Level of stimulus (1=full)
 offset = 15
 
-# Pre-pacing protocol for each cell
-p_pre = myokit.pacing.blocktrain(bcl, duration, offset=offset, level=level)
-
 # Pacing protocol for simulation
 p = myokit.Protocol()
 p.schedule(level, offset, duration)
@@ -214,24 +380,89 @@ for key in params.keys():
     except:
         "{} is not a valid parameter".format(key)
 
-# Prepacing of single cell to set initial condition
-s_cell = myokit.Simulation(m, p_pre)
+# Prepacing of single cell to set initial condition, taken from the state table
+# if given, otherwise loaded from cache if already done for this model,
+# parameters and protocol
 num_beats_pre = 1000
-print("Run pre-pacing of {} beats for single cell".format(num_beats_pre))
-s_cell.pre(num_beats_pre * bcl)
-print("Pre-pacing of single cell finished")
-
-# Get current state of cell to use as IC for cable simulation
-state0 = s_cell.default_state()
-
-print("Make OpenCL simulation object")
-s = myokit.SimulationOpenCL(
-    m,
-    p,
-    ncells=args.ncells,
-    diffusion=True,
-    precision=args.open_cl_precision,  # precision 64 required for ord to be stable
-)
+state0 = None
+if args.state_table:
+    table = pd.read_csv(args.state_table, index_col=0, float_precision="round_trip")
+    state0 = find_state(table, m, params)
+    info_pre = dict(beats=None, residual=None)
+    print("Pre-paced state found in state table: {}".format(state0 is not None))
+if state0 is None:
+    print("Run pre-pacing of up to {} beats for single cell".format(num_beats_pre))
+    state0, info_pre = get_prepaced_state(
+        m,
+        model_file,
+        params,
+        bcl=bcl,
+        duration=duration,
+        offset=offset,
+        level=level,
+        num_beats=num_beats_pre,
+        tol=args.prepace_tol or None,
+        n_stable=args.prepace_n_stable,
+        scale_floor=args.prepace_scale_floor,
+        method=args.prepace_method,
+    )
+    print("Pre-pacing of single cell finished after {} beats".format(info_pre["beats"]))
+
+# Record number of beats and final change in state per beat in config data
+args.prepace_beats = info_pre["beats"]
+args.prepace_residual = info_pre["residual"]
+export_config()
+
+# Add activation time states to the model, recording activation times of all
+# cells during the simulation
+if args.activation_map:
+    m = get_instrumented_model(m, args.active_thresh)
+    state0 = initial_state(state0)
+
+if args.engine == "cpu":
+    print("Make CPU simulation object")
+    s = SimulationCPU(
+        m,
+        p,
+        ncells=args.ncells,
+        backend=args.cpu_backend,
+        integrator=args.cpu_integrator,
+        diffusion=args.cpu_diffusion,
+        diffusion_solver=args.cpu_diffusion_solver,
+        precision=args.cpu_precision,
+        nthreads=args.cpu_threads,
+    )
+    s.set_adaptive(args.cpu_adaptive_tol or None, args.cpu_max_step or None)
+    coords_stacked = np.concatenate(
+        [point["geometry"]["coords"] for point in list_points]
+    )
+    s.set_partition(row_partition(coords_stacked, args.cpu_threads))
+    if args.cpu_active_tol:
+        # Only step cells near the wave with dt, at rest in the pre-paced state
+        s.set_active_set(
+            state0[m.label("membrane_potential").index()],
+            args.cpu_active_tol,
+            coarse_steps=args.cpu_coarse_steps,
+        )
+elif args.engine == "distributed":
+    print("Make distributed CPU simulation object")
+    s = SimulationDistributed(
+        m,
+        p,
+        ncells=args.ncells,
+        nprocs=args.cpu_procs,
+        backend=args.cpu_backend,
+        integrator=args.cpu_integrator,
+    )
+else:
+    print("Make OpenCL simulation object")
+    s = myokit.SimulationOpenCL(
+        m,
+        p,
+        ncells=args.ncells,
+        diffusion=True,
+        precision=args.open_cl_precision,  # precision 64 required for ord to be stable
+    )
 
 s.set_connections(connections)
 # can check connections using s._connections
@@ -249,13 +480,75 @@ tic = time.perf_counter()
 # Set up progress printer (-1 for update every 10%)
 w = myokit.ProgressPrinter(digits=-1)
 
+
+def update_status(log, i_start, v_end):
+    """
+    Update conduction status of each geometry from log entries i_start onwards
+    and the voltage v_end of all cells at the end of the run.
+    A geometry is resolved once x2 has activated (plus stop_margin), or once
+    no cell is active anymore after the wave started (conduction block).
+    """
+
+    times = np.array(log["engine.time"][i_start:])
+    for point, offset in zip(list_points, offsets):
+        if point["stop_reason"] is not None:
+            continue
+        cells_log = point["cells_log"]
+        v = np.array(
+            [log["{}.membrane.V".format(offset + i)][i_start:] for i in cells_log]
+        )
+        active_end = v_end[offset : offset + len(point["geometry"]["coords"])]
+        active_end = active_end > args.active_thresh
+        point["started"] = (
+            point["started"] or (v > args.active_thresh).any() or active_end.any()
+        )
+        v_x2 = v[np.searchsorted(cells_log, point["cells_x2"])]
+        active_x2 = v_x2.mean(axis=0) > args.active_thresh
+        if point["t_x2"] is None and active_x2.any():
+            point["t_x2"] = times[np.argmax(active_x2)]
+        if point["t_x2"] is not None:
+            if times[-1] >= point["t_x2"] + args.stop_margin:
+                point["stop_reason"] = "activated"
+        elif point["started"] and not active_end.any():
+            point["stop_reason"] = "block"
+
+    return all(point["stop_reason"] is not None for point in list_points)
+
+
+for point in list_points:
+    point.update(started=False, t_x2=None, stop_reason=None)
+
+# Index of the membrane potential in the state of a cell
+iv = m.get("membrane.V").index()
+
+# Chunks are a whole number of log intervals, to keep log times evenly spaced
+chunk = np.ceil(args.chunk / args.log_interval) * args.log_interval
+
 print("Run sim")
-log = s.run(
-    args.tmax,
-    log_interval=args.log_interval,
-    log=["engine.time", "membrane.V"],
-    progress=w,
-)
+log = ["engine.time", "membrane.V"]
+if args.probes_only:
+    log = ["engine.time"] + [
+        "{}.membrane.V".format(offset + i)
+        for point, offset in zip(list_points, offsets)
+        for i in point["cells_log"]
+    ]
+    print("Log {} of {} cells".format(len(log) - 1, args.ncells))
+if chunk == 0:
+    log = s.run(args.tmax, log_interval=args.log_interval, log=log, progress=w)
+    t_sim = args.tmax
+else:
+    t_sim, i_start = 0, 0
+    while t_sim < args.tmax - 1e-9:
+        # Continue the log of the previous chunk
+        t_chunk = min(chunk, args.tmax - t_sim)
+        log = s.run(t_chunk, log_interval=args.log_interval, log=log, progress=w)
+        t_sim += t_chunk
+        print("Simulated up to t={}".format(round(t_sim, 3)))
+        # Voltage of all cells at the end of the chunk (cell-major state)
+        v_end = np.array(s.state()).reshape(args.ncells, -1)[:, iv]
+        if update_status(log, i_start, v_end):
+            break
+        i_start = len(log["engine.time"])
 
 # # Save full data log as binary file
 # log.save(dir_name + "datalog", precision=64)
@@ -270,28 +563,17 @@ log = s.run(
 #     meta=False,
 # )
 
-# Datalog to pd.DataFrame
-dic = {"time": np.array(log["engine.time"])}
-for i in np.arange(0, args.ncells):
-    dic["cell {}".format(i)] = log["{}.membrane.V".format(i)]
-df = pd.DataFrame(dic)
-
-filename = "df_voltage.csv"
-if args.save_voltage_data:
-    df.to_csv(dir_name + filename, index=False)
-
 # ----------
-# Compute conduction time between x1 and x2
+# Split log into the geometries and compute conduction time between x1 and x2
 # ----------
 
 
-def get_active_time(list_coords):
+def get_active_time(df, geometry, list_idx):
     """
-    Compute first activation time of cells at cell_coords (averaged)
+    Compute first activation time of cells with indices list_idx (averaged)
     """
 
-    list_idx = [pos_to_index[coord] for coord in list_coords]
-    list_cols = ["time"] + [f"cell {idx}" for idx in list_idx]
+    list_cols = ["time"] + [f"cell {idx}" for idx in geometry["order"][list_idx]]
     df_left = df[list_cols]
     # Take mean over each cell at these positions
     series_v = df_left.set_index("time").mean(axis=1)
@@ -305,24 +587,58 @@ def get_active_time(list_coords):
         return active_times[0]
 
 
-yvals = np.arange(
-    args.h * args.scale_up, args.h * args.scale_up + args.w1 * args.scale_up
-)
-
-# Left activation
-list_coords = [(y, args.x1) for y in yvals]
-active_time_left = get_active_time(list_coords)
-
-# Right activation
-list_coords = [(y, args.x2) for y in yvals]
-active_time_right = get_active_time(list_coords)
-
-# Export activation times
-dict_active_times = dict(
-    active_left=str(round(active_time_left, 3)),
-    active_right=str(round(active_time_right, 3)),
-)
-json.dump(dict_active_times, open(dir_name + "active_times.json", "w"))
+if args.activation_map:
+    # Activation and repolarization time of all cells, from the final state
+    df_map_all = activation_map(m, s.state(), args.ncells)
+
+for point, offset in zip(list_points, offsets):
+    geometry = point["geometry"]
+    dir_name = point["dir_name"]
+
+    # Datalog to pd.DataFrame of the logged cells
+    # (columns are labelled by the raster-order index of each cell in the
+    # unpruned mesh, undoing any pruning and renumbering)
+    cells_log = point["cells_log"]
+    dic = {"time": np.array(log["engine.time"])}
+    for i in cells_log[np.argsort(geometry["order"][cells_log])]:
+        dic["cell {}".format(geometry["order"][i])] = log[
+            "{}.membrane.V".format(offset + i)
+        ]
+    df = pd.DataFrame(dic)
+
+    filename = "df_voltage.csv"
+    if args.save_voltage_data:
+        df.to_csv(dir_name + filename, index=False)
+
+    # Left activation
+    active_time_left = get_active_time(df, geometry, point["cells_x1"])
+
+    # Right activation
+    active_time_right = get_active_time(df, geometry, point["cells_x2"])
+
+    # Export activation times
+    dict_active_times = dict(
+        active_left=str(round(active_time_left, 3)),
+        active_right=str(round(active_time_right, 3)),
+        active_probes={
+            str(x): str(round(get_active_time(df, geometry, cells), 3))
+            for x, cells in zip(args.probes, point["cells_probes"])
+        },
+        stop_reason=point["stop_reason"] or "tmax",
+        t_sim=round(t_sim, 3),
+    )
+    json.dump(dict_active_times, open(dir_name + "active_times.json", "w"))
+
+    if args.activation_map:
+        # Activation map of this geometry, by raster-order index of each cell
+        # in the unpruned mesh and its position
+        ncells_point = len(geometry["coords"])
+        df_map = df_map_all.iloc[offset : offset + ncells_point].copy()
+        df_map.insert(0, "cell", geometry["order"])
+        df_map.insert(1, "row", geometry["coords"][:, 0])
+        df_map.insert(2, "col", geometry["coords"][:, 1])
+        df_map = df_map.sort_values("cell")
+        df_map.to_csv(dir_name + "activation_map.csv", index=False)
 
 # ---------
 # reset simulation
@@ -27,7 +27,7 @@ source $SLURM_TMPDIR/venv/bin/activate
 echo Install python packages
 pip install --no-index --upgrade pip
 #pip install --no-index -r /home/tbury/projects/def-glass/tbury/torord-sims/requirements.txt
-pip install --no-index pandas numpy
+pip install --no-index pandas numpy scipy
 # pip install git+https://github.com/MichaelClerx/myokit.git
 #pip install myokit==1.33.0
 pip install --no-index myokit
@@ -39,16 +39,17 @@ pip install --no-index tyro
 # echo "Running job for THETA=$THETA, w2=$W2"
 # python -u sim_branch.py --run_name id$SLURM_JOB_ID --theta $THETA --w2=$W2 --double_precision
 
-declare -a THETA_VALS=(150 135 120);
-declare -a W2_VALS=(5 10 15);
+# Grid of values, unless given by run_multi_cedar.sh
+declare -a THETA_VALS=(${THETA:-150 135 120});
+declare -a W2_VALS=(${W2:-5 10 15});
 
-# for ((THETA=10; THETA<=170; THETA+=5)); do
-for THETA in "${THETA_VALS[@]}"; do
-	for W2 in "${W2_VALS[@]}"; do
-
-        echo "Running job for THETA=$THETA, w2=$W2"
-        python -u sim_branch.py --run_name id$SLURM_JOB_ID --theta $THETA --w2=$W2 --double_precision
-
-	done
-done
+# A single point is simulated on its own, so its output directory has no
+# -theta..-w2.. suffix. Several points are simulated at once (batch mode)
+if [ ${#THETA_VALS[@]} -eq 1 ] && [ ${#W2_VALS[@]} -eq 1 ]; then
+	GRID_ARGS="--theta ${THETA_VALS[0]} --w2=${W2_VALS[0]}"
+else
+	GRID_ARGS="--thetas ${THETA_VALS[*]} --w2s ${W2_VALS[*]}"
+fi
 
+echo "Running job for THETA=(${THETA_VALS[*]}), w2=(${W2_VALS[*]})"
+python -u sim_branch.py --run_name id$SLURM_JOB_ID $GRID_ARGS --double_precision
